@@ -1,14 +1,23 @@
 import os
 import json
+import asyncio
 import ollama
 from logger_config import logger
 import pandas as pd # Importar pandas aqui para ler a tabela de preços
 import re # Adicionar import para regex
+from llm_cache import LlmCache, versao_prompt
+from metricas import contar_cache, medir
 # RAG: tentativa de import; fallback se indisponível
 try:
-    from rag_store import retrieve_similar
+    from rag_store import retrieve_similar, warm_up as rag_warm_up
 except Exception:
     retrieve_similar = None
+    rag_warm_up = None
+
+# Nos workers, RAG_WARMUP=true carrega o store RAG numa thread logo no import, para que o
+# primeiro e-mail não pague o carregamento do modelo de embeddings
+if rag_warm_up is not None and os.getenv("RAG_WARMUP", "false").lower() == "true":
+    rag_warm_up(background=True)
 
 # Carregar a tabela de preços para obter os destinos válidos
 try:
@@ -28,6 +37,84 @@ COLD_KEYWORDS = {
     "medicamento", "medicamentos", "vacina", "vacinas",
 }
 
+MODELO_LLM = "llama3"
+SYSTEM_PROMPT = "Você é um assistente especialista em logística e extração de dados. Retorne a resposta APENAS em formato JSON."
+
+# O prompt é montado como prefixo estático (system + instruções + demonstrações, byte a byte
+# igual em todos os pedidos) seguido da parte variável (contexto RAG + e-mail), para que o
+# Ollama reaproveite a cache KV do prefixo entre pedidos.
+PROMPT_EXTRACAO = """Instruções para extração de dados de e-mail:
+
+Objetivo: Extrair informações de transporte de carga de um e-mail e formatá-las em JSON.
+Extraia os dados **exatamente como aparecem no texto**, sem tentar converter ou validar.
+
+1.  **destino_texto**:
+    -   Identifique a **cidade principal de entrega em Portugal ou Europa**. Priorize sempre uma cidade conhecida.
+    -   Se o e-mail mencionar "Aeroporto de Lisboa", "Lisboa Aeroporto" ou similar para entrega, o destino deve ser **"Lisboa"**.
+    -   Ignore códigos de aeroporto (LIS, HAV), referências internas (JTM, Portway) ou nomes de países que não sejam Portugal ou países europeus vizinhos (como CUBA, que deve ser ignorado).
+    -   Extraia **apenas o nome da cidade** mais relevante para a cotação, mesmo que o email mencione um endereço completo, múltiplos pontos ou localidades de recolha (como "Pontinha").
+    -   **Exemplos:**
+        -   "Entrega: Aeroporto de Lisboa a/c JTM Destino - LIS / HAV - CUBA" -> "Lisboa"
+        -   "Morada: Rua X, 123, Porto" -> "Porto"
+        -   "Local entrega: 2951-503 Palmela" -> "Palmela"
+
+2.  **peso_texto**:
+    -   Identifique o peso total da carga, **exatamente como escrito**.
+    -   Ex: "83 kgs", "1.5 toneladas", "400 kg"
+
+3.  **volume_texto**:
+    -   Calcule o volume total da carga, **exatamente como escrito**.
+    -   Ex: "0,51", "0.51 m3", "3x3x5 metros", "45 m3" (se o contexto indicar metros cúbicos sem unidade explícita, apenas o número)
+
+4.  **tipo_transporte**:
+    -   Procure por termos que descrevam o veículo, como 'Pequeno', 'Médio', 'Camiao' ou 'Camiao Grande'.
+    -   Se não for especificado, o valor é `null`.
+
+5.  **temperatura**:
+    -   Verifique se há menção explícita de `frio` ou `frigorífico`.
+    -   Se sim, o valor é `frio`. Caso contrário, o valor é `ambiente`.
+
+6.  **Saída Final**:
+    -   Retorne a resposta **APENAS** em formato JSON, sem qualquer texto adicional ou explicação.
+    -   Use a seguinte estrutura de chaves: `"destino_texto": "...", "peso_texto": "...", "volume_texto": "...", "tipo_transporte": "...", "temperatura": "..."`.
+    -   Se uma informação não for encontrada, o valor correspondente é `null`.
+
+--- DEMONSTRATION EXAMPLE ---
+E-mail: "Preciso de transporte urgente de 8 toneladas para Albufeira, com dimensões de 3m x 3m x 5m e carga frigorífica."
+JSON Esperado:
+{"destino_texto": "Albufeira", "peso_texto": "8 toneladas", "volume_texto": "3m x 3m x 5m", "tipo_transporte": null, "temperatura": "frio"}
+--- FIM DO EXEMPLO ---
+
+--- NOVO EXEMPLO DE DEMONSTRAÇÃO ---
+E-mail: "Bom dia Ricardo,\nPor favor, confirmem valor e disponibilidade para a recolha abaixo:\nMorada da Recolha:\nMesclachoice\nCasal do Troca\nEstrada da Paiã\n1675-076 Pontinha\nData de Recolha: 02/09 às 14h30\nCarga:\nQty: 1 plt\nDms: 112x47x80 cm\nWght: 190 kg\nEntrega:\nAeroporto de Lisboa a/c JTM\nDestino - LIS / HAV - CUBA\nEntregar na Portway\nObrigada"
+JSON Esperado:
+{"destino_texto": "Lisboa", "peso_texto": "190 kg", "volume_texto": "112x47x80 cm", "tipo_transporte": null, "temperatura": "ambiente"}
+--- FIM DO NOVO EXEMPLO ---
+
+--- EXEMPLO DE COTAÇÃO PARA AEROPORTO ---
+E-mail: "Entrega: Aeroporto de Lisboa"
+JSON Esperado:
+{"destino_texto": "Lisboa", "peso_texto": null, "volume_texto": null, "tipo_transporte": null, "temperatura": "ambiente"}
+--- FIM DO EXEMPLO DE COTAÇÃO PARA AEROPORTO ---
+"""
+
+PROMPT_EMAIL = """
+Contexto interno (exemplos semelhantes de e-mails/cotações):
+{rag_context}
+
+E-mail a ser processado:
+---
+{corpo_email}
+---"""
+
+# Mantém o modelo carregado entre pedidos e limita o tamanho da resposta (JSON curto)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", 256))
+
+# Alterar o prompt ou o modelo muda a versão e invalida a cache de extrações
+PROMPT_VERSAO = versao_prompt(MODELO_LLM, SYSTEM_PROMPT, PROMPT_EXTRACAO, PROMPT_EMAIL, str(OLLAMA_NUM_PREDICT))
+_llm_cache = LlmCache(PROMPT_VERSAO)
+
 def _build_rag_context(corpo_email: str) -> str:
     """Obtém exemplos similares do RAG e formata um contexto textual.
     Se RAG não estiver disponível, retorna string vazia.
@@ -35,7 +122,8 @@ def _build_rag_context(corpo_email: str) -> str:
     try:
         if retrieve_similar is None:
             return ""
-        similares = retrieve_similar(corpo_email, top_k=3)
+        with medir("rag_retrieval"):
+            similares = retrieve_similar(corpo_email, top_k=3)
         if not similares:
             return ""
         linhas = []
@@ -145,152 +233,297 @@ def normalizar_volume(volume_str):
     logger.warning(f"Formato de volume '{volume_str}' não reconhecido.")
     return None
 
-def analisar_email(corpo_email):
+# --- Extração determinística (fast-path sem LLM) ---
+# Campos rotulados, um por linha, como "Peso (kgs): 800", "M3: 5", "Dms: 112x47x80 cm", "Entrega: Meimoa".
+# O destino pode vir na linha seguinte ao rótulo ("Entrega:\nAeroporto de Lisboa").
+_RE_PESO_ROTULADO = re.compile(
+    r"^\s*(?:peso|wght|weight)\s*(?:\(\s*(?P<unidade>[a-z]+)\s*\))?\s*[:=][ \t]*(?P<valor>[^\n]+?)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_RE_VOLUME_ROTULADO = re.compile(
+    r"^\s*(?:m3|m³|volume|dms|dimens(?:ões|oes|ions))\s*(?:\([^)\n]*\))?\s*[:=][ \t]*(?P<valor>[^\n]+?)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_RE_DESTINO_ROTULADO = re.compile(
+    r"^\s*(?:entrega|destino|local de entrega|morada de entrega)\s*[:=]\s*(?P<valor>[^\n]+?)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+_fast_path_stats = {"hits": 0, "misses": 0}
+
+def _valor_unico(regex, texto):
+    """Devolve o único valor capturado pelo regex (None se ausente ou ambíguo) e o match."""
+    matches = list(regex.finditer(texto))
+    valores = {m.group("valor").strip() for m in matches}
+    if len(valores) != 1:
+        return None, None
+    return valores.pop(), matches[0]
+
+def extrair_por_regras(corpo_email):
+    """Extração determinística para e-mails semi-estruturados.
+    Retorna `dados_brutos` no mesmo formato do LLM apenas quando destino, peso e volume
+    são encontrados sem ambiguidade, normalizam com sucesso e o destino existe na tabela.
+    Caso contrário retorna None (segue para o LLM).
     """
-    Usa o modelo Llama3 via Ollama para extrair dados estruturados de um e-mail,
-    e então normaliza esses dados com funções Python.
-    """
-    # RAG: contexto interno semelhante
-    rag_context = _build_rag_context(corpo_email)
+    texto = corpo_email or ""
 
-    prompt_llm = f"""Instruções para extração de dados de e-mail:
-
-Contexto interno (exemplos semelhantes de e-mails/cotações):
-{rag_context}
-
-Objetivo: Extrair informações de transporte de carga de um e-mail e formatá-las em JSON.
-Extraia os dados **exatamente como aparecem no texto**, sem tentar converter ou validar.
+    peso_texto, match_peso = _valor_unico(_RE_PESO_ROTULADO, texto)
+    volume_texto, _ = _valor_unico(_RE_VOLUME_ROTULADO, texto)
+    destino_texto, _ = _valor_unico(_RE_DESTINO_ROTULADO, texto)
+    if not (peso_texto and volume_texto and destino_texto):
+        return None
 
-1.  **destino_texto**:
-    -   Identifique a **cidade principal de entrega em Portugal ou Europa**. Priorize sempre uma cidade conhecida.
-    -   Se o e-mail mencionar "Aeroporto de Lisboa", "Lisboa Aeroporto" ou similar para entrega, o destino deve ser **"Lisboa"**.
-    -   Ignore códigos de aeroporto (LIS, HAV), referências internas (JTM, Portway) ou nomes de países que não sejam Portugal ou países europeus vizinhos (como CUBA, que deve ser ignorado).
-    -   Extraia **apenas o nome da cidade** mais relevante para a cotação, mesmo que o email mencione um endereço completo, múltiplos pontos ou localidades de recolha (como "Pontinha").
-    -   **Exemplos:**
-        -   "Entrega: Aeroporto de Lisboa a/c JTM Destino - LIS / HAV - CUBA" -> "Lisboa"
-        -   "Morada: Rua X, 123, Porto" -> "Porto"
-        -   "Local entrega: 2951-503 Palmela" -> "Palmela"
+    # Unidade no rótulo (ex.: "Peso (ton): 2") aplica-se a um valor sem unidade
+    unidade = (match_peso.group("unidade") or "").lower()
+    if unidade and re.fullmatch(r"[\d\.,]+", peso_texto):
+        peso_texto = f"{peso_texto} {unidade}"
 
-2.  **peso_texto**:
-    -   Identifique o peso total da carga, **exatamente como escrito**.
-    -   Ex: "83 kgs", "1.5 toneladas", "400 kg"
+    if normalizar_peso(peso_texto) is None or normalizar_volume(volume_texto) is None:
+        return None
 
-3.  **volume_texto**:
-    -   Calcule o volume total da carga, **exatamente como escrito**.
-    -   Ex: "0,51", "0.51 m3", "3x3x5 metros", "45 m3" (se o contexto indicar metros cúbicos sem unidade explícita, apenas o número)
+    destino = destino_texto.strip(" .,;").lower()
+    if "aeroporto de lisboa" in destino or "lisboa aeroporto" in destino:
+        destino = "lisboa"
+    if destino not in destinos_validos:
+        return None
 
-4.  **tipo_transporte**:
-    -   Procure por termos que descrevam o veículo, como 'Pequeno', 'Médio', 'Camiao' ou 'Camiao Grande'.
-    -   Se não for especificado, o valor é `null`.
+    texto_lower = texto.lower()
+    temperatura = "frio" if ("frio" in texto_lower or "frigor" in texto_lower) else "ambiente"
+    return {
+        "destino_texto": destino,
+        "peso_texto": peso_texto,
+        "volume_texto": volume_texto,
+        "tipo_transporte": None,
+        "temperatura": temperatura,
+    }
+
+def estatisticas_fast_path():
+    """Taxa de acerto da extração determinística neste processo."""
+    stats = dict(_fast_path_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    return stats
+
+def _montar_mensagens(corpo_email):
+    """Mensagens do chat de extração (inclui o contexto RAG do e-mail)."""
+    # RAG: contexto interno semelhante
+    rag_context = _build_rag_context(corpo_email)
 
-5.  **temperatura**:
-    -   Verifique se há menção explícita de `frio` ou `frigorífico`.
-    -   Se sim, o valor é `frio`. Caso contrário, o valor é `ambiente`.
+    prompt_llm = PROMPT_EXTRACAO + PROMPT_EMAIL.format(rag_context=rag_context, corpo_email=corpo_email)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt_llm} # Usar o novo prompt_llm
+    ]
 
-6.  **Saída Final**:
-    -   Retorne a resposta **APENAS** em formato JSON, sem qualquer texto adicional ou explicação.
-    -   Use a seguinte estrutura de chaves: `"destino_texto": "...", "peso_texto": "...", "volume_texto": "...", "tipo_transporte": "...", "temperatura": "..."`.
-    -   Se uma informação não for encontrada, o valor correspondente é `null`.
+def _registar_tempos_llm(response):
+    """Regista tokens do prompt e tempos reportados pelo Ollama (durações em ns).
+    Sem streaming, o tempo até ao primeiro token é aproximado por carga do modelo + prefill.
+    """
+    try:
+        def ms(chave):
+            return (response.get(chave) or 0) / 1e6
+
+        logger.info(
+            "Ollama: prompt_tokens=%s output_tokens=%s ttft~%.0fms (load=%.0fms, prefill=%.0fms) total=%.0fms",
+            response.get("prompt_eval_count"),
+            response.get("eval_count"),
+            ms("load_duration") + ms("prompt_eval_duration"),
+            ms("load_duration"),
+            ms("prompt_eval_duration"),
+            ms("total_duration"),
+        )
+    except Exception:
+        # Métricas nunca devem interromper a extração
+        pass
 
---- DEMONSTRATION EXAMPLE ---
-E-mail: "Preciso de transporte urgente de 8 toneladas para Albufeira, com dimensões de 3m x 3m x 5m e carga frigorífica."
-JSON Esperado:
-{{"destino_texto": "Albufeira", "peso_texto": "8 toneladas", "volume_texto": "3m x 3m x 5m", "tipo_transporte": null, "temperatura": "frio"}}
---- FIM DO EXEMPLO ---
+def _ler_resposta_llm(response):
+    _registar_tempos_llm(response)
+    try:
+        dados_brutos = json.loads(response['message']['content'])
+    except json.JSONDecodeError as e:
+        logger.error(f"Erro ao descodificar a resposta JSON do Ollama: {e}")
+        logger.error(f"Resposta recebida: {response.get('message', {}).get('content', 'N/A')}")
+        raise # Re-lança a exceção para que o RQ a capture e chame o on_failure
+    logger.info(f"Dados brutos recebidos do Ollama: {dados_brutos}")
+    return dados_brutos
 
---- NOVO EXEMPLO DE DEMONSTRAÇÃO ---
-E-mail: "Bom dia Ricardo,\nPor favor, confirmem valor e disponibilidade para a recolha abaixo:\nMorada da Recolha:\nMesclachoice\nCasal do Troca\nEstrada da Paiã\n1675-076 Pontinha\nData de Recolha: 02/09 às 14h30\nCarga:\nQty: 1 plt\nDms: 112x47x80 cm\nWght: 190 kg\nEntrega:\nAeroporto de Lisboa a/c JTM\nDestino - LIS / HAV - CUBA\nEntregar na Portway\nObrigada"
-JSON Esperado:
-{{"destino_texto": "Lisboa", "peso_texto": "190 kg", "volume_texto": "112x47x80 cm", "tipo_transporte": null, "temperatura": "ambiente"}}
---- FIM DO NOVO EXEMPLO ---
+def _extrair_dados_brutos_llm(corpo_email):
+    """Chama o Ollama e devolve o JSON `dados_brutos` (texto ainda não normalizado)."""
+    mensagens = _montar_mensagens(corpo_email)
 
---- EXEMPLO DE COTAÇÃO PARA AEROPORTO ---
-E-mail: "Entrega: Aeroporto de Lisboa"
-JSON Esperado:
-{{"destino_texto": "Lisboa", "peso_texto": null, "volume_texto": null, "tipo_transporte": null, "temperatura": "ambiente"}}
---- FIM DO EXEMPLO DE COTAÇÃO PARA AEROPORTO ---
+    logger.info("A chamar a API do Ollama com Llama3 para extrair dados brutos...")
+    with medir("ollama"):
+        response = ollama.chat(
+            model=MODELO_LLM,
+            messages=mensagens,
+            format='json',
+            options={"num_predict": OLLAMA_NUM_PREDICT},
+            keep_alive=OLLAMA_KEEP_ALIVE,
+        )
+    return _ler_resposta_llm(response)
+
+@medir("normalizacao")
+def normalizar_dados_brutos(dados_brutos, corpo_email):
+    """Normaliza os dados brutos extraídos (destino, peso, volume, temperatura) com funções Python."""
+    # --- Normalização em Python ---
+    dados_normalizados = {}
+
+    # 1. Normalizar Destino (sem fuzzy matching, sem sinônimos)
+    destino_extraido = dados_brutos.get("destino_texto", "")
+    if destino_extraido:
+        destino_normalizado_lower = destino_extraido.lower().strip()
+        # Regra explícita: aeroporto de Lisboa mapeia para Lisboa
+        if (
+            "aeroporto de lisboa" in destino_normalizado_lower
+            or "lisboa aeroporto" in destino_normalizado_lower
+        ):
+            dados_normalizados["destino"] = "lisboa"
+            logger.info(f"Destino '{destino_extraido}' mapeado para 'lisboa' via regra explícita.")
+        else:
+            # Mantém o destino exatamente como extraído (normalizado em lower)
+            dados_normalizados["destino"] = destino_normalizado_lower
+            logger.info(
+                "Destino mantido exatamente como extraído (sem fuzzy/sinônimos): '%s'",
+                dados_normalizados["destino"],
+            )
+    else:
+        dados_normalizados["destino"] = None
+        logger.warning("Destino não extraído pelo LLM.")
+
+
+    # 2. Normalizar Peso
+    peso_texto = dados_brutos.get("peso_texto")
+    dados_normalizados["peso"] = normalizar_peso(peso_texto)
+    if dados_normalizados["peso"] is None and peso_texto:
+        logger.warning(f"Não foi possível normalizar o peso '{peso_texto}'.")
+
+    # 3. Normalizar Volume
+    volume_texto = dados_brutos.get("volume_texto")
+    dados_normalizados["volume"] = normalizar_volume(volume_texto)
+    if dados_normalizados["volume"] is None and volume_texto:
+        logger.warning(f"Não foi possível normalizar o volume '{volume_texto}'.")
+    
+    # 4. Manter Tipo de Transporte e Temperatura do LLM (sem normalização Python adicional)
+    dados_normalizados["tipo_transporte"] = dados_brutos.get("tipo_transporte")
+    dados_normalizados["temperatura"] = dados_brutos.get("temperatura")
 
-E-mail a ser processado:
----
-{corpo_email}
----"""
+    # Heurística: se o e-mail mencionar produtos que exigem frio e a temperatura vier
+    # ausente ou "ambiente", força para "frio".
+    try:
+        texto_lower = (corpo_email or "").lower()
+        menciona_frio_implicito = any(k in texto_lower for k in COLD_KEYWORDS)
+        temp_atual = (dados_normalizados.get("temperatura") or "").lower() or None
+        if menciona_frio_implicito and (temp_atual is None or temp_atual == "ambiente"):
+            dados_normalizados["temperatura"] = "frio"
+            logger.info("Temperatura ajustada para 'frio' via heurística de produto (cadeia de frio).")
+    except Exception:
+        # Não interromper o fluxo por causa da heurística
+        pass
+    
+    logger.info(f"Dados normalizados e validados: {dados_normalizados}")
+    return dados_normalizados
 
-    logger.info("A chamar a API do Ollama com Llama3 para extrair dados brutos...")
+def analisar_email(corpo_email):
+    """
+    Usa o modelo Llama3 via Ollama para extrair dados estruturados de um e-mail,
+    e então normaliza esses dados com funções Python.
+    E-mails semi-estruturados são resolvidos por regras, sem chamar o LLM.
+    Extrações anteriores do mesmo corpo (retentativas, e-mails de template) vêm da cache.
+    """
     try:
-        response = ollama.chat(
-            model='llama3',
-            messages=[
-                {"role": "system", "content": "Você é um assistente especialista em logística e extração de dados. Retorne a resposta APENAS em formato JSON."},
-                {"role": "user", "content": prompt_llm} # Usar o novo prompt_llm
-            ],
-            format='json'
+        dados_brutos = extrair_por_regras(corpo_email)
+        contar_cache("extracao_regras", dados_brutos is not None)
+        if dados_brutos is not None:
+            _fast_path_stats["hits"] += 1
+            logger.info(f"Dados brutos extraídos por regras (sem LLM): {dados_brutos}")
+            return normalizar_dados_brutos(dados_brutos, corpo_email)
+        _fast_path_stats["misses"] += 1
+        stats = estatisticas_fast_path()
+        logger.info(
+            f"Extração por regras inconclusiva; a usar o LLM (taxa de acerto das regras: "
+            f"{stats['hit_rate']:.0%} de {stats['hits'] + stats['misses']} e-mails)."
         )
-        
-        dados_brutos = json.loads(response['message']['content'])
-        logger.info(f"Dados brutos recebidos do Ollama: {dados_brutos}")
-        
-        # --- Normalização em Python ---
-        dados_normalizados = {}
-
-        # 1. Normalizar Destino (sem fuzzy matching, sem sinônimos)
-        destino_extraido = dados_brutos.get("destino_texto", "")
-        if destino_extraido:
-            destino_normalizado_lower = destino_extraido.lower().strip()
-            # Regra explícita: aeroporto de Lisboa mapeia para Lisboa
-            if (
-                "aeroporto de lisboa" in destino_normalizado_lower
-                or "lisboa aeroporto" in destino_normalizado_lower
-            ):
-                dados_normalizados["destino"] = "lisboa"
-                logger.info(f"Destino '{destino_extraido}' mapeado para 'lisboa' via regra explícita.")
-            else:
-                # Mantém o destino exatamente como extraído (normalizado em lower)
-                dados_normalizados["destino"] = destino_normalizado_lower
-                logger.info(
-                    "Destino mantido exatamente como extraído (sem fuzzy/sinônimos): '%s'",
-                    dados_normalizados["destino"],
-                )
+
+        dados_brutos = _llm_cache.get(corpo_email)
+        if dados_brutos is not None:
+            logger.info(f"Dados brutos obtidos da cache de extração: {dados_brutos}")
         else:
-            dados_normalizados["destino"] = None
-            logger.warning("Destino não extraído pelo LLM.")
-
-
-        # 2. Normalizar Peso
-        peso_texto = dados_brutos.get("peso_texto")
-        dados_normalizados["peso"] = normalizar_peso(peso_texto)
-        if dados_normalizados["peso"] is None and peso_texto:
-            logger.warning(f"Não foi possível normalizar o peso '{peso_texto}'.")
-
-        # 3. Normalizar Volume
-        volume_texto = dados_brutos.get("volume_texto")
-        dados_normalizados["volume"] = normalizar_volume(volume_texto)
-        if dados_normalizados["volume"] is None and volume_texto:
-            logger.warning(f"Não foi possível normalizar o volume '{volume_texto}'.")
-        
-        # 4. Manter Tipo de Transporte e Temperatura do LLM (sem normalização Python adicional)
-        dados_normalizados["tipo_transporte"] = dados_brutos.get("tipo_transporte")
-        dados_normalizados["temperatura"] = dados_brutos.get("temperatura")
-
-        # Heurística: se o e-mail mencionar produtos que exigem frio e a temperatura vier
-        # ausente ou "ambiente", força para "frio".
-        try:
-            texto_lower = (corpo_email or "").lower()
-            menciona_frio_implicito = any(k in texto_lower for k in COLD_KEYWORDS)
-            temp_atual = (dados_normalizados.get("temperatura") or "").lower() or None
-            if menciona_frio_implicito and (temp_atual is None or temp_atual == "ambiente"):
-                dados_normalizados["temperatura"] = "frio"
-                logger.info("Temperatura ajustada para 'frio' via heurística de produto (cadeia de frio).")
-        except Exception:
-            # Não interromper o fluxo por causa da heurística
-            pass
-        
-        logger.info(f"Dados normalizados e validados: {dados_normalizados}")
-        return dados_normalizados
+            dados_brutos = _extrair_dados_brutos_llm(corpo_email)
+            _llm_cache.set(corpo_email, dados_brutos)
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Erro ao descodificar a resposta JSON do Ollama: {e}")
-        logger.error(f"Resposta recebida: {response.get('message', {}).get('content', 'N/A')}")
-        raise # Re-lança a exceção para que o RQ a capture e chame o on_failure
+        return normalizar_dados_brutos(dados_brutos, corpo_email)
+
+    except json.JSONDecodeError:
+        raise # Já registado; re-lança para que o RQ a capture e chame o on_failure
     except Exception as e:
         logger.error(f"Ocorreu um erro inesperado ao processar o e-mail: {e}", exc_info=True)
-        raise # Re-lança a exceção
\ No newline at end of file
+        raise # Re-lança a exceção
+
+# --- Extração concorrente em lote ---
+# Por omissão, alinhado com OLLAMA_NUM_PARALLEL do servidor
+OLLAMA_MAX_CONCORRENCIA = int(os.getenv("OLLAMA_MAX_CONCORRENCIA", os.getenv("OLLAMA_NUM_PARALLEL", 4)))
+OLLAMA_TIMEOUT_SECONDS = float(os.getenv("OLLAMA_TIMEOUT_SECONDS", 120))
+
+async def _analisar_emails_async(corpos, max_concorrencia, timeout):
+    client = ollama.AsyncClient()
+    semaforo = asyncio.Semaphore(max_concorrencia)
+
+    async def analisar(i, corpo_email):
+        dados_brutos = extrair_por_regras(corpo_email)
+        contar_cache("extracao_regras", dados_brutos is not None)
+        if dados_brutos is not None:
+            _fast_path_stats["hits"] += 1
+            return normalizar_dados_brutos(dados_brutos, corpo_email)
+        _fast_path_stats["misses"] += 1
+
+        # Cache (Redis) e contexto RAG (embeddings/Chroma) são síncronos: correm numa thread
+        # para não bloquearem o event loop enquanto outros pedidos esperam pelo Ollama
+        dados_brutos = await asyncio.to_thread(_llm_cache.get, corpo_email)
+        if dados_brutos is None:
+            mensagens = await asyncio.to_thread(_montar_mensagens, corpo_email)
+            async with semaforo:
+                logger.info(f"[LOTE {i}] A chamar a API do Ollama ({MODELO_LLM})...")
+                with medir("ollama"):
+                    response = await asyncio.wait_for(
+                        client.chat(
+                            model=MODELO_LLM,
+                            messages=mensagens,
+                            format='json',
+                            options={"num_predict": OLLAMA_NUM_PREDICT},
+                            keep_alive=OLLAMA_KEEP_ALIVE,
+                        ),
+                        timeout=timeout,
+                    )
+            dados_brutos = _ler_resposta_llm(response)
+            await asyncio.to_thread(_llm_cache.set, corpo_email, dados_brutos)
+        return normalizar_dados_brutos(dados_brutos, corpo_email)
+
+    return await asyncio.gather(
+        *(analisar(i, corpo) for i, corpo in enumerate(corpos)),
+        return_exceptions=True,
+    )
+
+def analisar_emails_lote(corpos, max_concorrencia=None, timeout=None):
+    """
+    Versão em lote de `analisar_email`: envia vários e-mails ao Ollama em paralelo
+    (no máximo `max_concorrencia` pedidos em simultâneo, cada um limitado a `timeout` segundos).
+    Retorna uma lista alinhada com `corpos`; entradas que falharam ficam a None.
+    """
+    corpos = list(corpos)
+    if not corpos:
+        return []
+    max_concorrencia = max_concorrencia or OLLAMA_MAX_CONCORRENCIA
+    timeout = timeout or OLLAMA_TIMEOUT_SECONDS
+
+    logger.info(f"A analisar {len(corpos)} e-mails em lote (concorrência máxima: {max_concorrencia}).")
+    resultados = asyncio.run(_analisar_emails_async(corpos, max_concorrencia, timeout))
+
+    saida = []
+    for i, resultado in enumerate(resultados):
+        if isinstance(resultado, BaseException):
+            motivo = "timeout" if isinstance(resultado, asyncio.TimeoutError) else resultado
+            logger.error(f"[LOTE {i}] Falha ao analisar e-mail: {motivo}")
+            saida.append(None)
+        else:
+            saida.append(resultado)
+    return saida
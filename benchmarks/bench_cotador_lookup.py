@@ -0,0 +1,81 @@
+"""
+Micro-benchmark: pesquisa na tabela de preços via índice vs. máscaras sobre o DataFrame
+(e cotação em lote via merge vetorizado).
+
+Execução:
+    python3 benchmarks/bench_cotador_lookup.py [n_linhas] [n_consultas]
+"""
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cotador import Cotador
+
+
+def gerar_tabela(n_linhas: int, n_destinos: int = 5000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "destino": rng.choice([f"destino_{i}" for i in range(n_destinos)], n_linhas),
+        "peso_maximo": rng.choice([100, 500, 1000, 5000, 20000], n_linhas),
+        "volume_maximo": rng.choice([1, 5, 10, 40, 90], n_linhas),
+        "tipo_transporte": rng.choice(["Pequeno", "Médio", "Camiao"], n_linhas),
+        "temperatura": rng.choice(["ambiente", "frio"], n_linhas),
+        "preco": rng.uniform(50, 2000, n_linhas).round(2),
+    })
+
+
+def main():
+    n_linhas = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    n_consultas = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+
+    fd, tabela_path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        gerar_tabela(n_linhas).to_csv(tabela_path, index=False)
+        cotador = Cotador(tabela_path=tabela_path)
+    finally:
+        os.remove(tabela_path)
+
+    rng = np.random.default_rng(1)
+    consultas = [
+        (
+            f"destino_{rng.integers(0, 5000)}",
+            float(rng.integers(1, 20000)),
+            float(rng.uniform(0, 90)),
+            str(rng.choice(["ambiente", "frio"])),
+        )
+        for _ in range(n_consultas)
+    ]
+
+    resultados = {}
+    for nome, fn in (("dataframe", cotador._procurar_na_tabela), ("indice", cotador._procurar_no_indice)):
+        t0 = time.perf_counter()
+        resultados[nome] = [fn(*c) for c in consultas]
+        dt = time.perf_counter() - t0
+        print(f"{nome:>10}: {dt * 1e6 / n_consultas:10.1f} µs/consulta ({n_consultas} consultas, {n_linhas} linhas)")
+
+    # Em lote, as falhas seguiriam para a API; aqui mede-se apenas o merge vetorizado
+    cotador._cotar_por_api = lambda *args: None
+    cotador.precarregar_distancias = lambda *args: {}
+    t0 = time.perf_counter()
+    cotador.encontrar_cotacoes_lote(consultas)
+    dt = time.perf_counter() - t0
+    print(f"{'lote':>10}: {dt * 1e6 / n_consultas:10.1f} µs/consulta ({n_consultas} consultas, {n_linhas} linhas)")
+
+    divergencias = sum(
+        (a is None) != (b is None) or (a is not None and a.name != b.name)
+        for a, b in zip(resultados["dataframe"], resultados["indice"])
+    )
+    print(f"Divergências entre caminhos: {divergencias}")
+
+
+if __name__ == "__main__":
+    main()
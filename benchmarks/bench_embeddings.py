@@ -0,0 +1,121 @@
+"""
+Benchmark dos backends de embeddings do RagStore (RAG_EMBED_BACKEND).
+
+Cada backend corre num processo próprio (como um worker RQ) e mede-se:
+- tempo de carregamento (imports + modelo) e memória residente (RSS) antes/depois;
+- embeddings por segundo em lotes de e-mails sintéticos;
+- compatibilidade: cosseno mínimo/médio em relação aos vetores do primeiro backend
+  da lista (por omissão "huggingface", o que criou as coleções existentes).
+
+Requer o modelo acessível (Hugging Face Hub ou RAG_ONNX_MODEL_PATH/RAG_ONNX_TOKENIZER_PATH).
+
+Execução:
+    python3 benchmarks/bench_embeddings.py [n_textos] [backend ...]
+"""
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+MODELO = "sentence-transformers/all-MiniLM-L6-v2"
+DESTINOS = ["Porto", "Lisboa", "Leiria", "Setúbal", "Faro", "Braga", "Coimbra", "Aveiro"]
+
+
+def gerar_textos(n: int) -> list:
+    rng = np.random.default_rng(0)
+    textos = []
+    for i in range(n):
+        destino = DESTINOS[i % len(DESTINOS)]
+        textos.append(
+            f"Assunto: Pedido de cotação {i}\nCorpo: Bom dia, precisamos de transporte de "
+            f"{rng.integers(1, 30)} paletes ({rng.integers(100, 9000)} kg) para {destino}, "
+            f"recolha em {rng.integers(1, 28)}/{rng.integers(1, 12)}. "
+            + ("Carga refrigerada. " if i % 3 == 0 else "")
+            + "Obrigado."
+        )
+    return textos
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for linha in f:
+            if linha.startswith("VmRSS:"):
+                return int(linha.split()[1]) / 1024
+    return 0.0
+
+
+def medir(backend: str, n_textos: int, saida: str) -> None:
+    """Corre dentro do subprocesso: carrega o backend, mede e grava os vetores."""
+    rss_inicial = rss_mb()
+    t0 = time.perf_counter()
+    if backend.startswith("onnx"):
+        # Codificador direto: não precisa do LlamaIndex para ser medido
+        from rag_embeddings import OnnxEncoder
+
+        encoder = OnnxEncoder(MODELO, quantizado=backend == "onnx-int8")
+        codificar = encoder.encode
+    else:
+        from rag_embeddings import criar_embedder
+
+        codificar = criar_embedder(MODELO, backend).get_text_embedding_batch
+    codificar(["aquecimento"])
+    carregamento = time.perf_counter() - t0
+    rss_modelo = rss_mb()
+
+    textos = gerar_textos(n_textos)
+    t0 = time.perf_counter()
+    vetores = np.asarray(codificar(textos), dtype=np.float32)
+    decorrido = time.perf_counter() - t0
+
+    np.save(saida, vetores)
+    print(json.dumps({
+        "carregamento_s": round(carregamento, 2),
+        "rss_inicial_mb": round(rss_inicial, 1),
+        "rss_modelo_mb": round(rss_modelo, 1),
+        "rss_final_mb": round(rss_mb(), 1),
+        "embeddings_por_s": round(n_textos / decorrido, 1),
+    }))
+
+
+def main():
+    n_textos = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    backends = sys.argv[2:] or ["huggingface", "onnx", "onnx-int8"]
+
+    referencia = None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for backend in backends:
+            saida = os.path.join(tmpdir, f"{backend}.npy")
+            processo = subprocess.run(
+                [sys.executable, __file__, "--medir", backend, str(n_textos), saida],
+                capture_output=True, text=True,
+            )
+            if processo.returncode != 0:
+                erro = (processo.stderr.strip().splitlines() or ["?"])[-1]
+                print(f"{backend:>12}: indisponível ({erro})")
+                continue
+            r = json.loads(processo.stdout.strip().splitlines()[-1])
+            vetores = np.load(saida)
+            if referencia is None:
+                referencia, compat = (backend, vetores), "referência"
+            else:
+                cossenos = (referencia[1] * vetores).sum(axis=1)
+                compat = f"cos vs {referencia[0]}: min {cossenos.min():.4f}, média {cossenos.mean():.4f}"
+            print(
+                f"{backend:>12}: {r['embeddings_por_s']:8.1f} emb/s, carregamento {r['carregamento_s']:6.2f}s, "
+                f"RSS {r['rss_inicial_mb']:.0f} → {r['rss_modelo_mb']:.0f} → {r['rss_final_mb']:.0f} MB ({compat})"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--medir":
+        medir(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+    else:
+        main()
@@ -0,0 +1,142 @@
+"""
+Enfileiramento de um lote de e-mails: um `enqueue` por e-mail vs. o lote numa só transação.
+
+Compara, para N e-mails com corpo grande:
+- "por e-mail": o caminho antigo do produtor, um `q.enqueue(processar_email_task, email)`
+  por e-mail, com o corpo completo serializado em cada job;
+- "em lote": o mesmo job único por e-mail, mas com `enqueue_many` num só pipeline e o
+  corpo gravado à parte, sob o seu hash, depois de reservar os e-mails contra duplicados
+  (`main.enfileirar_emails` com PIPELINE_ETAPAS=false);
+- "etapas": `tasks.enfileirar_pipelines`, com as quatro etapas de todos os e-mails numa
+  única transação Redis.
+
+Mede-se o tempo total, o número de idas ao Redis (comandos contados no cliente) e o
+aumento de `used_memory` do Redis.
+
+Requer um Redis acessível em REDIS_URL (padrão: redis://localhost:6379/0).
+
+Execução:
+    python3 benchmarks/bench_enfileirar.py [n_emails] [tamanho_corpo]
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rq import Queue, Retry  # noqa: E402
+
+import tasks  # noqa: E402
+from redis_client import get_redis  # noqa: E402
+
+FILA = "bench-enfileirar"
+
+
+def gerar_emails(n: int, tamanho_corpo: int) -> list:
+    # Uma cadeia de respostas típica: o mesmo histórico citado em vários e-mails
+    historico = ("> Pedido de transporte de 2 paletes para o Porto, carga refrigerada. " * 64)[:tamanho_corpo]
+    return [
+        {"remetente": f"cliente{i}@example.com", "assunto": f"Cotação {i}", "corpo": f"Pedido {i}\n{historico}"}
+        for i in range(n)
+    ]
+
+
+def contar_idas(conexao):
+    """Conta as idas ao Redis (um comando isolado ou um pipeline inteiro contam como uma)."""
+    contagem = {"idas": 0}
+    original_cmd = conexao.execute_command
+    original_pipe = conexao.pipeline
+
+    def execute_command(*args, **kwargs):
+        contagem["idas"] += 1
+        return original_cmd(*args, **kwargs)
+
+    def pipeline(*args, **kwargs):
+        pipe = original_pipe(*args, **kwargs)
+        original_exec = pipe.execute
+
+        def execute(*a, **kw):
+            contagem["idas"] += 1
+            return original_exec(*a, **kw)
+
+        pipe.execute = execute
+        return pipe
+
+    conexao.execute_command = execute_command
+    conexao.pipeline = pipeline
+    return contagem
+
+
+def limpar(conexao) -> None:
+    filas = [FILA] + [c["fila"] for c in tasks.CONFIG_ETAPAS.values()]
+    for nome in filas:
+        Queue(nome, connection=conexao).empty()
+    for padrao in ("corpo:*", "pipeline:*"):
+        for chave in conexao.scan_iter(padrao):
+            conexao.delete(chave)
+
+
+def medir(nome: str, enfileirar, n_emails: int) -> None:
+    conexao = get_redis()
+    limpar(conexao)
+    memoria_antes = conexao.info("memory")["used_memory"]
+    contagem = contar_idas(conexao)
+
+    inicio = time.perf_counter()
+    enfileirar(conexao)
+    total = time.perf_counter() - inicio
+
+    del conexao.execute_command, conexao.pipeline
+    memoria = conexao.info("memory")["used_memory"] - memoria_antes
+    print(
+        f"{nome:>12}: {total * 1e3:8.1f} ms ({total * 1e6 / n_emails:7.1f} µs/e-mail), "
+        f"{contagem['idas']:6d} idas ao Redis, +{memoria / 1024:8.1f} KiB de memória no Redis"
+    )
+
+
+def main():
+    n_emails = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    tamanho_corpo = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    emails = gerar_emails(n_emails, tamanho_corpo)
+
+    def por_email(conexao):
+        fila = Queue(FILA, connection=conexao)
+        for email in emails:
+            fila.enqueue(
+                tasks.processar_email_task, email,
+                on_failure=tasks.CALLBACK_FALHA, retry=Retry(max=3, interval=[10, 30, 60]),
+            )
+
+    def em_lote(conexao):
+        fila = Queue(FILA, connection=conexao)
+        novos = tasks.reservar_emails(emails, conexao)
+        with conexao.pipeline() as pipe:
+            fila.enqueue_many(
+                [
+                    Queue.prepare_data(
+                        tasks.processar_email_task, (tasks.referenciar_corpo(email, pipe),),
+                        job_id=f"{email['pipeline_id']}-email",
+                        on_failure=tasks.CALLBACK_FALHA, retry=Retry(max=3, interval=[10, 30, 60]),
+                    )
+                    for email in novos
+                ],
+                pipeline=pipe,
+            )
+            pipe.execute()
+
+    def etapas(conexao):
+        tasks.enfileirar_pipelines(emails, conexao)
+
+    print(f"{n_emails} e-mails com corpo de ~{tamanho_corpo} bytes")
+    try:
+        medir("por e-mail", por_email, n_emails)
+        medir("em lote", em_lote, n_emails)
+        medir("etapas", etapas, n_emails)
+    finally:
+        limpar(get_redis())
+
+
+if __name__ == "__main__":
+    main()
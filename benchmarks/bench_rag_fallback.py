@@ -0,0 +1,96 @@
+"""
+Micro-benchmark: consulta no RagStore de fallback (índice invertido + BM25) vs. a
+varrimento anterior (re-tokenizar cada documento e calcular Jaccard por consulta).
+
+Só se aplica quando o backend ChromaDB/LlamaIndex não está instalado.
+
+Execução:
+    python3 benchmarks/bench_rag_fallback.py [n_documentos] [n_consultas]
+"""
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_store
+
+DESTINOS = ["porto", "lisboa", "leiria", "setubal", "faro", "braga", "coimbra", "aveiro", "viseu", "evora"]
+PALAVRAS = ["transporte", "carga", "paletes", "frio", "ambiente", "urgente", "recolha", "entrega",
+            "camiao", "refrigerado", "cliente", "pedido", "cotacao", "armazem", "aeroporto"]
+
+
+def gerar_textos(n: int, seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    textos = []
+    for _ in range(n):
+        palavras = list(rng.choice(PALAVRAS, 12))
+        palavras += [str(rng.choice(DESTINOS)), f"{rng.integers(1, 5000)} kg", f"{rng.integers(1, 90)} m3",
+                     f"ref{rng.integers(0, 100000)}"]
+        rng.shuffle(palavras)
+        textos.append("Pedido: " + " ".join(palavras))
+    return textos
+
+
+def jaccard_varrimento(docs: list, query: str, top_k: int) -> list:
+    def tokens(s: str) -> set:
+        return {t for t in re.split(r"[^\w]+", s.lower()) if t}
+
+    q = tokens(query)
+    scored = []
+    for d in docs:
+        t = tokens(d)
+        scored.append((len(q & t) / len(q | t), d))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored[:top_k]
+
+
+def main():
+    if rag_store._HAS_RAG_BACKEND:
+        print("Backend ChromaDB/LlamaIndex instalado: este benchmark mede apenas o fallback.")
+        return
+    n_documentos = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_consultas = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    textos = gerar_textos(n_documentos, seed=0)
+    consultas = gerar_textos(n_consultas, seed=1)
+
+    persist_path = tempfile.mkdtemp()
+    try:
+        store = rag_store.RagStore(persist_path=persist_path)
+        t0 = time.perf_counter()
+        store.add_documents([(t, {"id": str(i)}) for i, t in enumerate(textos)])
+        store.compactar()
+        print(f"{'ingestão':>10}: {(time.perf_counter() - t0) * 1e6 / n_documentos:10.1f} µs/documento ({n_documentos} documentos, com compactação)")
+
+        # Um worker novo: abre o índice compacto via mmap
+        t0 = time.perf_counter()
+        store = rag_store.RagStore(persist_path=persist_path)
+        print(f"{'abertura':>10}: {(time.perf_counter() - t0) * 1e3:10.2f} ms")
+
+        t0 = time.perf_counter()
+        for q in consultas:
+            store.query_context(q, top_k=3)
+        dt = time.perf_counter() - t0
+        print(f"{'bm25':>10}: {dt * 1e3 / n_consultas:10.2f} ms/consulta ({n_consultas} consultas, {n_documentos} documentos)")
+    finally:
+        shutil.rmtree(persist_path)
+
+    # O varrimento é O(N·len) por consulta: mede-se numa amostra de consultas
+    amostra = consultas[: max(1, n_consultas // 20)]
+    t0 = time.perf_counter()
+    for q in amostra:
+        jaccard_varrimento(textos, q, top_k=3)
+    dt = time.perf_counter() - t0
+    print(f"{'jaccard':>10}: {dt * 1e3 / len(amostra):10.2f} ms/consulta ({len(amostra)} consultas, {n_documentos} documentos)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: latência por consulta no RagStore com ChromaDB/LlamaIndex.
+
+Compara:
+- query engine novo por chamada (caminho anterior: `as_query_engine(...).query(...)`);
+- retriever reutilizado, com a cache de embeddings fria (consultas todas diferentes);
+- retriever reutilizado, com a cache quente (as mesmas consultas repetidas, como em reenvios).
+
+Execução:
+    python3 benchmarks/bench_rag_query.py [n_documentos] [n_consultas]
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_store
+
+DESTINOS = ["porto", "lisboa", "leiria", "setubal", "faro", "braga", "coimbra", "aveiro", "viseu", "evora"]
+
+
+def gerar_textos(n: int, inicio: int = 0) -> list:
+    return [
+        f"Pedido {i}: transporte de {(i * 37) % 5000} kg, {(i * 11) % 90} m3 para "
+        f"{DESTINOS[i % len(DESTINOS)]}, carga {'fria' if i % 3 == 0 else 'ambiente'}."
+        for i in range(inicio, inicio + n)
+    ]
+
+
+def medir(nome: str, fn, consultas: list) -> None:
+    t0 = time.perf_counter()
+    for q in consultas:
+        fn(q)
+    dt = time.perf_counter() - t0
+    print(f"{nome:>22}: {dt * 1e3 / len(consultas):8.2f} ms/consulta ({len(consultas)} consultas)")
+
+
+def main():
+    if not rag_store._HAS_RAG_BACKEND:
+        print("Backend ChromaDB/LlamaIndex não instalado: nada a medir (ver bench_rag_fallback.py).")
+        return
+    n_documentos = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    n_consultas = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    persist_path = tempfile.mkdtemp()
+    try:
+        store = rag_store.RagStore(persist_path=persist_path)
+        store.add_documents([(t, {"id": str(i)}) for i, t in enumerate(gerar_textos(n_documentos))])
+        store.warm_up()
+
+        def query_engine_por_chamada(q):
+            store._index.as_query_engine(similarity_top_k=3).query(q)
+
+        medir("query engine/chamada", query_engine_por_chamada, gerar_textos(n_consultas, inicio=10**6))
+        medir("retriever, cache fria", lambda q: store.query_context(q, top_k=3), gerar_textos(n_consultas, inicio=2 * 10**6))
+        medir("retriever, cache quente", lambda q: store.query_context(q, top_k=3), gerar_textos(n_consultas, inicio=2 * 10**6))
+        print(f"Cache de embeddings: {store.query_cache_stats()}")
+    finally:
+        shutil.rmtree(persist_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Overhead por job: `rq worker` normal vs. worker pré-aquecido (modos fork e simples).
+
+Enfileira N jobs de `cotador.calcular_cotacao` (uma pesquisa na tabela de preços) e corre
+cada worker em modo burst. Mede-se, por job, o tempo de execução registado pelo RQ e o
+débito de ponta a ponta. Para referência, mede-se também a pesquisa sozinha, em processo.
+No `rq worker` normal, a execução inclui a importação do `cotador` (leitura da tabela
+com pandas) em cada work-horse.
+
+Requer um Redis acessível em REDIS_URL (padrão: redis://localhost:6379/0); o fakeredis
+não serve, porque os workers são outros processos. Os workers correm num diretório
+temporário com uma tabela de preços sintética (a mesma de `bench_cotador_lookup.py`).
+
+Execução:
+    python3 benchmarks/bench_worker_overhead.py [n_jobs] [n_linhas_tabela]
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(RAIZ)
+
+from rq import Queue  # noqa: E402
+
+from bench_cotador_lookup import gerar_tabela  # noqa: E402
+from redis_client import get_redis  # noqa: E402
+
+FILA = "bench-worker-overhead"
+WORKER_NORMAL = (
+    "from rq import Queue, Worker; from redis_client import get_redis; "
+    f"c = get_redis(); Worker([Queue('{FILA}', connection=c)], connection=c).work(burst=True)"
+)
+
+
+def consulta_da_tabela(tabela) -> dict:
+    """Um pedido que cabe na primeira linha da tabela: resolve-se sem recorrer à API."""
+    linha = tabela.iloc[0]
+    return {
+        "destino": str(linha["destino"]),
+        "peso": float(linha["peso_maximo"]) / 2,
+        "volume": float(linha["volume_maximo"]) / 2,
+        "temperatura": str(linha["temperatura"]),
+    }
+
+
+def medir_modo(nome: str, comando: list, dados: dict, n_jobs: int, diretorio: str, ambiente: dict) -> None:
+    fila = Queue(FILA, connection=get_redis())
+    fila.empty()
+    jobs = [fila.enqueue("cotador.calcular_cotacao", dados) for _ in range(n_jobs)]
+
+    inicio = time.perf_counter()
+    subprocess.run(comando, cwd=diretorio, env=ambiente, check=True, capture_output=True)
+    total = time.perf_counter() - inicio
+
+    execucoes = []
+    for job in jobs:
+        job.refresh()
+        if job.started_at and job.ended_at:
+            execucoes.append((job.ended_at - job.started_at).total_seconds())
+    media = sum(execucoes) / len(execucoes) if execucoes else float("nan")
+    print(
+        f"{nome:>14}: {total * 1e3 / n_jobs:8.1f} ms/job de ponta a ponta, "
+        f"{media * 1e3:8.1f} ms de execução por job ({len(execucoes)}/{n_jobs} concluídos, "
+        f"inclui o arranque do worker)"
+    )
+
+
+def main():
+    n_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n_linhas = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    diretorio = tempfile.mkdtemp()
+    try:
+        tabela = gerar_tabela(n_linhas)
+        tabela.to_csv(os.path.join(diretorio, "tabela_precos.csv"), index=False)
+        ambiente = dict(os.environ, PYTHONPATH=RAIZ + os.pathsep + os.environ.get("PYTHONPATH", ""))
+        dados = consulta_da_tabela(tabela)
+
+        os.chdir(diretorio)
+        import cotador
+
+        # bench_cotador_lookup já importou o cotador fora deste diretório, sem a tabela sintética
+        cotador.cotador_global = cotador.Cotador()
+
+        inicio = time.perf_counter()
+        for _ in range(n_jobs):
+            cotador.calcular_cotacao(dict(dados))
+        print(f"{'só a pesquisa':>14}: {(time.perf_counter() - inicio) * 1e3 / n_jobs:8.3f} ms/job (em processo)")
+
+        modos = {
+            "rq worker": [sys.executable, "-c", WORKER_NORMAL],
+            "pré-aq. fork": [sys.executable, os.path.join(RAIZ, "worker.py"), FILA, "--modo", "fork", "--burst"],
+            "pré-aq. simples": [sys.executable, os.path.join(RAIZ, "worker.py"), FILA, "--modo", "simples", "--burst"],
+        }
+        for nome, comando in modos.items():
+            medir_modo(nome, comando, dados, n_jobs, diretorio, ambiente)
+    finally:
+        Queue(FILA, connection=get_redis()).empty()
+        shutil.rmtree(diretorio)
+
+
+if __name__ == "__main__":
+    main()
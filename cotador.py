@@ -1,15 +1,45 @@
 import os
 import json
+import threading
+import time
+import numpy as np
 import pandas as pd
 from logger_config import logger
+from geo_cache import GeoCache, normalizar_chave
+from metricas import incrementar, medir
 import requests
 
 
+# Origem fixa das cotações por distância
+ORIGEM_PADRAO = "Lisboa, Portugal"
+# Casas decimais das coordenadas na chave da cache de distâncias (~11 m)
+PRECISAO_COORDENADAS = 4
+# Número máximo de coordenadas por pedido ao endpoint `table` do OSRM público
+OSRM_TABLE_MAX_COORDENADAS = 100
+# Intervalo mínimo entre pedidos ao Nominatim; a política de uso permite no máximo 1 pedido/s
+NOMINATIM_MIN_INTERVAL_SECONDS = max(float(os.getenv("NOMINATIM_MIN_INTERVAL_SECONDS", 1.0)), 1.0)
+
+# Partilhados por todas as instâncias do processo (o limite é por cliente, não por Cotador)
+_nominatim_lock = threading.Lock()
+_nominatim_ultimo_pedido = float("-inf")
+
+
+def _aguardar_vez_nominatim():
+    """Bloqueia até passar NOMINATIM_MIN_INTERVAL_SECONDS desde o último pedido ao Nominatim."""
+    global _nominatim_ultimo_pedido
+    with _nominatim_lock:
+        espera = _nominatim_ultimo_pedido + NOMINATIM_MIN_INTERVAL_SECONDS - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        _nominatim_ultimo_pedido = time.monotonic()
+
+
 class Cotador:
     def __init__(self, tabela_path="tabela_precos.csv"):
         try:
             self.df = pd.read_csv(tabela_path)
             self._normalizar_colunas()
+            self._construir_indice()
             logger.info(f"Tabela de preços '{tabela_path}' carregada com sucesso.")
         except FileNotFoundError:
             logger.error(f"Arquivo da tabela de preços '{tabela_path}' não encontrado.")
@@ -18,7 +48,9 @@ class Cotador:
             logger.error(f"Erro ao ler ou processar a tabela de preços: {e}", exc_info=True)
             raise
 
-        # Geocoding será feito via HTTP direto ao Nominatim (sem dependência externa)
+        # Geocoding será feito via HTTP direto ao Nominatim (sem dependência externa),
+        # com cache persistente partilhada entre processos
+        self._geo_cache = GeoCache()
         # Carrega configuração de preços por km do ficheiro privado (gitignored)
         self._pricing_tiers = self._load_pricing_tiers()
 
@@ -27,33 +59,170 @@ class Cotador:
         if 'destino' in self.df.columns:
             self.df['destino'] = self.df['destino'].str.strip().str.lower()
 
-    def encontrar_cotacao(self, destino, peso, volume, temperatura="ambiente"):
-        destino_normalizado = destino.lower().strip()
-        temperatura_normalizada = temperatura.lower().strip() if isinstance(temperatura, str) else "ambiente"
-        
-        logger.info(f"Buscando cotação para Destino: {destino_normalizado}, Peso: {peso}, Volume: {volume}, Temperatura: {temperatura_normalizada}")
+    def _construir_indice(self):
+        """Pré-calcula um índice (destino, temperatura) -> linhas ordenadas por peso_maximo.
+        Cada pesquisa passa a ser um acesso ao dicionário seguido de pesquisa binária,
+        em vez de quatro máscaras booleanas sobre a tabela inteira.
+        """
+        self._indice = None
+        colunas = {"destino", "temperatura", "peso_maximo", "volume_maximo", "preco"}
+        if not colunas.issubset(self.df.columns):
+            logger.warning("Tabela de preços sem as colunas esperadas. Índice de pesquisa desativado.")
+            return
+        if not all(pd.api.types.is_numeric_dtype(self.df[c]) for c in ("peso_maximo", "volume_maximo", "preco")):
+            logger.warning("Colunas numéricas da tabela com tipos inesperados. Índice de pesquisa desativado.")
+            return
+
+        peso_max = self.df["peso_maximo"].to_numpy(dtype=float)
+        volume_max = self.df["volume_maximo"].to_numpy(dtype=float)
+        precos = self.df["preco"].to_numpy(dtype=float)
+
+        indice = {}
+        grupos = self.df.groupby(["destino", "temperatura"], sort=False).indices
+        for chave, posicoes in grupos.items():
+            # Linhas sem limites definidos nunca passam no filtro da tabela
+            posicoes = posicoes[~np.isnan(peso_max[posicoes]) & ~np.isnan(volume_max[posicoes])]
+            if len(posicoes) == 0:
+                continue
+            ordem = np.argsort(peso_max[posicoes], kind="stable")
+            posicoes = posicoes[ordem]
+            indice[chave] = {
+                "posicoes": posicoes,
+                "peso_maximo": peso_max[posicoes],
+                "volume_maximo": volume_max[posicoes],
+                "preco": precos[posicoes],
+            }
+        self._indice = indice
+        logger.info(f"Índice da tabela de preços construído com {len(indice)} grupos (destino, temperatura).")
 
+    def _procurar_no_indice(self, destino, peso, volume, temperatura):
+        """Devolve a linha mais barata que cobre peso/volume, ou None."""
+        grupo = self._indice.get((destino, temperatura))
+        if grupo is None:
+            return None
+        # Primeira linha com peso_maximo >= peso; as seguintes também cobrem o peso
+        inicio = np.searchsorted(grupo["peso_maximo"], peso, side="left")
+        candidatas = np.flatnonzero(grupo["volume_maximo"][inicio:] >= volume) + inicio
+        if len(candidatas) == 0:
+            return None
+        posicoes = grupo["posicoes"][candidatas]
+        # Mais barata primeiro; em empate, a que aparece primeiro na tabela
+        melhor = posicoes[np.lexsort((posicoes, grupo["preco"][candidatas]))[0]]
+        return self.df.iloc[melhor]
+
+    def _procurar_na_tabela(self, destino, peso, volume, temperatura):
+        """Pesquisa direta sobre o DataFrame (caminho de referência do índice)."""
         filtro = (
-            (self.df["destino"] == destino_normalizado) &
+            (self.df["destino"] == destino) &
             (self.df["peso_maximo"] >= peso) &
             (self.df["volume_maximo"] >= volume) &
-            (self.df["temperatura"] == temperatura_normalizada)
+            (self.df["temperatura"] == temperatura)
         )
 
-        resultados = self.df[filtro].sort_values(by=["preco"]) # Ordenar pelo preço para encontrar o mais barato
+        resultados = self.df[filtro].sort_values(by=["preco"], kind="stable") # Ordenar pelo preço para encontrar o mais barato
 
         if not resultados.empty:
             return resultados.iloc[0]
+        return None
+
+    def encontrar_cotacao(self, destino, peso, volume, temperatura="ambiente"):
+        destino_normalizado = destino.lower().strip()
+        temperatura_normalizada = temperatura.lower().strip() if isinstance(temperatura, str) else "ambiente"
+        
+        logger.info(f"Buscando cotação para Destino: {destino_normalizado}, Peso: {peso}, Volume: {volume}, Temperatura: {temperatura_normalizada}")
+
+        with medir("tabela"):
+            if self._indice is not None:
+                resultado = self._procurar_no_indice(destino_normalizado, peso, volume, temperatura_normalizada)
+            else:
+                resultado = self._procurar_na_tabela(destino_normalizado, peso, volume, temperatura_normalizada)
+
+        if resultado is not None:
+            incrementar("cotacoes_cotacoes_total", fonte="tabela")
+            return resultado
 
         # Fallback API se não encontrar na tabela
         logger.warning(
             f"Nenhuma cotação exata encontrada na tabela. A tentar fallback via API (Nominatim + OSRM) para destino='{destino_normalizado}'."
         )
-        return self._cotar_por_api(destino_normalizado, peso, volume, temperatura_normalizada)
+        with medir("api_fallback"):
+            resultado = self._cotar_por_api(destino_normalizado, peso, volume, temperatura_normalizada)
+        incrementar("cotacoes_cotacoes_total", fonte="api" if resultado is not None else "nenhuma")
+        return resultado
+
+    def encontrar_cotacoes_lote(self, pedidos):
+        """Cotação em lote. `pedidos` é um DataFrame com colunas destino/peso/volume
+        (e opcionalmente temperatura) ou uma lista de tuplos (destino, peso, volume[, temperatura]).
+        Os pedidos cobertos pela tabela são resolvidos num único merge vetorizado; só os
+        restantes seguem para o fallback por API. Retorna uma lista alinhada com a entrada,
+        com o mesmo tipo de resultado de `encontrar_cotacao` (Series, dict ou None).
+        """
+        if isinstance(pedidos, pd.DataFrame):
+            pedidos_df = pedidos.reset_index(drop=True).copy()
+            if "temperatura" not in pedidos_df.columns:
+                pedidos_df["temperatura"] = "ambiente"
+            pedidos_df = pedidos_df[["destino", "peso", "volume", "temperatura"]]
+        else:
+            registos = [tuple(p) + ("ambiente",) * (4 - len(p)) for p in pedidos]
+            pedidos_df = pd.DataFrame.from_records(registos, columns=["destino", "peso", "volume", "temperatura"])
+
+        n = len(pedidos_df)
+        if n == 0:
+            return []
+
+        pedidos_df = pd.DataFrame({
+            "_pedido": np.arange(n),
+            "destino": pedidos_df["destino"].astype(str).str.lower().str.strip(),
+            "_peso": pd.to_numeric(pedidos_df["peso"], errors="coerce"),
+            "_volume": pd.to_numeric(pedidos_df["volume"], errors="coerce"),
+            "temperatura": [
+                t.lower().strip() if isinstance(t, str) else "ambiente" for t in pedidos_df["temperatura"]
+            ],
+        })
+        logger.info(f"Cotação em lote de {n} pedidos.")
+
+        tabela = self.df.assign(_linha=np.arange(len(self.df)))
+        combinado = pedidos_df.merge(tabela, on=["destino", "temperatura"], how="inner")
+        combinado = combinado[
+            (combinado["peso_maximo"] >= combinado["_peso"]) &
+            (combinado["volume_maximo"] >= combinado["_volume"])
+        ]
+        # Mais barata por pedido; em empate, a que aparece primeiro na tabela
+        melhores = (
+            combinado.sort_values(["_pedido", "preco", "_linha"], kind="stable")
+            .drop_duplicates("_pedido")
+        )
+        linha_por_pedido = dict(zip(melhores["_pedido"], melhores["_linha"]))
+
+        resultados = [
+            self.df.iloc[linha_por_pedido[i]] if i in linha_por_pedido else None
+            for i in range(n)
+        ]
+        if linha_por_pedido:
+            incrementar("cotacoes_cotacoes_total", len(linha_por_pedido), fonte="tabela")
+
+        falhas = pedidos_df[~pedidos_df["_pedido"].isin(linha_por_pedido.keys())]
+        falhas = falhas.dropna(subset=["_peso", "_volume"])
+        if not falhas.empty:
+            logger.warning(
+                f"{len(falhas)} de {n} pedidos sem cotação na tabela. A tentar fallback via API."
+            )
+            destinos_api = falhas["destino"].unique().tolist()
+            if len(destinos_api) > 1:
+                # Um único pedido `table` ao OSRM aquece a cache para todos os destinos
+                self.precarregar_distancias(destinos_api)
+            for i, destino, peso, volume, temperatura in zip(
+                falhas["_pedido"], falhas["destino"], falhas["_peso"], falhas["_volume"], falhas["temperatura"]
+            ):
+                with medir("api_fallback"):
+                    resultados[i] = self._cotar_por_api(destino, float(peso), float(volume), temperatura)
+                incrementar("cotacoes_cotacoes_total", fonte="api" if resultados[i] is not None else "nenhuma")
+
+        return resultados
 
     def _cotar_por_api(self, destino: str, peso: float, volume: float, temperatura: str):
         try:
-            origem = "Lisboa, Portugal"
+            origem = ORIGEM_PADRAO
             origem_loc = self._geocode(origem)
             destino_loc = self._geocode(destino)
             if not origem_loc or not destino_loc:
@@ -88,51 +257,162 @@ class Cotador:
             return None
 
     def _geocode(self, query: str):
-        """Geocoding usando Nominatim via HTTP (sem API key)."""
+        """Geocoding com cache persistente (inclui resultados negativos)."""
+        chave = normalizar_chave(query)
+        encontrado, valor = self._geo_cache.get("geocode", chave)
+        if encontrado:
+            return tuple(valor) if valor is not None else None
+
+        # Só os pedidos que saem para a rede esperam pela vez; hits da cache não contam
+        _aguardar_vez_nominatim()
         try:
-            params = {
-                "q": query,
-                "format": "json",
-                "addressdetails": 0,
-                "countrycodes": "pt",
-                "limit": 1,
-            }
-            headers = {"User-Agent": "cotacoes_ai_app/1.0 (contact: exemplo@exemplo.com)"}
-            r = requests.get("https://nominatim.openstreetmap.org/search", params=params, headers=headers, timeout=15)
-            r.raise_for_status()
-            data = r.json()
-            if not data:
-                return None
-            item = data[0]
-            lat = float(item.get("lat"))
-            lon = float(item.get("lon"))
-            return (lat, lon)
+            resultado = self._geocode_nominatim(query)
         except Exception as e:
+            # Erros de rede não são guardados: o próximo pedido volta a tentar
             logger.warning(f"Falha no geocoding para '{query}': {e}")
             return None
 
+        self._geo_cache.set("geocode", chave, list(resultado) if resultado else None)
+        return resultado
+
+    @medir("geocoding")
+    def _geocode_nominatim(self, query: str):
+        """Geocoding usando Nominatim via HTTP (sem API key).
+        Retorna (lat, lon), None se o local não existir, ou lança exceção em erro de rede.
+        """
+        params = {
+            "q": query,
+            "format": "json",
+            "addressdetails": 0,
+            "countrycodes": "pt",
+            "limit": 1,
+        }
+        headers = {"User-Agent": "cotacoes_ai_app/1.0 (contact: exemplo@exemplo.com)"}
+        r = requests.get("https://nominatim.openstreetmap.org/search", params=params, headers=headers, timeout=15)
+        r.raise_for_status()
+        data = r.json()
+        if not data:
+            return None
+        item = data[0]
+        lat = float(item.get("lat"))
+        lon = float(item.get("lon"))
+        return (lat, lon)
+
+    def estatisticas_cache(self):
+        """Contadores de hit/miss das caches geográficas deste processo."""
+        return self._geo_cache.stats()
+
+    @staticmethod
+    def _chave_rota(origem_latlon, destino_latlon):
+        o_lat, o_lon = (round(float(v), PRECISAO_COORDENADAS) for v in origem_latlon)
+        d_lat, d_lon = (round(float(v), PRECISAO_COORDENADAS) for v in destino_latlon)
+        return f"{o_lat},{o_lon};{d_lat},{d_lon}"
+
     def _osrm_distance_km(self, origem_latlon, destino_latlon):
+        """Distância de condução em km, com cache persistente por coordenadas arredondadas."""
+        chave = self._chave_rota(origem_latlon, destino_latlon)
+        encontrado, valor = self._geo_cache.get("osrm", chave)
+        if encontrado:
+            return valor
+
         try:
-            o_lat, o_lon = origem_latlon
-            d_lat, d_lon = destino_latlon
-            url = (
-                f"https://router.project-osrm.org/route/v1/driving/"
-                f"{o_lon},{o_lat};{d_lon},{d_lat}?overview=false&alternatives=false&annotations=distance"
-            )
-            r = requests.get(url, timeout=15)
-            r.raise_for_status()
-            data = r.json()
-            routes = data.get("routes") or []
-            if not routes:
-                return None
-            dist_m = routes[0].get("distance")
-            if dist_m is None:
-                return None
-            return round(dist_m / 1000.0, 2)
+            distancia = self._osrm_route_km(origem_latlon, destino_latlon)
         except Exception as e:
             logger.warning(f"Falha ao consultar OSRM: {e}")
             return None
 
+        self._geo_cache.set("osrm", chave, distancia)
+        return distancia
+
+    @medir("osrm")
+    def _osrm_route_km(self, origem_latlon, destino_latlon):
+        """Consulta o endpoint `route` do OSRM. Retorna km, None se não houver rota,
+        ou lança exceção em erro de rede.
+        """
+        o_lat, o_lon = origem_latlon
+        d_lat, d_lon = destino_latlon
+        url = (
+            f"https://router.project-osrm.org/route/v1/driving/"
+            f"{o_lon},{o_lat};{d_lon},{d_lat}?overview=false&alternatives=false&annotations=distance"
+        )
+        r = requests.get(url, timeout=15)
+        r.raise_for_status()
+        data = r.json()
+        routes = data.get("routes") or []
+        if not routes:
+            return None
+        dist_m = routes[0].get("distance")
+        if dist_m is None:
+            return None
+        return round(dist_m / 1000.0, 2)
+
+    @medir("osrm")
+    def _osrm_table_km(self, origem_latlon, destinos_latlon):
+        """Consulta o endpoint `table` do OSRM: distâncias da origem para vários destinos
+        num único pedido. Retorna uma lista de km (None onde não há rota).
+        """
+        coordenadas = [origem_latlon] + list(destinos_latlon)
+        coords_str = ";".join(f"{lon},{lat}" for lat, lon in coordenadas)
+        url = (
+            f"https://router.project-osrm.org/table/v1/driving/"
+            f"{coords_str}?sources=0&annotations=distance"
+        )
+        r = requests.get(url, timeout=30)
+        r.raise_for_status()
+        data = r.json()
+        linhas = data.get("distances") or []
+        if not linhas:
+            raise ValueError(f"Resposta do OSRM table sem distâncias: {data.get('code')}")
+        # A coluna 0 é a própria origem
+        return [round(d / 1000.0, 2) if d is not None else None for d in linhas[0][1:]]
+
+    def precarregar_distancias(self, destinos, origem=ORIGEM_PADRAO):
+        """Pré-carrega a cache com as distâncias da origem para vários destinos,
+        usando o endpoint `table` do OSRM em lotes. Útil para aquecer a cache com
+        os destinos mais frequentes do fallback por API.
+        Retorna um dict destino -> km (ou None se não foi possível obter).
+        """
+        resultado = {}
+        origem_loc = self._geocode(origem)
+        if not origem_loc:
+            logger.error(f"Falha no geocoding da origem '{origem}'. Pré-carregamento cancelado.")
+            return resultado
+
+        pendentes = []
+        for destino in dict.fromkeys(destinos):
+            destino_loc = self._geocode(destino)
+            if not destino_loc:
+                resultado[destino] = None
+                continue
+            encontrado, valor = self._geo_cache.get("osrm", self._chave_rota(origem_loc, destino_loc))
+            if encontrado:
+                resultado[destino] = valor
+            else:
+                pendentes.append((destino, destino_loc))
+
+        lote_max = OSRM_TABLE_MAX_COORDENADAS - 1
+        for i in range(0, len(pendentes), lote_max):
+            lote = pendentes[i:i + lote_max]
+            try:
+                distancias = self._osrm_table_km(origem_loc, [loc for _, loc in lote])
+            except Exception as e:
+                logger.warning(f"Falha ao consultar OSRM table para {len(lote)} destinos: {e}")
+                for destino, _ in lote:
+                    resultado[destino] = None
+                continue
+            self._geo_cache.set_many(
+                "osrm",
+                {self._chave_rota(origem_loc, loc): km for (_, loc), km in zip(lote, distancias)},
+            )
+            for (destino, _), km in zip(lote, distancias):
+                resultado[destino] = km
+
+        logger.info(
+            f"Distâncias pré-carregadas: {sum(v is not None for v in resultado.values())}/{len(resultado)} "
+            f"destinos ({len(pendentes)} consultados ao OSRM)."
+        )
+        return resultado
+
     def _tarifa_por_peso_volume(self, peso: float, volume: float, temperatura: str):
         """Retorna (tarifa_por_km, tipo_transporte) conforme configuração privada.
         Esta informação é carregada de um ficheiro gitignored.
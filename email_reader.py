@@ -1,14 +1,507 @@
 import imaplib
 import email
+import base64
+import quopri
+import re
+import select
+import ssl
+import time
+import hashlib
 from email.header import decode_header
 import os
 from logger_config import logger
+from redis_client import get_redis
 
 PALAVRAS_CHAVE = ["pedido", "orçamento", "cotação", "preço", "urgente"]
 
+# Número máximo de UIDs por comando FETCH/STORE
+IMAP_FETCH_BATCH = int(os.getenv("IMAP_FETCH_BATCH", 200))
+# Checkpoint por pasta e registo de e-mails já enfileirados (Redis)
+_PREFIXO_CHECKPOINT = "cotacoes:imap:checkpoint"
+_PREFIXO_PROCESSADO = "cotacoes:imap:processado"
+IMAP_PROCESSADOS_TTL_SECONDS = int(os.getenv("IMAP_PROCESSADOS_TTL_SECONDS", 90 * 24 * 3600))
+# Campos de cabeçalho pedidos na primeira passagem (sem descarregar corpos nem anexos)
+_CAMPOS_CABECALHO = "SUBJECT FROM MESSAGE-ID"
+
+_RE_EXISTS = re.compile(rb"^\* \d+ EXISTS", re.IGNORECASE)
+_TOKEN_IMAP = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
 def limpar_texto(texto):
     return "".join(c if c.isalnum() else " " for c in texto).lower()
 
+def e_relevante(assunto, corpo):
+    texto_completo = limpar_texto((assunto or "") + " " + (corpo or ""))
+    return any(palavra in texto_completo for palavra in PALAVRAS_CHAVE)
+
+def _conjunto_uids(uids):
+    """Compacta UIDs num conjunto IMAP (ex.: [1, 2, 3, 7] -> "1:3,7")."""
+    valores = sorted({int(u) for u in uids})
+    partes = []
+    inicio = anterior = None
+    for u in valores:
+        if inicio is None:
+            inicio = anterior = u
+        elif u == anterior + 1:
+            anterior = u
+        else:
+            partes.append(f"{inicio}:{anterior}" if anterior != inicio else str(inicio))
+            inicio = anterior = u
+    if inicio is not None:
+        partes.append(f"{inicio}:{anterior}" if anterior != inicio else str(inicio))
+    return ",".join(partes)
+
+def _lotes(valores, tamanho):
+    for i in range(0, len(valores), tamanho):
+        yield valores[i:i + tamanho]
+
+def _parse_lista_imap(dados):
+    """Converte uma lista IMAP entre parênteses (ex.: BODYSTRUCTURE) em listas Python."""
+    pilha = [[]]
+    for m in _TOKEN_IMAP.finditer(dados):
+        token = m.group()
+        if token == b"(":
+            pilha.append([])
+        elif token == b")":
+            if len(pilha) > 1:
+                lista = pilha.pop()
+                pilha[-1].append(lista)
+        elif token.startswith(b'"'):
+            pilha[-1].append(token[1:-1].replace(b'\\"', b'"').replace(b"\\\\", b"\\").decode(errors="replace"))
+        elif token.upper() == b"NIL":
+            pilha[-1].append(None)
+        else:
+            pilha[-1].append(token.decode(errors="replace"))
+    return pilha[0]
+
+def _extrair_item(meta, nome):
+    """Extrai o valor entre parênteses de um item FETCH (ex.: BODYSTRUCTURE (...))."""
+    inicio = meta.find(nome + b" (")
+    if inicio < 0:
+        return None
+    i = inicio + len(nome) + 1
+    profundidade = 0
+    em_aspas = False
+    for j in range(i, len(meta)):
+        c = meta[j:j + 1]
+        if em_aspas:
+            if c == b'"' and meta[j - 1:j] != b"\\":
+                em_aspas = False
+        elif c == b'"':
+            em_aspas = True
+        elif c == b"(":
+            profundidade += 1
+        elif c == b")":
+            profundidade -= 1
+            if profundidade == 0:
+                lista = _parse_lista_imap(meta[i:j + 1])
+                return lista[0] if lista else None
+    return None
+
+def _parametro(parametros, nome):
+    if not isinstance(parametros, list):
+        return None
+    for chave, valor in zip(parametros[::2], parametros[1::2]):
+        if isinstance(chave, str) and chave.lower() == nome:
+            return valor
+    return None
+
+def _secao_texto(estrutura, secao=""):
+    """Localiza a parte de texto a usar como corpo a partir do BODYSTRUCTURE.
+    Multipart: primeira parte text/plain (em profundidade), como `msg.walk()`.
+    Parte única: o próprio corpo ("1"), qualquer que seja o tipo.
+    Retorna (secao, encoding, charset) ou None.
+    """
+    if not isinstance(estrutura, list) or not estrutura:
+        return None
+    if isinstance(estrutura[0], list):
+        for n, parte in enumerate(p for p in estrutura if isinstance(p, list)):
+            resultado = _secao_texto_multipart(parte, f"{secao}{n + 1}")
+            if resultado:
+                return resultado
+        return None
+    return (secao or "1", (estrutura[5] or "7bit").lower(), _parametro(estrutura[2], "charset"))
+
+def _secao_texto_multipart(parte, secao):
+    if isinstance(parte[0], list):
+        return _secao_texto(parte, secao + ".")
+    tipo = f"{parte[0]}/{parte[1]}".lower()
+    if tipo == "text/plain":
+        return (secao, (parte[5] or "7bit").lower(), _parametro(parte[2], "charset"))
+    return None
+
+def _descodificar_corpo(dados, encoding, charset):
+    try:
+        if encoding == "base64":
+            dados = base64.b64decode(dados)
+        elif encoding == "quoted-printable":
+            dados = quopri.decodestring(dados)
+    except Exception as e:
+        logger.warning(f"Falha ao descodificar corpo ({encoding}): {e}")
+    try:
+        return dados.decode(charset or "utf-8", errors="ignore")
+    except LookupError:
+        return dados.decode("utf-8", errors="ignore")
+
+def _respostas_fetch(dados):
+    """Agrupa a resposta de um FETCH em (metadados, literal) por mensagem."""
+    respostas = []
+    for item in dados or []:
+        if isinstance(item, tuple):
+            respostas.append([item[0], item[1]])
+        elif isinstance(item, bytes) and respostas and not re.match(rb"^\d+ \(", item):
+            # Itens que chegam depois do literal (ex.: " BODYSTRUCTURE (...))")
+            respostas[-1][0] += b" " + item
+        elif isinstance(item, bytes) and re.match(rb"^\d+ \(", item):
+            respostas.append([item, None])
+    return respostas
+
+def _uid_de(meta):
+    m = re.search(rb"UID (\d+)", meta)
+    return m.group(1).decode() if m else None
+
+def _buscar_cabecalhos(mail, uids):
+    """1.ª passagem: cabeçalhos + BODYSTRUCTURE de todos os UIDs, num FETCH por lote."""
+    cabecalhos = {}
+    for lote in _lotes(uids, IMAP_FETCH_BATCH):
+        status, dados = mail.uid(
+            "FETCH", _conjunto_uids(lote),
+            f"(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({_CAMPOS_CABECALHO})])",
+        )
+        if status != 'OK':
+            logger.warning(f"Falha ao buscar cabeçalhos dos UIDs {_conjunto_uids(lote)}.")
+            continue
+        for meta, literal in _respostas_fetch(dados):
+            uid = _uid_de(meta)
+            if uid is None or literal is None:
+                continue
+            msg = email.message_from_bytes(literal)
+            assunto, codificacao = decode_header(msg["Subject"] or "")[0]
+            if isinstance(assunto, bytes):
+                try:
+                    assunto = assunto.decode(codificacao or "utf-8", errors="ignore")
+                except LookupError:
+                    # Cabeçalho 8-bit sem codificação declarada
+                    assunto = assunto.decode("utf-8", errors="ignore")
+            cabecalhos[uid] = {
+                "remetente": msg.get("From"),
+                "assunto": assunto,
+                "message_id": (msg.get("Message-ID") or "").strip() or None,
+                "secao": _secao_texto(_extrair_item(meta, b"BODYSTRUCTURE")),
+            }
+    return cabecalhos
+
+def _buscar_corpos(mail, cabecalhos):
+    """
+    2.ª passagem: apenas a parte de texto dos candidatos (sem anexos), agrupada por secção.
+    Retorna (corpos, UIDs dos lotes cujo FETCH falhou).
+    """
+    por_secao = {}
+    for uid, cab in cabecalhos.items():
+        if cab["secao"]:
+            por_secao.setdefault(cab["secao"][0], []).append(uid)
+
+    corpos = {}
+    falhados = set()
+    for secao, uids in por_secao.items():
+        for lote in _lotes(uids, IMAP_FETCH_BATCH):
+            status, dados = mail.uid("FETCH", _conjunto_uids(lote), f"(UID BODY.PEEK[{secao}])")
+            if status != 'OK':
+                logger.warning(f"Falha ao buscar corpos dos UIDs {_conjunto_uids(lote)}.")
+                falhados.update(lote)
+                continue
+            for meta, literal in _respostas_fetch(dados):
+                uid = _uid_de(meta)
+                if uid in cabecalhos and literal is not None:
+                    _, encoding, charset = cabecalhos[uid]["secao"]
+                    corpos[uid] = _descodificar_corpo(literal, encoding, charset)
+    return corpos, falhados
+
+def _marcar_como_lidos(mail, uids):
+    """Marca \\Seen com um único STORE por lote."""
+    for lote in _lotes(uids, IMAP_FETCH_BATCH):
+        mail.uid("STORE", _conjunto_uids(lote), "+FLAGS", "(\\Seen)")
+
+def conectar_imap():
+    """Abre uma ligação IMAP autenticada com a pasta configurada selecionada."""
+    EMAIL_USUARIO = os.getenv("EMAIL_USUARIO")
+    EMAIL_SENHA = os.getenv("EMAIL_SENHA")
+    EMAIL_SERVIDOR = os.getenv("EMAIL_SERVIDOR")
+    EMAIL_PASTA = os.getenv("EMAIL_PASTA", "inbox")
+
+    logger.info(f"Conectando ao servidor IMAP: {EMAIL_SERVIDOR}")
+    mail = imaplib.IMAP4_SSL(EMAIL_SERVIDOR)
+    mail.login(EMAIL_USUARIO, EMAIL_SENHA)
+    mail.select(EMAIL_PASTA)
+    logger.info(f"Conexão bem-sucedida. Selecionada a pasta '{EMAIL_PASTA}'.")
+    return mail
+
+def buscar_emails(mail, desde_uid=None, apenas_nao_lidos=True, lido_ate=None):
+    """
+    Lê os e-mails relevantes numa ligação já aberta.
+    Com `desde_uid`, considera apenas mensagens com UID superior (novas desde a última leitura);
+    com `apenas_nao_lidos=False`, inclui mensagens já abertas por alguém na caixa.
+    Retorna (emails_relevantes, maior_uid): `maior_uid` é o UID até ao qual a pasta fica lida
+    (o maior encontrado, ou `lido_ate` se for superior), mas nunca passa de uma mensagem cujo
+    FETCH falhou: fica no UID anterior, para que o ciclo seguinte a volte a ler.
+    Erros IMAP são propagados.
+    """
+    ja_lido = max((int(u) for u in (desde_uid, lido_ate) if u is not None), default=None)
+    criterio = ["UNSEEN"] if apenas_nao_lidos else [] # Procura apenas e-mails não lidos
+    if desde_uid is not None:
+        criterio += ["UID", f"{int(desde_uid) + 1}:*"]
+    if not criterio:
+        criterio = ["ALL"]
+    status, mensagens = mail.uid("SEARCH", None, *criterio)
+    if status != 'OK':
+        logger.error("Falha ao buscar e-mails.")
+        return [], desde_uid
+
+    uids = [u.decode() for u in mensagens[0].split()]
+    # "n:*" inclui sempre a última mensagem, mesmo que o seu UID seja inferior a n
+    if desde_uid is not None:
+        uids = [u for u in uids if int(u) > int(desde_uid)]
+    if not uids:
+        logger.info("Nenhum e-mail novo encontrado.")
+        return [], ja_lido
+
+    logger.info(f"Encontrados {len(uids)} e-mails novos. Processando...")
+    maior_uid = max([int(u) for u in uids] + ([ja_lido] if ja_lido is not None else []))
+
+    cabecalhos = _buscar_cabecalhos(mail, uids)
+    corpos, falhados = _buscar_corpos(mail, cabecalhos)
+    falhados.update(u for u in uids if u not in cabecalhos)
+    if falhados:
+        # Nenhuma mensagem que não foi lida pode ficar para trás do checkpoint
+        maior_uid = min(int(u) for u in falhados) - 1
+        logger.warning(f"{len(falhados)} e-mails não foram lidos; voltam a ser pedidos no próximo ciclo.")
+
+    emails_relevantes = []
+    for uid in uids:
+        cab = cabecalhos.get(uid)
+        if uid in falhados:
+            logger.warning(f"Falha ao buscar o e-mail com UID {uid}.")
+            continue
+        assunto = cab["assunto"]
+        remetente = cab["remetente"]
+        corpo = corpos.get(uid, "")
+
+        if e_relevante(assunto, corpo):
+            logger.info(f"E-mail de '{remetente}' sobre '{assunto}' marcado como relevante.")
+            emails_relevantes.append({
+                "remetente": remetente,
+                "assunto": assunto,
+                "corpo": corpo,
+                "uid": uid,
+                "message_id": cab["message_id"],
+            })
+
+    # \Seen só é marcado depois de enfileirados, em `confirmar_emails`
+    return emails_relevantes, maior_uid
+
+# --- Checkpoint por pasta (UIDVALIDITY + último UID processado) ---
+def identificador_email(email_dict):
+    """Identificador estável de um e-mail: Message-ID, ou hash do conteúdo quando não existe."""
+    message_id = email_dict.get("message_id")
+    if message_id:
+        return message_id
+    conteudo = "\0".join(str(email_dict.get(k) or "") for k in ("remetente", "assunto", "corpo"))
+    return "sha256:" + hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+def _chave_checkpoint(pasta):
+    return f"{_PREFIXO_CHECKPOINT}:{os.getenv('EMAIL_USUARIO', '')}:{pasta}"
+
+def ler_checkpoint(pasta):
+    """Retorna {'uidvalidity', 'ultimo_uid', 'pendente'} ou None se não existir/indisponível."""
+    try:
+        dados = get_redis().hgetall(_chave_checkpoint(pasta))
+    except Exception as e:
+        logger.warning(f"Checkpoint IMAP indisponível ({e}). A usar pesquisa UNSEEN.")
+        return None
+    if not dados:
+        return None
+    return {k.decode() if isinstance(k, bytes) else k: int(v) for k, v in dados.items()}
+
+def guardar_checkpoint(pasta, uidvalidity, ultimo_uid, pendente=None):
+    try:
+        valores = {"uidvalidity": int(uidvalidity), "ultimo_uid": int(ultimo_uid)}
+        valores["pendente"] = int(pendente if pendente is not None else ultimo_uid)
+        get_redis().hset(_chave_checkpoint(pasta), mapping=valores)
+    except Exception as e:
+        logger.warning(f"Falha ao guardar checkpoint IMAP: {e}")
+
+def _estado_pasta(mail, pasta):
+    """Retorna (UIDVALIDITY, UIDNEXT) da pasta selecionada."""
+    uidvalidity = mail.response("UIDVALIDITY")[1][0]
+    uidnext = mail.response("UIDNEXT")[1][0]
+    if uidvalidity is None or uidnext is None:
+        status, dados = mail.status(pasta, "(UIDVALIDITY UIDNEXT)")
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"Falha ao obter UIDVALIDITY da pasta '{pasta}'.")
+        uidvalidity = re.search(rb"UIDVALIDITY (\d+)", dados[0]).group(1)
+        uidnext = re.search(rb"UIDNEXT (\d+)", dados[0]).group(1)
+    return int(uidvalidity), int(uidnext)
+
+def _filtrar_processados(emails):
+    """Remove e-mails cujo identificador já foi enfileirado anteriormente."""
+    if not emails:
+        return emails
+    try:
+        pipe = get_redis().pipeline()
+        for e in emails:
+            pipe.exists(f"{_PREFIXO_PROCESSADO}:{identificador_email(e)}")
+        ja_vistos = pipe.execute()
+    except Exception as e:
+        logger.warning(f"Não foi possível verificar e-mails já processados: {e}")
+        return emails
+    novos = [e for e, visto in zip(emails, ja_vistos) if not visto]
+    if len(novos) < len(emails):
+        logger.info(f"{len(emails) - len(novos)} e-mails ignorados por já terem sido processados.")
+    return novos
+
+def ler_emails_novos(mail, pasta=None):
+    """
+    Lê apenas o que chegou desde o último checkpoint da pasta (`UID n+1:*`),
+    independentemente da flag \\Seen. Sem checkpoint válido (primeira execução ou
+    UIDVALIDITY alterado), usa a pesquisa UNSEEN e cria o checkpoint.
+    O checkpoint só avança para lá dos e-mails devolvidos depois de `confirmar_emails`.
+    """
+    pasta = pasta or os.getenv("EMAIL_PASTA", "inbox")
+    uidvalidity, uidnext = _estado_pasta(mail, pasta)
+    checkpoint = ler_checkpoint(pasta)
+
+    if checkpoint and checkpoint.get("uidvalidity") == uidvalidity:
+        emails, maior_uid = buscar_emails(mail, desde_uid=checkpoint["ultimo_uid"], apenas_nao_lidos=False)
+    else:
+        if checkpoint:
+            logger.warning(f"UIDVALIDITY da pasta '{pasta}' mudou. Checkpoint reiniciado.")
+        # Abaixo de UIDNEXT, o que a pesquisa UNSEEN não devolveu já estava lido
+        emails, maior_uid = buscar_emails(mail, lido_ate=uidnext - 1)
+
+    emails = _filtrar_processados(emails)
+    for e in emails:
+        e["pasta"] = pasta
+        e["uidvalidity"] = uidvalidity
+
+    if maior_uid is not None:
+        # Até serem enfileirados, os e-mails devolvidos não podem ficar para trás do checkpoint
+        provisorio = min([int(e["uid"]) - 1 for e in emails] + [maior_uid])
+        if checkpoint and checkpoint.get("uidvalidity") == uidvalidity:
+            provisorio = max(provisorio, checkpoint["ultimo_uid"])
+        guardar_checkpoint(pasta, uidvalidity, provisorio, pendente=maior_uid)
+    return emails
+
+def confirmar_emails(emails, mail=None):
+    """
+    Chamado só depois de os e-mails estarem enfileirados: regista-os como processados
+    (por identificador), avança o checkpoint da pasta e marca-os como \\Seen.
+    Sem `mail`, abre uma ligação própria para o STORE.
+    """
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        for e in emails:
+            pipe.set(f"{_PREFIXO_PROCESSADO}:{identificador_email(e)}", e.get("uid") or 1, ex=IMAP_PROCESSADOS_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Falha ao registar e-mails processados: {e}")
+
+    for pasta, uidvalidity in {(e.get("pasta"), e.get("uidvalidity")) for e in emails if e.get("pasta")}:
+        checkpoint = ler_checkpoint(pasta)
+        if checkpoint and checkpoint.get("uidvalidity") == uidvalidity:
+            guardar_checkpoint(pasta, uidvalidity, checkpoint["pendente"], pendente=checkpoint["pendente"])
+
+    _marcar_confirmados(emails, mail)
+
+def _marcar_confirmados(emails, mail):
+    """Marca \\Seen nos e-mails confirmados, pasta a pasta. Uma falha só fica registada no log."""
+    por_pasta = {}
+    for e in emails:
+        if e.get("uid") and e.get("pasta"):
+            por_pasta.setdefault(e["pasta"], []).append(e["uid"])
+    if not por_pasta:
+        return
+    propria = mail is None
+    try:
+        if propria:
+            mail = conectar_imap()
+        for pasta, uids in por_pasta.items():
+            if propria:
+                mail.select(pasta)
+            _marcar_como_lidos(mail, uids)
+    except Exception as e:
+        # O checkpoint e o registo de processados já impedem que voltem a ser enfileirados
+        logger.warning(f"Falha ao marcar e-mails como lidos: {e}")
+    finally:
+        if propria and mail is not None:
+            try:
+                mail.logout()
+            except Exception:
+                pass
+
+def _nova_tag(mail):
+    """
+    Tag para o IDLE, que é enviado à mão (o imaplib não tem IDLE antes do Python 3.14).
+    Usa o gerador interno do imaplib (`_new_tag`, privado) para não colidir com as tags
+    dos outros comandos da ligação; é o único ponto que depende dessa API.
+    """
+    return mail._new_tag()
+
+def _ha_dados(mail, sock):
+    """
+    True se já há dados por ler sem bloquear. O imaplib lê por `mail.file` (buffer), por isso
+    uma linha já no buffer, ou decifrada pelo SSL, não é vista pelo select() no socket.
+    """
+    anterior = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(anterior)
+
+def aguardar_novos_emails(mail, timeout):
+    """
+    Entra em IMAP IDLE (RFC 2177) e espera até `timeout` segundos por uma notificação EXISTS.
+    Retorna True se chegaram mensagens novas, False se o tempo esgotou.
+    Uma ligação perdida lança `imaplib.IMAP4.abort`.
+    """
+    tag = _nova_tag(mail)
+    mail.send(tag + b" IDLE\r\n")
+    resposta = mail.readline()
+    if not resposta.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"Servidor recusou IDLE: {resposta!r}")
+
+    sock = mail.socket()
+    novidades = False
+    limite = time.monotonic() + timeout
+    while not novidades:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        if not _ha_dados(mail, sock):
+            prontos, _, _ = select.select([sock], [], [], restante)
+            if not prontos:
+                break
+        linha = mail.readline()
+        if not linha:
+            raise imaplib.IMAP4.abort("Ligação IMAP fechada durante IDLE.")
+        if _RE_EXISTS.match(linha):
+            novidades = True
+
+    mail.send(b"DONE\r\n")
+    while True:
+        linha = mail.readline()
+        if not linha:
+            raise imaplib.IMAP4.abort("Ligação IMAP fechada ao terminar IDLE.")
+        if linha.startswith(tag):
+            if b" OK" not in linha.upper():
+                raise imaplib.IMAP4.error(f"IDLE terminou com erro: {linha!r}")
+            break
+        if _RE_EXISTS.match(linha):
+            novidades = True
+    return novidades
+
 def obter_emails():
     # Se o modo de teste estiver ativo, retorna um e-mail simulado
     if os.getenv("APP_TEST_MODE") == "true":
@@ -26,68 +519,10 @@ Entrega: Meimoa
             }
         ]
 
-    emails_relevantes = []
     mail = None
-
-    EMAIL_USUARIO = os.getenv("EMAIL_USUARIO")
-    EMAIL_SENHA = os.getenv("EMAIL_SENHA")
-    EMAIL_SERVIDOR = os.getenv("EMAIL_SERVIDOR")
-    EMAIL_PASTA = os.getenv("EMAIL_PASTA", "inbox")
-
     try:
-        logger.info(f"Conectando ao servidor IMAP: {EMAIL_SERVIDOR}")
-        mail = imaplib.IMAP4_SSL(EMAIL_SERVIDOR)
-        mail.login(EMAIL_USUARIO, EMAIL_SENHA)
-        mail.select(EMAIL_PASTA)
-        logger.info(f"Conexão bem-sucedida. Selecionada a pasta '{EMAIL_PASTA}'.")
-
-        status, mensagens = mail.search(None, "(UNSEEN)") # Procura apenas e-mails não lidos
-        if status != 'OK':
-            logger.error("Falha ao buscar e-mails.")
-            return []
-
-        ids = mensagens[0].split()
-        if not ids:
-            logger.info("Nenhum e-mail não lido encontrado.")
-            return []
-
-        logger.info(f"Encontrados {len(ids)} e-mails não lidos. Processando...")
-
-        for num in ids:
-            status, dados = mail.fetch(num, "(RFC822)")
-            if status != 'OK':
-                logger.warning(f"Falha ao buscar o e-mail com ID {num.decode()}.")
-                continue
-
-            for resposta in dados:
-                if isinstance(resposta, tuple):
-                    msg = email.message_from_bytes(resposta[1])
-                    assunto, codificacao = decode_header(msg["Subject"])[0]
-                    if isinstance(assunto, bytes):
-                        assunto = assunto.decode(codificacao or "utf-8")
-                    remetente = msg.get("From")
-
-                    corpo = ""
-                    if msg.is_multipart():
-                        for parte in msg.walk():
-                            if parte.get_content_type() == "text/plain":
-                                corpo = parte.get_payload(decode=True).decode(errors='ignore')
-                                break
-                    else:
-                        corpo = msg.get_payload(decode=True).decode(errors='ignore')
-
-                    texto_completo = limpar_texto(assunto + " " + corpo)
-                    if any(palavra in texto_completo for palavra in PALAVRAS_CHAVE):
-                        logger.info(f"E-mail de '{remetente}' sobre '{assunto}' marcado como relevante.")
-                        emails_relevantes.append({
-                            "remetente": remetente,
-                            "assunto": assunto,
-                            "corpo": corpo
-                        })
-                        # Marcar e-mail como lido para não processar novamente
-                        mail.store(num, '+FLAGS', '\\Seen')
-
-        return emails_relevantes
+        mail = conectar_imap()
+        return ler_emails_novos(mail)
 
     except imaplib.IMAP4.error as e:
         logger.error(f"Erro de IMAP: {e}", exc_info=True)
@@ -98,4 +533,4 @@ Entrega: Meimoa
     finally:
         if mail:
             logger.info("Fechando a conexão com o servidor IMAP.")
-            mail.logout()
\ No newline at end of file
+            mail.logout()
@@ -1,77 +1,207 @@
 import smtplib
 import os
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from logger_config import logger
+from metricas import incrementar, medir
 
-def enviar_email_cotacao(destinatario, assunto_original, cotacao):
+# Spool de envio: sessões SMTP persistentes reutilizadas entre e-mails
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 2))
+SMTP_BATCH_SIZE = int(os.getenv("SMTP_BATCH_SIZE", 20))
+# Sessões paradas há mais tempo do que isto são verificadas com NOOP antes de reutilizar
+SMTP_HEALTHCHECK_IDLE_SECONDS = float(os.getenv("SMTP_HEALTHCHECK_IDLE_SECONDS", 30))
+# Espera máxima pelo envio de uma mensagem. Tem de ser menor do que o timeout do job de envio
+# (PIPELINE_ENVIO_TIMEOUT), para o job saber o resultado antes de o RQ o interromper
+SMTP_SEND_TIMEOUT_SECONDS = float(os.getenv("SMTP_SEND_TIMEOUT_SECONDS", 60))
+
+_PARAR = object()
+
+
+class SmtpSpool:
     """
-    Formata e envia um e-mail de resposta com a cotação.
-    Lança uma exceção em caso de falha.
+    Fila de envio com um pequeno pool de ligações SMTP de longa duração.
+    Cada thread de envio mantém a sua sessão (STARTTLS + login feitos uma vez),
+    esvazia a fila em lotes e volta a ligar-se quando a sessão cai.
     """
-    # Se o modo de teste estiver ativo, apenas registra o e-mail em vez de enviá-lo
-    if os.getenv("APP_TEST_MODE") == "true":
-        logger.info(f"APP_TEST_MODE está ativo. Simulando envio de e-mail para {destinatario}")
-        logger.info(f"Assunto: Re: {assunto_original}")
-        logger.info(f"Cotação simulada: {cotacao}")
 
-        # Adicionar a lógica de construção do HTML para o modo de teste
-        destino = cotacao.get('destino', 'N/A')
-        peso = cotacao.get('peso', 'N/A')
-        volume = cotacao.get('volume', 'N/A')
-        tipo_transporte = cotacao.get('tipo_transporte', 'N/A')
-        preco_final = cotacao.get('preco_final', 0)
-        # Arredonda para o múltiplo de 5€ mais próximo, sem casas decimais
+    def __init__(self, servidor, porta, usuario=None, senha=None, starttls=True,
+                 pool_size=SMTP_POOL_SIZE, batch_size=SMTP_BATCH_SIZE,
+                 healthcheck_idle_seconds=SMTP_HEALTHCHECK_IDLE_SECONDS):
+        self.servidor = servidor
+        self.porta = porta
+        self.usuario = usuario
+        self.senha = senha
+        self.starttls = starttls
+        self.batch_size = max(1, batch_size)
+        self.healthcheck_idle_seconds = healthcheck_idle_seconds
+        self._fila = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {"enviados": 0, "falhados": 0, "cancelados": 0, "ligacoes": 0, "religacoes": 0, "lotes": 0}
+        self._threads = [
+            threading.Thread(target=self._drenar, name=f"smtp-spool-{i}", daemon=True)
+            for i in range(max(1, pool_size))
+        ]
+        for t in self._threads:
+            t.start()
+
+    # -------------------------
+    # API pública
+    # -------------------------
+    def enqueue(self, msg) -> Future:
+        """Coloca uma mensagem na fila. O Future resolve para True/False após a tentativa de envio."""
+        futuro = Future()
+        self._fila.put((msg, futuro))
+        return futuro
+
+    def close(self, timeout=None):
+        """Envia o que estiver na fila e fecha as sessões."""
+        for _ in self._threads:
+            self._fila.put(_PARAR)
+        for t in self._threads:
+            t.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    # -------------------------
+    # Internos
+    # -------------------------
+    def _contar(self, chave, n=1):
+        with self._lock:
+            self._stats[chave] += n
+
+    def _ligar(self):
+        server = smtplib.SMTP(self.servidor, self.porta, timeout=30)
+        if self.starttls:
+            server.starttls()
+        if self.usuario and self.senha:
+            # Com credenciais configuradas, o login é obrigatório: um servidor sem AUTH
+            # (SMTPNotSupportedError) ou credenciais erradas fazem falhar o envio
+            server.login(self.usuario, self.senha)
+        self._contar("ligacoes")
+        logger.info(f"Sessão SMTP aberta com {self.servidor}:{self.porta}")
+        return server
+
+    @staticmethod
+    def _fechar(server):
+        if server is None:
+            return
         try:
-            preco_display = int(round(float(preco_final) / 5.0) * 5)
+            server.quit()
         except Exception:
-            preco_display = int(float(preco_final)) if isinstance(preco_final, (int, float)) else 0
-        temperatura = cotacao.get('temperatura', 'ambiente').capitalize()
+            try:
+                server.close()
+            except Exception:
+                pass
 
-        corpo_html = f"""
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; color: #333; margin: 0; padding: 0; background-color: #f4f4f4; }}
-            .container {{ padding: 25px; border: 1px solid #ddd; border-radius: 10px; max-width: 600px; margin: 40px auto; background-color: #ffffff; box-shadow: 0 4px 8px rgba(0,0,0,0.1); }}
-            .header {{ font-size: 26px; color: #0056b3; margin-bottom: 20px; border-bottom: 2px solid #0056b3; padding-bottom: 10px; }}
-            .details {{ margin-top: 20px; padding-top: 15px; border-top: 1px solid #eee; }}
-            .footer {{ margin-top: 25px; font-size: 12px; color: #777; }}
-            strong {{ color: #0056b3; }}
-            .price {{ font-size: 20px; font-weight: bold; color: #28a745; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <p class="header">Proposta de Cotação - SpeedConect</p>
-            <p>Olá,</p>
-            <p>Agradecemos o seu contacto. É com prazer que apresentamos a nossa proposta para o transporte solicitado:</p>
-            <div class="details">
-                <p><strong>Destino:</strong> {destino}</p>
-                <p><strong>Tipo de Transporte:</strong> {tipo_transporte}</p>
-                <p><strong>Peso:</strong> {peso} kg</p>
-                <p><strong>Volume:</strong> {volume} m³</p>
-                <p><strong>Condição de Transporte:</strong> {temperatura}</p>
-                <hr>
-                <p class="price">Valor Final: {preco_display} €</p>
-            </div>
-            <p>Esta proposta é válida por 15 dias. Para qualquer esclarecimento ou para confirmar o serviço, estamos à sua inteira disposição.</p>
-            <p>Com os melhores cumprimentos,</p>
-            <p><strong>A Equipa SpeedConect</strong></p>
-            <p class="footer">Este é um e-mail automático. Por favor, não responda diretamente.</p>
-        </div>
-    </body>
-    </html>
+    def _sessao_saudavel(self, server, ultimo_uso):
+        if server is None:
+            return False
+        if time.monotonic() - ultimo_uso < self.healthcheck_idle_seconds:
+            return True
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _drenar(self):
+        server = None
+        ultimo_uso = 0.0
+        parar = False
+        while not parar:
+            lote = [self._fila.get()]
+            while len(lote) < self.batch_size:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            sinais = sum(1 for item in lote if item is _PARAR)
+            if sinais:
+                parar = True
+                # Sinais de paragem a mais pertencem às outras threads
+                for _ in range(sinais - 1):
+                    self._fila.put(_PARAR)
+                # Mensagens depois do sinal de paragem ainda são enviadas
+                lote = [item for item in lote if item is not _PARAR]
+            if not lote:
+                continue
+
+            self._contar("lotes")
+            for msg, futuro in lote:
+                # Quem enfileirou pode ter desistido (timeout): uma mensagem cancelada não é enviada
+                if not futuro.set_running_or_notify_cancel():
+                    self._contar("cancelados")
+                    continue
+                enviado = False
+                for tentativa in range(2):
+                    try:
+                        if not self._sessao_saudavel(server, ultimo_uso):
+                            if server is not None:
+                                self._contar("religacoes")
+                            self._fechar(server)
+                            server = self._ligar()
+                        server.send_message(msg)
+                        ultimo_uso = time.monotonic()
+                        enviado = True
+                        break
+                    except (smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError) as e:
+                        # Não é uma sessão perdida: tentar de novo não resolve
+                        logger.error(f"Autenticação SMTP em {self.servidor}:{self.porta} falhou; e-mail para {msg['To']} não enviado: {e}")
+                        self._fechar(server)
+                        server = None
+                        break
+                    except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError) as e:
+                        # Sessão caiu: descarta e tenta novamente numa ligação nova
+                        logger.warning(f"Sessão SMTP perdida ao enviar para {msg['To']} (tentativa {tentativa + 1}): {e}")
+                        self._fechar(server)
+                        server = None
+                    except Exception as e:
+                        logger.error(f"Falha ao enviar e-mail para {msg['To']}. Erro: {e}", exc_info=True)
+                        break
+                self._contar("enviados" if enviado else "falhados")
+                if enviado:
+                    logger.info(f"E-mail enviado com sucesso para {msg['To']}")
+                futuro.set_result(enviado)
+        self._fechar(server)
+
+
+_spool = None
+_spool_pid = None
+_spool_lock = threading.Lock()
+
+
+def get_spool() -> SmtpSpool:
     """
-        logger.info(f"HTML gerado (simulado):\n---\n{corpo_html}\n---")
-        return True
+    Spool por processo, configurado a partir das variáveis de ambiente na primeira utilização.
 
-    EMAIL_USUARIO = os.getenv("EMAIL_USUARIO")
-    EMAIL_SENHA = os.getenv("EMAIL_SENHA")
-    SMTP_SERVIDOR = os.getenv("SMTP_SERVIDOR", "smtp.gmail.com")
-    SMTP_PORTA = int(os.getenv("SMTP_PORTA", 587))
+    As sessões só são reaproveitadas entre e-mails num processo de longa duração. Com o worker
+    RQ por omissão (fork de um work-horse por job, incluindo `worker.WorkerPreaquecido`), cada
+    job cria o seu spool e paga ligação, STARTTLS e login. Para sessões persistentes use
+    `python3 worker.py --modo simples` (`WorkerSimplesPreaquecido`).
+    """
+    global _spool, _spool_pid
+    with _spool_lock:
+        # Threads e sockets não sobrevivem a um fork: cada processo cria o seu spool
+        if _spool is None or _spool_pid != os.getpid():
+            _spool = SmtpSpool(
+                servidor=os.getenv("SMTP_SERVIDOR", "smtp.gmail.com"),
+                porta=int(os.getenv("SMTP_PORTA", 587)),
+                usuario=os.getenv("EMAIL_USUARIO"),
+                senha=os.getenv("EMAIL_SENHA"),
+                starttls=os.getenv("SMTP_STARTTLS", "true").lower() != "false",
+            )
+            _spool_pid = os.getpid()
+            atexit.register(_spool.close, SMTP_SEND_TIMEOUT_SECONDS)
+        return _spool
 
-    assunto_resposta = f"Re: {assunto_original}"
+
+def _montar_corpo_html(cotacao):
     # Extrair dados da cotação com valores padrão
     destino = cotacao.get('destino', 'N/A')
     peso = cotacao.get('peso', 'N/A')
@@ -120,6 +250,39 @@ def enviar_email_cotacao(destinatario, assunto_original, cotacao):
     </body>
     </html>
     """
+    return corpo_html
+
+
+def enviar_email_cotacao(destinatario, assunto_original, cotacao, aguardar=True, timeout=None):
+    """
+    Formata o e-mail de resposta com a cotação e coloca-o no spool de envio.
+    Com `aguardar=True` (padrão) espera pelo envio, no máximo `timeout` segundos
+    (padrão: SMTP_SEND_TIMEOUT_SECONDS), e retorna:
+    - True: enviado;
+    - False: não enviado (rejeitado pelo servidor, ou cancelado no spool antes de começar);
+    - None: resultado desconhecido (o envio já tinha começado quando o tempo esgotou).
+    Com `aguardar=False` retorna True assim que a mensagem fica na fila. Não é permitido
+    dentro de um job RQ: o work-horse termina com `os._exit`, sem esvaziar o spool.
+    """
+    if not aguardar:
+        from rq import get_current_job
+
+        if get_current_job() is not None:
+            raise ValueError("enviar_email_cotacao(aguardar=False) não é permitido dentro de um job RQ.")
+    # Se o modo de teste estiver ativo, apenas registra o e-mail em vez de enviá-lo
+    if os.getenv("APP_TEST_MODE") == "true":
+        logger.info(f"APP_TEST_MODE está ativo. Simulando envio de e-mail para {destinatario}")
+        logger.info(f"Assunto: Re: {assunto_original}")
+        logger.info(f"Cotação simulada: {cotacao}")
+
+        corpo_html = _montar_corpo_html(cotacao)
+        logger.info(f"HTML gerado (simulado):\n---\n{corpo_html}\n---")
+        return True
+
+    EMAIL_USUARIO = os.getenv("EMAIL_USUARIO")
+
+    assunto_resposta = f"Re: {assunto_original}"
+    corpo_html = _montar_corpo_html(cotacao)
 
     msg = MIMEMultipart()
     msg['From'] = EMAIL_USUARIO
@@ -127,15 +290,21 @@ def enviar_email_cotacao(destinatario, assunto_original, cotacao):
     msg['Subject'] = assunto_resposta
     msg.attach(MIMEText(corpo_html, 'html'))
 
-    logger.info(f"Tentando enviar e-mail para {destinatario}")
-    try:
-        with smtplib.SMTP(SMTP_SERVIDOR, SMTP_PORTA) as server:
-            server.starttls()
-            server.login(EMAIL_USUARIO, EMAIL_SENHA)
-            server.send_message(msg)
-        logger.info(f"E-mail enviado com sucesso para {destinatario}")
+    logger.info(f"E-mail para {destinatario} colocado no spool de envio")
+    futuro = get_spool().enqueue(msg)
+    if not aguardar:
         return True
-    except Exception as e:
-        logger.error(f"Falha ao enviar e-mail para {destinatario}. Erro: {e}", exc_info=True)
-        return False
-
+    try:
+        # Inclui a espera no spool: é o tempo que a tarefa passa no envio
+        with medir("smtp"):
+            enviado = futuro.result(timeout=SMTP_SEND_TIMEOUT_SECONDS if timeout is None else timeout)
+    except FutureTimeoutError:
+        if futuro.cancel():
+            logger.error(f"Tempo esgotado à espera do envio do e-mail para {destinatario}; mensagem retirada do spool.")
+            return False
+        # Já está a ser enviada: pode chegar ao cliente, por isso não é uma falha segura de repetir
+        logger.error(f"Tempo esgotado durante o envio do e-mail para {destinatario}; resultado desconhecido.")
+        return None
+    if not enviado:
+        incrementar("cotacoes_operacao_erros_total", operacao="smtp")
+    return enviado
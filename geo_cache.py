@@ -0,0 +1,152 @@
+"""
+Cache persistente (SQLite) para resultados de geocoding e afins.
+
+O ficheiro é partilhado por todos os processos (workers RQ incluídos), pelo que um
+destino é resolvido uma vez por instalação e não uma vez por e-mail.
+Resultados vazios ("miss" no serviço externo) também são guardados, com um TTL mais curto.
+
+Configuração (variáveis de ambiente):
+- GEOCACHE_PATH: caminho do ficheiro SQLite (padrão: geo_cache.sqlite3)
+- GEOCACHE_TTL_SECONDS: validade de resultados positivos (padrão: 30 dias)
+- GEOCACHE_NEGATIVE_TTL_SECONDS: validade de resultados negativos (padrão: 1 dia)
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+from logger_config import logger
+from metricas import contar_cache
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    chave TEXT NOT NULL,
+    valor TEXT,
+    expira_em REAL NOT NULL,
+    PRIMARY KEY (namespace, chave)
+)
+"""
+
+
+def normalizar_chave(texto: str) -> str:
+    """Normaliza uma consulta textual (minúsculas, espaços colapsados)."""
+    return re.sub(r"\s+", " ", str(texto)).strip().lower()
+
+
+class GeoCache:
+    """Cache chave/valor com TTL, negative caching e contadores de hit/miss."""
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        negative_ttl_seconds: Optional[float] = None,
+    ) -> None:
+        self.db_path = db_path or os.getenv("GEOCACHE_PATH", "geo_cache.sqlite3")
+        self.ttl_seconds = float(
+            ttl_seconds if ttl_seconds is not None else os.getenv("GEOCACHE_TTL_SECONDS", 30 * 24 * 3600)
+        )
+        self.negative_ttl_seconds = float(
+            negative_ttl_seconds
+            if negative_ttl_seconds is not None
+            else os.getenv("GEOCACHE_NEGATIVE_TTL_SECONDS", 24 * 3600)
+        )
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        # Contadores por namespace (ex.: "geocode")
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"hits": 0, "negative_hits": 0, "misses": 0, "errors": 0}
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # Ligações SQLite não sobrevivem a um fork: cada processo abre a sua
+        if self._conn is None or self._conn_pid != os.getpid():
+            diretorio = os.path.dirname(self.db_path)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            conn.commit()
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, namespace: str, chave: str) -> Tuple[bool, Any]:
+        """Devolve (encontrado, valor). Um resultado negativo em cache devolve (True, None)."""
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT valor, expira_em FROM cache WHERE namespace = ? AND chave = ?",
+                    (namespace, chave),
+                ).fetchone()
+        except Exception as e:
+            self._stats[namespace]["errors"] += 1
+            logger.warning(f"Falha ao ler a cache geográfica ({namespace}): {e}")
+            return False, None
+
+        encontrado = row is not None and row[1] >= time.time()
+        contar_cache(namespace, encontrado)
+        if not encontrado:
+            self._stats[namespace]["misses"] += 1
+            return False, None
+
+        if row[0] is None:
+            self._stats[namespace]["negative_hits"] += 1
+            return True, None
+        self._stats[namespace]["hits"] += 1
+        return True, json.loads(row[0])
+
+    def set(self, namespace: str, chave: str, valor: Any, ttl_seconds: Optional[float] = None) -> None:
+        """Guarda um valor; `None` é guardado como resultado negativo (TTL curto)."""
+        self.set_many(namespace, {chave: valor}, ttl_seconds)
+
+    def set_many(self, namespace: str, valores: Dict[str, Any], ttl_seconds: Optional[float] = None) -> None:
+        agora = time.time()
+        linhas = []
+        for chave, valor in valores.items():
+            if valor is None:
+                ttl = self.negative_ttl_seconds
+                serializado = None
+            else:
+                ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+                serializado = json.dumps(valor)
+            linhas.append((namespace, chave, serializado, agora + ttl))
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cache (namespace, chave, valor, expira_em) VALUES (?, ?, ?, ?)",
+                    linhas,
+                )
+                conn.commit()
+        except Exception as e:
+            self._stats[namespace]["errors"] += 1
+            logger.warning(f"Falha ao escrever na cache geográfica ({namespace}): {e}")
+
+    def purge_expired(self) -> int:
+        """Remove entradas expiradas. Retorna o número de linhas removidas."""
+        with self._lock:
+            conn = self._connection()
+            cur = conn.execute("DELETE FROM cache WHERE expira_em < ?", (time.time(),))
+            conn.commit()
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Contadores de hit/miss deste processo, por namespace."""
+        resultado = {}
+        for namespace, contadores in self._stats.items():
+            stats = dict(contadores)
+            consultas = stats["hits"] + stats["negative_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["hits"] + stats["negative_hits"]) / consultas if consultas else 0.0
+            resultado[namespace] = stats
+        return resultado
@@ -0,0 +1,91 @@
+"""
+Cache de resultados da extração por LLM, endereçada por conteúdo.
+
+A chave é o hash do corpo do e-mail normalizado, prefixado pela versão do prompt/modelo:
+alterar o prompt ou o modelo invalida automaticamente todas as entradas anteriores.
+Os valores (JSON `dados_brutos`) ficam no Redis com TTL; para eviction LRU configure o
+servidor com `maxmemory-policy allkeys-lru`.
+
+Configuração (variáveis de ambiente):
+- LLM_CACHE_ENABLED: "false" desativa a cache (padrão: true)
+- LLM_CACHE_TTL_SECONDS: validade das entradas (padrão: 30 dias)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, Optional
+
+from logger_config import logger
+from metricas import contar_cache
+from redis_client import get_redis
+
+_PREFIXO = "cotacoes:llm"
+
+
+def normalizar_corpo(corpo_email: str) -> str:
+    """Normaliza espaços em branco para que reenvios do mesmo template colidam."""
+    return re.sub(r"\s+", " ", corpo_email or "").strip()
+
+
+def versao_prompt(*partes: str) -> str:
+    """Identificador curto do prompt/modelo (hash de todas as partes estáticas)."""
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(parte.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+class LlmCache:
+    """Cache Redis de `dados_brutos` por (versão do prompt, hash do corpo)."""
+
+    def __init__(self, versao: str, ttl_seconds: Optional[int] = None, redis_conn=None) -> None:
+        self.versao = versao
+        self.ttl_seconds = int(
+            ttl_seconds if ttl_seconds is not None else os.getenv("LLM_CACHE_TTL_SECONDS", 30 * 24 * 3600)
+        )
+        self.enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() != "false"
+        self._redis = redis_conn
+        self._stats = {"hits": 0, "misses": 0, "errors": 0}
+
+    def _conn(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    def chave(self, corpo_email: str) -> str:
+        digest = hashlib.sha256(normalizar_corpo(corpo_email).encode("utf-8")).hexdigest()
+        return f"{_PREFIXO}:{self.versao}:{digest}"
+
+    def get(self, corpo_email: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        try:
+            valor = self._conn().get(self.chave(corpo_email))
+        except Exception as e:
+            # Cache indisponível nunca deve impedir a extração
+            self._stats["errors"] += 1
+            logger.warning(f"Cache de extração LLM indisponível: {e}")
+            return None
+        contar_cache("llm", valor is not None)
+        if valor is None:
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        return json.loads(valor)
+
+    def set(self, corpo_email: str, dados_brutos: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._conn().set(self.chave(corpo_email), json.dumps(dados_brutos), ex=self.ttl_seconds)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning(f"Falha ao guardar extração LLM na cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        consultas = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / consultas if consultas else 0.0
+        return stats
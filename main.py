@@ -1,21 +1,72 @@
 import dotenv
 dotenv.load_dotenv()
-from redis import Redis
+import argparse
+import imaplib
+import os
+import time
 from rq import Queue, Retry
-from email_reader import obter_emails
-from tasks import processar_email_task, on_failure
+from email_reader import obter_emails, conectar_imap, ler_emails_novos, confirmar_emails, aguardar_novos_emails
+from tasks import (
+    CALLBACK_FALHA, PIPELINE_ETAPAS, enfileirar_pipelines, libertar_emails, processar_email_task,
+    referenciar_corpo, reservar_emails,
+)
 from logger_config import logger
+from redis_client import get_redis
 
 # Carregar variáveis do .env
 dotenv.load_dotenv()
 
-# Conectar ao Redis e configurar a fila principal
-redis_conn = Redis()
+# Conectar ao Redis (REDIS_URL, o mesmo que os workers usam) e configurar a fila principal
+redis_conn = get_redis()
 q = Queue(connection=redis_conn, default_timeout=3600)
 
 # Configurar a fila de falhas
 failed_queue = Queue("failed", connection=redis_conn)
 
+# Modo contínuo (IMAP IDLE): os servidores terminam IDLE ao fim de ~29 min, por isso renovamos antes
+IMAP_IDLE_TIMEOUT_SECONDS = float(os.getenv("IMAP_IDLE_TIMEOUT_SECONDS", 25 * 60))
+IMAP_RECONNECT_MAX_SECONDS = float(os.getenv("IMAP_RECONNECT_MAX_SECONDS", 300))
+
+def enfileirar_emails(emails):
+    """
+    Enfileira o processamento de cada e-mail. Retorna o número de e-mails enfileirados.
+    O lote inteiro segue numa única ida ao Redis (pipeline), e os corpos grandes são
+    gravados uma vez sob o seu hash (`tasks.referenciar_corpo`). Os e-mails já enfileirados
+    antes são descartados, e os jobs têm IDs determinísticos (`tasks.reservar_emails`).
+    """
+    if not emails:
+        return 0
+    if PIPELINE_ETAPAS:
+        # Uma fila por etapa (extracao → cotacao → envio → ingestao), ver tasks.enfileirar_pipelines
+        por_email = enfileirar_pipelines(emails, redis_conn)
+        for jobs in por_email:
+            logger.info(f"Pipeline {jobs[0].args[0]} enfileirado para o e-mail de {jobs[0].args[1]['remetente']}")
+        return len(por_email)
+
+    novos = reservar_emails(emails, redis_conn)
+    if not novos:
+        return 0
+    try:
+        with redis_conn.pipeline() as pipe:
+            jobs = q.enqueue_many(
+                [
+                    # Política de retentativa: 3 vezes em intervalos de 10s, 30s, 60s
+                    Queue.prepare_data(
+                        processar_email_task, (referenciar_corpo(email, pipe),), job_id=f"{email['pipeline_id']}-email",
+                        on_failure=CALLBACK_FALHA, retry=Retry(max=3, interval=[10, 30, 60]),
+                    )
+                    for email in novos
+                ],
+                pipeline=pipe,
+            )
+            pipe.execute()
+    except Exception:
+        libertar_emails(novos, redis_conn)
+        raise
+    for email, job in zip(novos, jobs):
+        logger.info(f"Tarefa {job.id} enfileirada para o e-mail de {email['remetente']}")
+    return len(novos)
+
 def main():
     """
     Lê e-mails e enfileira tarefas para serem processadas pelos workers.
@@ -31,15 +82,9 @@ def main():
 
         logger.info(f"{len(emails)} e-mails novos encontrados. Enfileirando tarefas...")
 
-        for email in emails:
-            # Enfileira a tarefa com política de retentativa e manipulador de falha
-            job = q.enqueue(
-                processar_email_task, 
-                email,
-                on_failure=on_failure,
-                retry=Retry(max=3, interval=[10, 30, 60]) # Tenta 3 vezes em intervalos de 10s, 30s, 60s
-            )
-            logger.info(f"Tarefa {job.id} enfileirada para o e-mail de {email['remetente']}")
+        enfileirar_emails(emails)
+        # Só depois de o lote estar no Redis: uma falha acima deixa os e-mails por ler
+        confirmar_emails(emails)
 
         logger.info(f"{len(emails)} tarefas foram adicionadas à fila com sucesso.")
 
@@ -49,5 +94,59 @@ def main():
     finally:
         logger.info("--- Fim do ciclo de verificação de e-mails ---")
 
+def escutar():
+    """
+    Modo contínuo: mantém uma ligação IMAP persistente em IDLE e enfileira e-mails novos
+    assim que o servidor notifica EXISTS. Volta a ligar-se com backoff exponencial.
+    """
+    logger.info("--- INICIANDO ESCUTA DE E-MAILS (IMAP IDLE) ---")
+    espera = 1.0
+    while True:
+        mail = None
+        try:
+            mail = conectar_imap()
+
+            # Recupera o que chegou enquanto não estávamos ligados
+            emails = ler_emails_novos(mail)
+            if emails:
+                logger.info(f"{enfileirar_emails(emails)} tarefas enfileiradas (recuperação).")
+                confirmar_emails(emails, mail)
+
+            while True:
+                novidades = aguardar_novos_emails(mail, IMAP_IDLE_TIMEOUT_SECONDS)
+                # Só um ciclo IDLE completo prova que a ligação está sã: reinicia o backoff
+                espera = 1.0
+                if novidades:
+                    emails = ler_emails_novos(mail)
+                    if emails:
+                        logger.info(f"{enfileirar_emails(emails)} tarefas enfileiradas.")
+                        confirmar_emails(emails, mail)
+
+        except KeyboardInterrupt:
+            logger.info("Escuta de e-mails interrompida.")
+            break
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.warning(f"Ligação IMAP perdida: {e}. Nova tentativa em {espera:.0f}s.")
+        except Exception as e:
+            logger.error(f"Erro inesperado na escuta de e-mails: {e}", exc_info=True)
+        finally:
+            if mail:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+
+        time.sleep(espera)
+        espera = min(espera * 2, IMAP_RECONNECT_MAX_SECONDS)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Produtor de tarefas de cotação a partir da caixa de e-mail.")
+    parser.add_argument(
+        "--escutar", action="store_true",
+        help="Fica ligado ao servidor IMAP (IDLE) e enfileira e-mails à medida que chegam.",
+    )
+    args = parser.parse_args()
+    if args.escutar:
+        escutar()
+    else:
+        main()
@@ -0,0 +1,357 @@
+"""
+Métricas de latência e débito do processamento de cotações, agregadas entre workers no Redis.
+
+Cada processo acumula as observações em memória: histogramas de duração por operação
+(rag_retrieval, ollama, normalizacao, tabela, api_fallback, geocoding, osrm, smtp,
+ingestao_rag), por tarefa RQ e de espera na fila, e contadores (caches, fonte das cotações,
+tarefas por resultado). No fim de cada tarefa (`medir_tarefa`), o acumulado é somado a um
+hash Redis (`cotacoes:metricas`) com HINCRBYFLOAT, numa única ida ao Redis. Assim, o custo
+por operação medida é só o de uma atualização de dicionário.
+
+A exportação junta os valores de todos os workers no formato de texto do Prometheus:
+    python3 metricas.py                                # imprime as métricas
+    python3 metricas.py --porta 9108                   # endpoint HTTP /metrics
+    python3 metricas.py --textfile /var/lib/node_exporter/textfile/cotacoes.prom
+    python3 metricas.py --limpar                       # repõe os contadores a zero
+
+Configuração (variáveis de ambiente):
+- METRICAS_ENABLED: "false" desativa a recolha (padrão: true)
+- METRICAS_PORTA: porta do endpoint HTTP (padrão: 9108)
+- METRICAS_INTERVALO_SECONDS: intervalo de escrita do textfile (padrão: 15)
+"""
+from __future__ import annotations
+
+import argparse
+import bisect
+import functools
+import os
+import tempfile
+import threading
+import time
+from contextlib import ContextDecorator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+from logger_config import logger
+from redis_client import get_redis
+
+METRICAS_ENABLED = os.getenv("METRICAS_ENABLED", "true").lower() != "false"
+METRICAS_PORTA = int(os.getenv("METRICAS_PORTA", 9108))
+METRICAS_INTERVALO_SECONDS = float(os.getenv("METRICAS_INTERVALO_SECONDS", 15))
+
+_CHAVE = "cotacoes:metricas"
+# Da pesquisa na tabela (µs) à chamada ao Ollama com a fila cheia (minutos)
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10, 30, 60, 120, 300)
+
+METRICAS = {
+    "cotacoes_operacao_segundos": ("histogram", "Duração de cada operação do processamento de um e-mail."),
+    "cotacoes_operacao_erros_total": ("counter", "Operações terminadas com exceção."),
+    "cotacoes_tarefa_segundos": ("histogram", "Tempo de execução de cada tarefa RQ."),
+    "cotacoes_tarefas_total": ("counter", "Tarefas RQ terminadas, por resultado (ok/erro)."),
+    "cotacoes_fila_espera_segundos": ("histogram", "Tempo entre a entrada do job na fila e o início da execução."),
+    "cotacoes_worker_overhead_segundos": ("histogram", "Tempo de cada job no worker para além da sua execução."),
+    "cotacoes_cache_total": ("counter", "Consultas às caches, por resultado (hit/miss)."),
+    "cotacoes_cotacoes_total": ("counter", "Cotações calculadas, por fonte (tabela/api/nenhuma)."),
+}
+
+_Serie = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = threading.Lock()
+# (nome, labels) -> total (contadores) ou [contagens por bucket..., +Inf, soma, n] (histogramas)
+_buffer: Dict[_Serie, Any] = {}
+_aviso_publicacao = False
+
+
+def _reiniciar_no_filho() -> None:
+    # O filho não herda observações do pai (o pai publica as suas) nem um lock possivelmente preso
+    global _lock, _buffer
+    _lock = threading.Lock()
+    _buffer = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_no_filho)
+
+
+def _serie(nome: str, labels: Dict[str, Any]) -> _Serie:
+    return nome, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def incrementar(nome: str, valor: float = 1, **labels: Any) -> None:
+    """Soma `valor` ao contador `nome` com os labels dados."""
+    if not METRICAS_ENABLED:
+        return
+    serie = _serie(nome, labels)
+    with _lock:
+        _buffer[serie] = _buffer.get(serie, 0) + valor
+
+
+def observar(nome: str, valor: float, **labels: Any) -> None:
+    """Regista uma observação (em segundos) no histograma `nome`."""
+    if not METRICAS_ENABLED:
+        return
+    serie = _serie(nome, labels)
+    indice = bisect.bisect_left(BUCKETS, valor)
+    with _lock:
+        contagens = _buffer.get(serie)
+        if contagens is None:
+            contagens = _buffer[serie] = [0] * (len(BUCKETS) + 3)
+        contagens[indice] += 1
+        contagens[-2] += valor
+        contagens[-1] += 1
+
+
+def contar_cache(cache: str, acerto: bool) -> None:
+    incrementar("cotacoes_cache_total", cache=cache, resultado="hit" if acerto else "miss")
+
+
+class medir(ContextDecorator):
+    """
+    Mede a duração de uma operação em `cotacoes_operacao_segundos{operacao=...}`; uma
+    exceção conta também em `cotacoes_operacao_erros_total`. Serve como `with` ou decorador.
+    """
+
+    def __init__(self, operacao: str) -> None:
+        self.operacao = operacao
+
+    def _recreate_cm(self):
+        # Como decorador, cada chamada usa uma instância nova (chamadas concorrentes ou aninhadas)
+        return medir(self.operacao)
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        duracao = time.perf_counter() - self._inicio
+        observar("cotacoes_operacao_segundos", duracao, operacao=self.operacao)
+        if tipo is not None:
+            incrementar("cotacoes_operacao_erros_total", operacao=self.operacao)
+        return False
+
+
+def _registar_espera_na_fila() -> None:
+    try:
+        from rq import get_current_job
+
+        job = get_current_job()
+    except Exception:
+        return
+    if job is not None and job.enqueued_at and job.started_at:
+        espera = (job.started_at - job.enqueued_at).total_seconds()
+        observar("cotacoes_fila_espera_segundos", max(espera, 0.0), fila=job.origin)
+
+
+def medir_tarefa(tarefa: str):
+    """
+    Decorador das tarefas RQ: espera na fila, duração, resultado e publicação no Redis do
+    que o processo acumulou. Num worker com fork, o filho termina sem correr `atexit`,
+    por isso a publicação é feita aqui, no fim de cada tarefa.
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def envolvida(*args, **kwargs):
+            if not METRICAS_ENABLED:
+                return func(*args, **kwargs)
+            _registar_espera_na_fila()
+            inicio = time.perf_counter()
+            resultado = "erro"
+            try:
+                valor = func(*args, **kwargs)
+                resultado = "ok"
+                return valor
+            finally:
+                observar("cotacoes_tarefa_segundos", time.perf_counter() - inicio, tarefa=tarefa)
+                incrementar("cotacoes_tarefas_total", tarefa=tarefa, resultado=resultado)
+                publicar()
+        return envolvida
+    return decorador
+
+
+def _formatar_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    def escapar(valor: str) -> str:
+        return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{k}="{escapar(v)}"' for k, v in labels)
+
+
+def _formatar_le(limite: float) -> str:
+    return "+Inf" if limite == float("inf") else f"{limite:g}"
+
+
+def _campos(buffer: Dict[_Serie, Any]) -> Dict[str, float]:
+    """Campos do hash Redis: `nome\\tsufixo\\tlabels\\tle` -> incremento (buckets já cumulativos)."""
+    campos = {}
+    for (nome, labels), valor in buffer.items():
+        texto = _formatar_labels(labels)
+        if not isinstance(valor, list):
+            campos[f"{nome}\t\t{texto}\t"] = valor
+            continue
+        acumulado = 0
+        for limite, contagem in zip(BUCKETS + (float("inf"),), valor[:-2]):
+            acumulado += contagem
+            campos[f"{nome}\tbucket\t{texto}\t{_formatar_le(limite)}"] = acumulado
+        campos[f"{nome}\tsum\t{texto}\t"] = valor[-2]
+        campos[f"{nome}\tcount\t{texto}\t"] = valor[-1]
+    return campos
+
+
+def _juntar(buffer: Dict[_Serie, Any]) -> None:
+    for serie, valor in buffer.items():
+        atual = _buffer.get(serie)
+        if atual is None:
+            _buffer[serie] = valor
+        elif isinstance(valor, list):
+            _buffer[serie] = [a + b for a, b in zip(atual, valor)]
+        else:
+            _buffer[serie] = atual + valor
+
+
+def publicar(conexao=None) -> None:
+    """Soma ao Redis o que este processo acumulou desde a última publicação."""
+    global _buffer, _aviso_publicacao
+    with _lock:
+        if not _buffer:
+            return
+        pendente, _buffer = _buffer, {}
+    try:
+        pipe = (conexao if conexao is not None else get_redis()).pipeline(transaction=False)
+        for campo, incremento in _campos(pendente).items():
+            pipe.hincrbyfloat(_CHAVE, campo, incremento)
+        pipe.execute()
+    except Exception as e:
+        # Fica para a próxima publicação; métricas nunca devem interromper uma tarefa
+        with _lock:
+            _juntar(pendente)
+        if not _aviso_publicacao:
+            logger.warning(f"Métricas não publicadas no Redis ({e}); ficam em memória até à próxima tentativa.")
+            _aviso_publicacao = True
+
+
+def _valor(valor: float) -> str:
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+def _ordem(campo: Tuple[str, str, str, str]):
+    nome, sufixo, labels, le = campo
+    ordem_sufixo = {"bucket": 0, "sum": 1, "count": 2}.get(sufixo, 0)
+    return nome, labels, ordem_sufixo, float(le) if le else 0.0
+
+
+def exportar_prometheus(conexao=None) -> str:
+    """Métricas agregadas de todos os workers, no formato de texto do Prometheus."""
+    conexao = conexao if conexao is not None else get_redis()
+    campos = []
+    for campo, valor in conexao.hgetall(_CHAVE).items():
+        campo = campo.decode("utf-8") if isinstance(campo, bytes) else campo
+        partes = campo.split("\t")
+        if len(partes) == 4 and partes[0] in METRICAS:
+            campos.append((tuple(partes), float(valor)))
+    campos.sort(key=lambda item: _ordem(item[0]))
+
+    linhas: List[str] = []
+    familia = None
+    caches: Dict[str, Dict[str, float]] = {}
+    for (nome, sufixo, labels, le), valor in campos:
+        if nome != familia:
+            tipo, ajuda = METRICAS[nome]
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+            familia = nome
+        todos = ",".join(filter(None, [labels, f'le="{le}"' if le else ""]))
+        amostra = f"{nome}_{sufixo}" if sufixo else nome
+        linhas.append(f"{amostra}{{{todos}}} {_valor(valor)}" if todos else f"{amostra} {_valor(valor)}")
+        if nome == "cotacoes_cache_total":
+            cache = labels.split('cache="', 1)[1].split('"', 1)[0]
+            resultado = "hit" if 'resultado="hit"' in labels else "miss"
+            caches.setdefault(cache, {"hit": 0.0, "miss": 0.0})[resultado] += valor
+
+    if caches:
+        linhas += [
+            "# HELP cotacoes_cache_taxa_acerto Fração das consultas a cada cache resolvidas pela cache.",
+            "# TYPE cotacoes_cache_taxa_acerto gauge",
+        ]
+        for cache, contagens in sorted(caches.items()):
+            total = contagens["hit"] + contagens["miss"]
+            linhas.append(f'cotacoes_cache_taxa_acerto{{cache="{cache}"}} {_valor(contagens["hit"] / total if total else 0.0)}')
+
+    try:
+        from rq import Queue
+
+        filas = sorted(Queue.all(connection=conexao), key=lambda fila: fila.name)
+    except Exception as e:
+        logger.warning(f"Não foi possível ler o tamanho das filas RQ: {e}")
+        filas = []
+    if filas:
+        linhas += ["# HELP cotacoes_fila_jobs Jobs à espera em cada fila RQ.", "# TYPE cotacoes_fila_jobs gauge"]
+        for fila in filas:
+            linhas.append(f'cotacoes_fila_jobs{{fila="{fila.name}"}} {fila.count}')
+    return "\n".join(linhas) + "\n"
+
+
+def limpar(conexao=None) -> None:
+    (conexao if conexao is not None else get_redis()).delete(_CHAVE)
+
+
+def escrever_textfile(caminho: str) -> None:
+    """Escreve as métricas para o textfile collector do node_exporter (escrita atómica)."""
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    fd, temporario = tempfile.mkstemp(dir=diretorio, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(exportar_prometheus())
+    os.replace(temporario, caminho)
+
+
+class _Endpoint(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            corpo = exportar_prometheus().encode("utf-8")
+        except Exception as e:
+            self.send_error(503, f"Redis indisponível: {e}")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def servir(porta: int, endereco: str = "") -> None:
+    servidor = ThreadingHTTPServer((endereco, porta), _Endpoint)
+    logger.info(f"Métricas Prometheus em http://{endereco or '0.0.0.0'}:{porta}/metrics")
+    servidor.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta as métricas do pipeline de cotações (formato Prometheus).")
+    parser.add_argument(
+        "--porta", type=int, nargs="?", const=METRICAS_PORTA,
+        help=f"Serve /metrics por HTTP (padrão: METRICAS_PORTA={METRICAS_PORTA}).",
+    )
+    parser.add_argument("--textfile", help="Escreve periodicamente para este ficheiro (textfile collector).")
+    parser.add_argument(
+        "--intervalo", type=float, default=METRICAS_INTERVALO_SECONDS,
+        help="Intervalo de escrita do textfile, em segundos (padrão: METRICAS_INTERVALO_SECONDS).",
+    )
+    parser.add_argument("--limpar", action="store_true", help="Repõe todas as métricas a zero.")
+    args = parser.parse_args()
+
+    if args.limpar:
+        limpar()
+    elif args.porta is not None:
+        servir(args.porta)
+    elif args.textfile:
+        while True:
+            try:
+                escrever_textfile(args.textfile)
+            except Exception as e:
+                logger.warning(f"Falha ao escrever as métricas em {args.textfile}: {e}")
+            time.sleep(args.intervalo)
+    else:
+        print(exportar_prometheus(), end="")
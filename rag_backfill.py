@@ -0,0 +1,148 @@
+"""
+Backfill do RAG store a partir de um arquivo de e-mails antigos.
+
+O arquivo é um ficheiro JSONL com um registo por linha, num de dois formatos:
+- {"text": "...", "metadata": {...}}
+- um dicionário de e-mail como o produzido por `email_reader` ({"assunto", "corpo", ...})
+
+Os registos são ingeridos em lotes via `rag_store.ingest_emails` (embedding em lote e
+escrita em massa). Após cada lote, o número de linhas já processadas é guardado num
+ficheiro de progresso, pelo que uma execução interrompida retoma onde parou.
+Os IDs dos documentos são derivados do conteúdo, pelo que reprocessar um lote não
+duplica entradas.
+
+Uso:
+    python3 rag_backfill.py arquivo.jsonl [--batch-size 64] [--progresso ficheiro] [--reiniciar]
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from logger_config import logger
+from rag_store import RAG_INGEST_BATCH_SIZE, ingest_emails, ingest_stats
+
+
+def registo_para_documento(registo: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Converte um registo do arquivo em (texto, metadados), ou None se não tiver texto."""
+    if "text" in registo:
+        texto = registo.get("text") or ""
+        metadata = dict(registo.get("metadata") or {})
+    else:
+        # Mesmo formato de texto usado na ingestão em `tasks.processar_email_task`
+        texto = f"Assunto: {registo.get('assunto', '')}\nCorpo: {registo.get('corpo', '')}"
+        metadata = {"fonte": "arquivo"}
+        if registo.get("remetente"):
+            metadata["remetente"] = registo["remetente"]
+        if not (registo.get("corpo") or "").strip():
+            texto = ""
+    if not texto.strip():
+        return None
+    metadata.setdefault("id", "backfill:" + hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32])
+    return texto, metadata
+
+
+def ler_progresso(caminho: str) -> int:
+    try:
+        with open(caminho, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("linhas_processadas", 0))
+    except FileNotFoundError:
+        return 0
+
+
+def guardar_progresso(caminho: str, linhas_processadas: int) -> None:
+    # Escrita atómica: uma interrupção a meio nunca deixa o ficheiro corrompido
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump({"linhas_processadas": linhas_processadas}, f)
+    os.replace(temporario, caminho)
+
+
+def _lotes_do_arquivo(caminho: str, saltar: int, batch_size: int) -> Iterator[Tuple[int, List[Tuple[str, Dict[str, Any]]]]]:
+    """Gera (número da última linha lida, documentos do lote), a partir da linha `saltar`."""
+    lote: List[Tuple[str, Dict[str, Any]]] = []
+    linha_atual = 0
+    with open(caminho, "r", encoding="utf-8") as f:
+        for linha_atual, linha in enumerate(f, start=1):
+            if linha_atual <= saltar or not linha.strip():
+                continue
+            try:
+                documento = registo_para_documento(json.loads(linha))
+            except (json.JSONDecodeError, AttributeError) as e:
+                logger.warning(f"Linha {linha_atual} ignorada no backfill: {e}")
+                continue
+            if documento is not None:
+                lote.append(documento)
+            if len(lote) >= batch_size:
+                yield linha_atual, lote
+                lote = []
+    if lote or linha_atual > saltar:
+        yield linha_atual, lote
+
+
+def backfill(
+    caminho: str,
+    batch_size: Optional[int] = None,
+    caminho_progresso: Optional[str] = None,
+    reiniciar: bool = False,
+) -> Dict[str, Any]:
+    """Ingere o arquivo no RAG store, retomando do último lote confirmado."""
+    batch_size = batch_size or RAG_INGEST_BATCH_SIZE
+    caminho_progresso = caminho_progresso or caminho + ".progresso.json"
+    saltar = 0 if reiniciar else ler_progresso(caminho_progresso)
+    if saltar:
+        logger.info(f"Backfill RAG: a retomar após a linha {saltar}.")
+
+    with open(caminho, "r", encoding="utf-8") as f:
+        total_linhas = sum(1 for _ in f)
+
+    duplicados_antes = ingest_stats()["duplicados"]
+    inicio = time.perf_counter()
+    documentos = 0
+    linhas_processadas = saltar
+    for linhas_processadas, lote in _lotes_do_arquivo(caminho, saltar, batch_size):
+        if lote:
+            ingest_emails(lote, batch_size)
+            documentos += len(lote)
+        guardar_progresso(caminho_progresso, linhas_processadas)
+
+        decorrido = time.perf_counter() - inicio
+        taxa = documentos / decorrido if decorrido > 0 else 0.0
+        restantes = total_linhas - linhas_processadas
+        logger.info(
+            f"Backfill RAG: {linhas_processadas}/{total_linhas} linhas, {documentos} documentos, "
+            f"{taxa:.1f} docs/s, ~{restantes / taxa if taxa else 0:.0f}s restantes"
+        )
+
+    decorrido = time.perf_counter() - inicio
+    resumo = {
+        "documentos": documentos,
+        "linhas_processadas": linhas_processadas,
+        "total_linhas": total_linhas,
+        "segundos": round(decorrido, 3),
+        "docs_por_segundo": round(documentos / decorrido, 1) if decorrido > 0 else 0.0,
+        # Quase-duplicados de documentos já existentes, não ingeridos
+        "duplicados": ingest_stats()["duplicados"] - duplicados_antes,
+    }
+    logger.info(f"Backfill RAG concluído: {resumo}")
+    return resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingere um arquivo JSONL de e-mails antigos no RAG store.")
+    parser.add_argument("arquivo", help="Ficheiro JSONL com um e-mail/documento por linha.")
+    parser.add_argument(
+        "--batch-size", type=int, default=None,
+        help=f"Documentos por lote de embedding/escrita (padrão: RAG_INGEST_BATCH_SIZE={RAG_INGEST_BATCH_SIZE}).",
+    )
+    parser.add_argument(
+        "--progresso", default=None,
+        help="Ficheiro de progresso para retomar (padrão: <arquivo>.progresso.json).",
+    )
+    parser.add_argument("--reiniciar", action="store_true", help="Ignora o progresso guardado e começa do início.")
+    args = parser.parse_args()
+    backfill(args.arquivo, args.batch_size, args.progresso, args.reiniciar)
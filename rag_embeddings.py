@@ -0,0 +1,249 @@
+"""
+Backends de embeddings para o RagStore, escolhidos por configuração (RAG_EMBED_BACKEND).
+
+- "huggingface" (padrão): `HuggingFaceEmbedding` do LlamaIndex (PyTorch em CPU).
+- "onnx": o mesmo modelo exportado para ONNX e executado com ONNX Runtime. A tokenização
+  usa `tokenizers`, e o mean pooling e a normalização L2 são feitos em NumPy. Não importa
+  PyTorch, pelo que o arranque é mais rápido e cada worker ocupa menos memória.
+- "onnx-int8": como "onnx", com os pesos quantizados dinamicamente para int8. A
+  quantização é feita localmente na primeira utilização e guardada em RAG_ONNX_CACHE_DIR.
+
+Os backends ONNX reproduzem o pipeline do sentence-transformers: mean pooling sobre a
+máscara de atenção, normalização L2 e truncagem a RAG_EMBED_MAX_LENGTH tokens. Os
+vetores ficam por isso no mesmo espaço das coleções criadas com "huggingface", o que
+permite trocar de backend sem reingerir. A diferença em relação ao PyTorch é medida por
+`benchmarks/bench_embeddings.py`.
+
+Configuração (variáveis de ambiente):
+- RAG_EMBED_BACKEND: "huggingface" | "onnx" | "onnx-int8" (padrão: huggingface)
+- RAG_EMBED_MAX_LENGTH: tokens por texto (padrão: 256, como o all-MiniLM-L6-v2)
+- RAG_ONNX_MODEL_PATH: ficheiro .onnx local (padrão: `onnx/model.onnx` do repositório do modelo)
+- RAG_ONNX_TOKENIZER_PATH: tokenizer.json local (padrão: o do repositório do modelo)
+- RAG_ONNX_CACHE_DIR: onde guardar o modelo quantizado (padrão: ~/.cache/cotacoes_ai/onnx)
+- RAG_ONNX_THREADS: threads intra-op do ONNX Runtime (padrão: 0, decidido pelo runtime)
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from logger_config import logger
+
+RAG_EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "huggingface").lower()
+RAG_EMBED_MAX_LENGTH = int(os.getenv("RAG_EMBED_MAX_LENGTH", 256))
+RAG_ONNX_CACHE_DIR = os.path.expanduser(os.getenv("RAG_ONNX_CACHE_DIR") or "~/.cache/cotacoes_ai/onnx")
+RAG_ONNX_THREADS = int(os.getenv("RAG_ONNX_THREADS", 0))
+
+BACKENDS = ("huggingface", "onnx", "onnx-int8")
+MODELO_PADRAO = "sentence-transformers/all-MiniLM-L6-v2"
+
+_embedders: Dict[Tuple[str, str], Any] = {}
+_embedders_lock = threading.Lock()
+
+
+def verificar_dependencias(backend: Optional[str] = None) -> None:
+    """
+    Importa o que o backend precisa; levanta ImportError se faltar alguma dependência,
+    ValueError para um backend desconhecido e FileNotFoundError se RAG_ONNX_MODEL_PATH ou
+    RAG_ONNX_TOKENIZER_PATH apontarem para um ficheiro que não existe.
+    """
+    backend = (backend or RAG_EMBED_BACKEND).lower()
+    if backend == "huggingface":
+        import llama_index.embeddings.huggingface  # noqa: F401
+    elif backend in ("onnx", "onnx-int8"):
+        for variavel in ("RAG_ONNX_MODEL_PATH", "RAG_ONNX_TOKENIZER_PATH"):
+            caminho = os.getenv(variavel)
+            if caminho and not os.path.isfile(caminho):
+                raise FileNotFoundError(f"{variavel} não existe: {caminho}")
+        import onnxruntime  # noqa: F401
+        import tokenizers  # noqa: F401
+    else:
+        raise ValueError(f"RAG_EMBED_BACKEND desconhecido: {backend!r} (opções: {', '.join(BACKENDS)})")
+
+
+def mean_pooling(token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """Média dos vetores dos tokens reais (máscara de atenção), como no sentence-transformers."""
+    mascara = attention_mask[..., None].astype(token_embeddings.dtype)
+    soma = (token_embeddings * mascara).sum(axis=1)
+    return soma / np.clip(mascara.sum(axis=1), 1e-9, None)
+
+
+def normalizar_l2(vetores: np.ndarray) -> np.ndarray:
+    normas = np.linalg.norm(vetores, axis=1, keepdims=True)
+    return vetores / np.clip(normas, 1e-12, None)
+
+
+def _descarregar(model_name: str, ficheiro: str) -> str:
+    from huggingface_hub import hf_hub_download
+
+    return hf_hub_download(model_name, ficheiro)
+
+
+def quantizar_int8(modelo_path: str, cache_dir: Optional[str] = None) -> str:
+    """Quantização dinâmica (pesos int8) do modelo ONNX; reaproveita o resultado em cache."""
+    cache_dir = cache_dir or RAG_ONNX_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    origem = os.path.realpath(modelo_path)
+    nome = os.path.splitext(os.path.basename(origem))[0]
+    # O caminho de origem entra no nome para não misturar modelos diferentes com o mesmo ficheiro
+    sufixo = hashlib.sha256(origem.encode("utf-8")).hexdigest()[:12]
+    destino = os.path.join(cache_dir, f"{nome}_{sufixo}_int8.onnx")
+    if not os.path.exists(destino):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info(f"A quantizar {modelo_path} para int8 ({destino})...")
+        # Vários workers podem arrancar ao mesmo tempo: escreve num temporário e troca
+        temporario = f"{destino}.{os.getpid()}.tmp.onnx"
+        quantize_dynamic(modelo_path, temporario, weight_type=QuantType.QInt8)
+        os.replace(temporario, destino)
+    return destino
+
+
+class OnnxEncoder:
+    """Codificador de frases com ONNX Runtime; devolve vetores normalizados (float32)."""
+
+    def __init__(
+        self,
+        model_name: str,
+        quantizado: bool = False,
+        modelo_path: Optional[str] = None,
+        tokenizer_path: Optional[str] = None,
+        max_length: Optional[int] = None,
+        threads: Optional[int] = None,
+    ) -> None:
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        modelo_path = modelo_path or os.getenv("RAG_ONNX_MODEL_PATH") or _descarregar(model_name, "onnx/model.onnx")
+        tokenizer_path = (
+            tokenizer_path or os.getenv("RAG_ONNX_TOKENIZER_PATH") or _descarregar(model_name, "tokenizer.json")
+        )
+        if quantizado:
+            modelo_path = quantizar_int8(modelo_path)
+
+        self._tokenizer = Tokenizer.from_file(tokenizer_path)
+        self._tokenizer.enable_truncation(max_length or RAG_EMBED_MAX_LENGTH)
+        # O padding é feito por lote, depois de ordenar por comprimento
+        self._tokenizer.no_padding()
+        self._pad_id = self._tokenizer.token_to_id("[PAD]") or 0
+
+        self._opcoes = ort.SessionOptions()
+        threads = RAG_ONNX_THREADS if threads is None else threads
+        if threads:
+            self._opcoes.intra_op_num_threads = threads
+        self._opcoes.inter_op_num_threads = 1
+        # Os bytes do modelo ficam em memória (partilhados com os filhos de um fork por
+        # copy-on-write); a sessão não sobrevive a um fork (thread pool do runtime), por
+        # isso é criada em cada processo na primeira utilização
+        with open(modelo_path, "rb") as f:
+            self._modelo = f.read()
+        self._sessao_cache = None
+        self._sessao_pid: Optional[int] = None
+        self._entradas: set = set()
+
+    @property
+    def _sessao(self):
+        if self._sessao_cache is None or self._sessao_pid != os.getpid():
+            import onnxruntime as ort
+
+            self._sessao_cache = ort.InferenceSession(self._modelo, self._opcoes, providers=["CPUExecutionProvider"])
+            self._sessao_pid = os.getpid()
+            self._entradas = {i.name for i in self._sessao_cache.get_inputs()}
+        return self._sessao_cache
+
+    def warm_up(self) -> None:
+        """Cria a sessão deste processo e corre uma inferência descartável."""
+        self.encode(["aquecimento"])
+
+    def encode(self, textos: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        codificados = self._tokenizer.encode_batch(list(textos))
+        # Lotes de comprimentos semelhantes desperdiçam menos computação em padding
+        ordem = sorted(range(len(codificados)), key=lambda i: len(codificados[i].ids))
+        resultado: List[Optional[np.ndarray]] = [None] * len(codificados)
+        for inicio in range(0, len(ordem), batch_size):
+            indices = ordem[inicio:inicio + batch_size]
+            comprimento = max(len(codificados[i].ids) for i in indices)
+            ids = np.full((len(indices), comprimento), self._pad_id, dtype=np.int64)
+            mascara = np.zeros((len(indices), comprimento), dtype=np.int64)
+            tipos = np.zeros((len(indices), comprimento), dtype=np.int64)
+            for linha, i in enumerate(indices):
+                n = len(codificados[i].ids)
+                ids[linha, :n] = codificados[i].ids
+                mascara[linha, :n] = 1
+                tipos[linha, :n] = codificados[i].type_ids
+            sessao = self._sessao
+            entradas = {"input_ids": ids, "attention_mask": mascara, "token_type_ids": tipos}
+            saida = sessao.run(None, {k: v for k, v in entradas.items() if k in self._entradas})[0]
+            vetores = normalizar_l2(mean_pooling(saida, mascara)).astype(np.float32)
+            for linha, i in enumerate(indices):
+                resultado[i] = vetores[linha]
+        if not resultado:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack(resultado)
+
+
+try:
+    from llama_index.core.base.embeddings.base import BaseEmbedding  # type: ignore
+    from llama_index.core.bridge.pydantic import PrivateAttr  # type: ignore
+except Exception:
+    BaseEmbedding = None
+
+if BaseEmbedding is not None:
+    class OnnxEmbedding(BaseEmbedding):
+        """Adaptador do `OnnxEncoder` para a interface de embeddings do LlamaIndex."""
+
+        _encoder: Any = PrivateAttr()
+
+        def __init__(self, encoder: OnnxEncoder, **kwargs: Any) -> None:
+            super().__init__(model_name=encoder.model_name, **kwargs)
+            self._encoder = encoder
+
+        @classmethod
+        def class_name(cls) -> str:
+            return "OnnxEmbedding"
+
+        def _get_query_embedding(self, query: str) -> List[float]:
+            return self._encoder.encode([query])[0].tolist()
+
+        def _get_text_embedding(self, text: str) -> List[float]:
+            return self._encoder.encode([text])[0].tolist()
+
+        def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+            return self._encoder.encode(texts).tolist()
+
+        async def _aget_query_embedding(self, query: str) -> List[float]:
+            return self._get_query_embedding(query)
+
+        async def _aget_text_embedding(self, text: str) -> List[float]:
+            return self._get_text_embedding(text)
+
+
+def criar_embedder(model_name: str, backend: Optional[str] = None):
+    """Cria o modelo de embeddings (interface LlamaIndex) para o backend configurado."""
+    backend = (backend or RAG_EMBED_BACKEND).lower()
+    verificar_dependencias(backend)
+    if backend == "huggingface":
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding  # type: ignore
+
+        return HuggingFaceEmbedding(model_name=model_name, device="cpu")
+    if BaseEmbedding is None:
+        raise ImportError("O backend ONNX no RagStore requer o LlamaIndex instalado")
+    return OnnxEmbedding(OnnxEncoder(model_name, quantizado=backend == "onnx-int8"))
+
+
+def obter_embedder(model_name: str = MODELO_PADRAO, backend: Optional[str] = None):
+    """Como `criar_embedder`, mas carrega cada (modelo, backend) uma só vez por processo.
+
+    Um worker pré-aquecido chama-a antes do fork: os pesos ficam carregados no processo pai
+    e os filhos reutilizam-nos em vez de os ler do disco em cada job.
+    """
+    chave = (model_name, (backend or RAG_EMBED_BACKEND).lower())
+    with _embedders_lock:
+        if chave not in _embedders:
+            _embedders[chave] = criar_embedder(*chave)
+        return _embedders[chave]
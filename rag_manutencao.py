@@ -0,0 +1,59 @@
+"""
+Manutenção periódica do RAG store: aplica a política de retenção (idade máxima, número
+máximo de documentos, opcionalmente por último acesso), remove em lotes e compacta o
+armazenamento (VACUUM do SQLite no Chroma; nova geração do log/índice no fallback).
+
+O VACUUM corre depois de fechado o cliente Chroma. Se falhar, a execução falha também
+(código de saída diferente de zero), para o cron ou o supervisor o notarem.
+
+Pode correr via cron (uma execução) ou ficar em ciclo com `--intervalo`.
+
+Uso:
+    python3 rag_manutencao.py [--intervalo SEGUNDOS] [--max-docs N] [--max-idade-dias D] [--lru]
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Any, Dict, Optional
+
+from logger_config import logger
+from rag_store import apply_retention, compact_storage
+
+
+def executar(
+    max_docs: Optional[int] = None,
+    max_age_days: Optional[float] = None,
+    lru: Optional[bool] = None,
+) -> Dict[str, Any]:
+    inicio = time.perf_counter()
+    resumo = dict(apply_retention(max_docs, max_age_days, lru))
+    resumo["compactado"] = bool(resumo["removidos_idade"] + resumo["removidos_capacidade"]) and compact_storage()
+    resumo["segundos"] = round(time.perf_counter() - inicio, 3)
+    logger.info(f"Manutenção do RAG concluída: {resumo}")
+    return resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aplica a retenção e compacta o RAG store.")
+    parser.add_argument(
+        "--intervalo", type=float, default=0,
+        help="Repete a manutenção a cada N segundos (padrão: executa uma vez).",
+    )
+    parser.add_argument("--max-docs", type=int, default=None, help="Padrão: RAG_MAX_DOCS.")
+    parser.add_argument("--max-idade-dias", type=float, default=None, help="Padrão: RAG_MAX_AGE_DAYS.")
+    parser.add_argument(
+        "--lru", action="store_true", default=None,
+        help="Acima do limite remove os menos recentemente devolvidos (padrão: RAG_EVICTION_LRU).",
+    )
+    args = parser.parse_args()
+    while True:
+        try:
+            executar(args.max_docs, args.max_idade_dias, args.lru)
+        except Exception as e:
+            if not args.intervalo:
+                raise
+            logger.error(f"Falha na manutenção do RAG: {e}", exc_info=True)
+        if not args.intervalo:
+            break
+        time.sleep(args.intervalo)
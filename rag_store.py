@@ -1,30 +1,253 @@
 """
 RAG Store: Usa ChromaDB + LlamaIndex quando disponíveis; caso contrário,
-fornece um fallback em memória baseado em difflib para ranking de similaridade.
+fornece um fallback com índice invertido e ranking BM25, persistido em disco (mmap).
 
 API:
 - add_document(email_text: str, metadata: dict) -> str
+- add_documents(items: list[tuple[str, dict]], batch_size: int | None = None) -> list[str]
 - query_context(query_text: str, top_k: int = 3) -> list[dict]
 - ingest_email(email_text: str, metadata: dict) -> str
+- ingest_emails(items: list[tuple[str, dict]], batch_size: int | None = None) -> list[str]
 - retrieve_similar(query_text: str, top_k: int = 3) -> list[dict]
+- warm_up(background: bool = False) -> threading.Thread | None
+- ingest_stats() -> dict  (documentos ingeridos e quase-duplicados suprimidos)
+- apply_retention(max_docs=None, max_age_days=None, lru=None) -> dict
+
+O store por omissão é criado na primeira utilização (carregar o modelo de embeddings e abrir
+o Chroma demora segundos). Chame `warm_up()` no arranque do worker, ou com `background=True`
+numa thread, para que a primeira consulta não pague esse custo.
 """
 from __future__ import annotations
 
+import hashlib
+import json
+import math
+import mmap
 import os
-from typing import List, Dict, Any, Optional
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Any, Optional, Sequence, Tuple
 from uuid import uuid4
 
-# Tenta importar o backend completo (ChromaDB + LlamaIndex). Se falhar, usa fallback.
+import numpy as np
+
+from logger_config import logger
+from metricas import contar_cache
+
+# Tamanho dos lotes de embedding/escrita na ingestão em massa
+RAG_INGEST_BATCH_SIZE = int(os.getenv("RAG_INGEST_BATCH_SIZE", 64))
+# Número de embeddings de consulta mantidos em memória (0 desativa)
+RAG_QUERY_EMBED_CACHE_SIZE = int(os.getenv("RAG_QUERY_EMBED_CACHE_SIZE", 1024))
+# Supressão de quase-duplicados na ingestão (distância de Hamming máxima entre SimHashes, até 7)
+RAG_DEDUP_ENABLED = os.getenv("RAG_DEDUP_ENABLED", "true").lower() != "false"
+RAG_DEDUP_MAX_HAMMING = min(int(os.getenv("RAG_DEDUP_MAX_HAMMING", 6)), 7)
+# Retenção (0 = sem limite): número máximo de documentos e idade máxima em dias
+RAG_MAX_DOCS = int(os.getenv("RAG_MAX_DOCS", 0))
+RAG_MAX_AGE_DAYS = float(os.getenv("RAG_MAX_AGE_DAYS", 0))
+# Acima de RAG_MAX_DOCS remove os menos recentemente devolvidos (true) ou os mais antigos (false)
+RAG_EVICTION_LRU = os.getenv("RAG_EVICTION_LRU", "false").lower() == "true"
+# Intervalo mínimo entre duas atualizações do último acesso do mesmo documento
+RAG_ACCESS_UPDATE_SECONDS = float(os.getenv("RAG_ACCESS_UPDATE_SECONDS", 3600))
+# Documentos por operação de leitura/remoção durante a retenção
+RAG_DELETE_BATCH_SIZE = int(os.getenv("RAG_DELETE_BATCH_SIZE", 500))
+
+from rag_embeddings import MODELO_PADRAO, RAG_EMBED_BACKEND, obter_embedder, verificar_dependencias
+
+
+def _backend_embeddings_disponivel() -> bool:
+    """
+    Verifica o backend de embeddings configurado. Sem ele, o RagStore usa o fallback BM25,
+    mas nunca em silêncio: com um backend escolhido explicitamente (ONNX) o motivo vai para
+    o log como erro, e com o padrão (huggingface) como aviso.
+    """
+    try:
+        verificar_dependencias()
+    except (ImportError, ValueError, OSError) as e:
+        registar = logger.warning if RAG_EMBED_BACKEND == "huggingface" else logger.error
+        registar(f"Backend de embeddings RAG_EMBED_BACKEND={RAG_EMBED_BACKEND!r} indisponível ({e}). A usar o fallback BM25.")
+        return False
+    return True
+
+
+# Tenta importar o backend completo (ChromaDB + LlamaIndex, dependências opcionais). Se faltar, usa fallback.
 _HAS_RAG_BACKEND = True
 try:
     import chromadb  # type: ignore
     from chromadb.config import Settings as ChromaSettings  # type: ignore
 
     from llama_index.core import VectorStoreIndex, StorageContext, Document, Settings  # type: ignore
-    from llama_index.embeddings.huggingface import HuggingFaceEmbedding  # type: ignore
+    from llama_index.core.ingestion import run_transformations  # type: ignore
+    from llama_index.core.schema import MetadataMode, QueryBundle  # type: ignore
     from llama_index.vector_stores.chroma import ChromaVectorStore  # type: ignore
-except Exception:
+except ImportError:
     _HAS_RAG_BACKEND = False
+else:
+    _HAS_RAG_BACKEND = _backend_embeddings_disponivel()
+
+
+def _validar_documento(email_text: str, metadata: Dict[str, Any]) -> None:
+    if not isinstance(email_text, str) or not email_text.strip():
+        raise ValueError("email_text deve ser uma string não vazia")
+    if not isinstance(metadata, dict):
+        raise ValueError("metadata deve ser um dict")
+
+
+_RE_SEPARADOR = re.compile(r"[^\w]+")
+
+# SimHash de 64 bits em 8 bandas de 8: duas assinaturas a distância <= 7 partilham
+# pelo menos uma banda, pelo que no Chroma basta procurar candidatos por banda igual
+_SIMHASH_BANDAS = 8
+_SIMHASH_BITS_BANDA = 8
+_SIMHASH_POSICOES = np.arange(64, dtype=np.uint64)
+
+# Metadados internos (dedup e retenção): ficam fora do texto que o LlamaIndex embute e
+# do que mostra ao LLM, para não alterarem os vetores nem gastarem tokens
+_METADADOS_INTERNOS = ["simhash", *(f"simhash_b{i}" for i in range(_SIMHASH_BANDAS)), "ingerido_em", "ultimo_acesso"]
+
+
+def _tokenizar(texto: str) -> List[str]:
+    """Quebra por caracteres não alfanuméricos e remove vazios."""
+    return [t for t in _RE_SEPARADOR.split(texto.lower()) if t]
+
+
+def simhash(texto: str) -> int:
+    """SimHash de 64 bits sobre palavras e bigramas (ponderados pela frequência)."""
+    tokens = _tokenizar(texto)
+    features = Counter(tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])])
+    if not features:
+        return 0
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "big") for f in features],
+        dtype=np.uint64,
+    )
+    pesos = np.array(list(features.values()), dtype=np.float64)
+    bits = ((hashes[:, None] >> _SIMHASH_POSICOES) & np.uint64(1)).astype(np.float64)
+    soma = (pesos[:, None] * (2 * bits - 1)).sum(axis=0)
+    return sum(1 << i for i in np.flatnonzero(soma > 0).tolist())
+
+
+def _bandas_simhash(assinatura: int) -> List[int]:
+    mascara = (1 << _SIMHASH_BITS_BANDA) - 1
+    return [(assinatura >> (_SIMHASH_BITS_BANDA * i)) & mascara for i in range(_SIMHASH_BANDAS)]
+
+
+def _distancia_hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _preparar_metadados(email_text: str, metadata: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[int]]:
+    """
+    Cópia dos metadados com os carimbos temporais (ingestão e último acesso) e, se a dedup
+    estiver ligada, a assinatura SimHash (hex) e as bandas. Devolve (metadata, assinatura).
+    """
+    metadata = dict(metadata)
+    metadata.setdefault("ingerido_em", time.time())
+    metadata.setdefault("ultimo_acesso", metadata["ingerido_em"])
+    if not RAG_DEDUP_ENABLED:
+        return metadata, None
+    assinatura = simhash(email_text)
+    metadata["simhash"] = f"{assinatura:016x}"
+    for i, banda in enumerate(_bandas_simhash(assinatura)):
+        metadata[f"simhash_b{i}"] = banda
+    return metadata, assinatura
+
+
+def _duplicado_no_lote(assinatura: int, lote: List[Tuple[int, str]]) -> Optional[str]:
+    for outra, doc_id in lote:
+        if _distancia_hamming(assinatura, outra) <= RAG_DEDUP_MAX_HAMMING:
+            return doc_id
+    return None
+
+
+def _politica_retencao(
+    max_docs: Optional[int], max_age_days: Optional[float], lru: Optional[bool]
+) -> Tuple[int, float, bool]:
+    return (
+        RAG_MAX_DOCS if max_docs is None else max_docs,
+        RAG_MAX_AGE_DAYS if max_age_days is None else max_age_days,
+        RAG_EVICTION_LRU if lru is None else lru,
+    )
+
+
+def _selecionar_para_remocao(
+    itens: Sequence[Tuple[Any, Dict[str, Any]]],
+    max_docs: int,
+    max_age_days: float,
+    lru: bool,
+    agora: float,
+) -> Tuple[List[Any], List[Any]]:
+    """
+    Aplica a política de retenção a (chave, metadados) e devolve (removidos por idade,
+    removidos por capacidade). Documentos sem carimbo de ingestão não expiram por idade
+    e são os primeiros a sair por capacidade; em empate sai o que aparece primeiro.
+    """
+    limite = agora - max_age_days * 86400 if max_age_days else None
+    por_idade, restantes = [], []
+    for chave, meta in itens:
+        ingerido = meta.get("ingerido_em")
+        if limite is not None and ingerido is not None and ingerido < limite:
+            por_idade.append(chave)
+        else:
+            restantes.append((chave, meta))
+
+    por_capacidade: List[Any] = []
+    if max_docs and len(restantes) > max_docs:
+        campo = "ultimo_acesso" if lru else "ingerido_em"
+        restantes.sort(key=lambda item: item[1].get(campo) or item[1].get("ingerido_em") or 0.0)
+        por_capacidade = [chave for chave, _ in restantes[:len(restantes) - max_docs]]
+    return por_idade, por_capacidade
+
+
+def _acessos_a_registar(acessos: Dict[str, float], doc_ids: Sequence[str], agora: float) -> List[str]:
+    """Documentos cujo último acesso conhecido é mais antigo que RAG_ACCESS_UPDATE_SECONDS."""
+    novos = []
+    for doc_id in doc_ids:
+        if agora - acessos.get(doc_id, 0.0) >= RAG_ACCESS_UPDATE_SECONDS:
+            acessos[doc_id] = agora
+            novos.append(doc_id)
+    return novos
+
+
+class _CacheEmbeddings:
+    """LRU texto da consulta -> vetor; e-mails repetidos ou reprocessados evitam o forward pass."""
+
+    def __init__(self, max_itens: int) -> None:
+        self.max_itens = max_itens
+        self._itens: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def obter(self, texto: str, calcular: Callable[[str], List[float]]) -> List[float]:
+        chave = re.sub(r"\s+", " ", texto).strip()
+        with self._lock:
+            encontrado = chave in self._itens
+            contar_cache("rag_embeddings", encontrado)
+            if encontrado:
+                self._itens.move_to_end(chave)
+                self._stats["hits"] += 1
+                return self._itens[chave]
+            self._stats["misses"] += 1
+        # Calculado fora do lock: consultas diferentes não esperam umas pelas outras
+        vetor = calcular(texto)
+        if self.max_itens > 0:
+            with self._lock:
+                self._itens[chave] = vetor
+                self._itens.move_to_end(chave)
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+        return vetor
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        consultas = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / consultas if consultas else 0.0
+        stats["itens"] = len(self._itens)
+        return stats
 
 
 if _HAS_RAG_BACKEND:
@@ -35,7 +258,7 @@ if _HAS_RAG_BACKEND:
             self,
             persist_path: str = "./rag_test_db",
             collection_name: str = "emails_cotacoes",
-            embed_model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+            embed_model_name: str = MODELO_PADRAO,
         ) -> None:
             # Garante diretório para persistência
             os.makedirs(persist_path, exist_ok=True)
@@ -54,8 +277,8 @@ if _HAS_RAG_BACKEND:
             # Evita backend MPS (Metal) no macOS em processos forkados do RQ
             os.environ.setdefault("PYTORCH_ENABLE_MPS_FALLBACK", "1")
 
-            # Embeddings locais via HuggingFace (sem serviços externos) em CPU
-            self._embed_model = HuggingFaceEmbedding(model_name=embed_model_name, device="cpu")
+            # Embeddings locais em CPU (sem serviços externos); backend em RAG_EMBED_BACKEND
+            self._embed_model = obter_embedder(embed_model_name)
             # Define embedder no Settings global do LlamaIndex e desativa LLM (não usamos LLM aqui)
             Settings.embed_model = self._embed_model
             Settings.llm = None
@@ -64,12 +287,22 @@ if _HAS_RAG_BACKEND:
             self._vector_store = ChromaVectorStore(chroma_collection=self._chroma_collection)
             self._storage_context = StorageContext.from_defaults(vector_store=self._vector_store)
 
-            # Cria o índice baseado no vector store existente (não reingere dados)
+            # Cria o índice baseado no vector store existente (não reingere dados). As mesmas
+            # transformações (node parser) servem a ingestão, para que os chunks sejam os do índice
+            self._transformations = Settings.transformations
             self._index = VectorStoreIndex.from_vector_store(
                 vector_store=self._vector_store,
                 storage_context=self._storage_context,
+                transformations=self._transformations,
             )
 
+            # Retrievers reutilizados por top_k e cache de embeddings das consultas
+            self._retrievers: Dict[int, Any] = {}
+            self._query_embeddings = _CacheEmbeddings(RAG_QUERY_EMBED_CACHE_SIZE)
+            self._ingest_stats = {"ingeridos": 0, "duplicados": 0}
+            # id do node -> último acesso já gravado por este processo
+            self._acessos: Dict[str, float] = {}
+
         # -------------------------
         # Public API
         # -------------------------
@@ -78,18 +311,96 @@ if _HAS_RAG_BACKEND:
             Adiciona um documento ao índice/ChromaDB.
             Retorna o ID do documento.
             """
-            if not isinstance(email_text, str) or not email_text.strip():
-                raise ValueError("email_text deve ser uma string não vazia")
-            if not isinstance(metadata, dict):
-                raise ValueError("metadata deve ser um dict")
-
-            # Gera um ID estável para o documento e retorna este ID, já que insert() pode não retornar
-            doc_id = metadata.get("id") or str(uuid4())
-            doc = Document(text=email_text, metadata=metadata, doc_id=doc_id)
-            # Insere no índice (irá persistir no Chroma via vector store)
-            self._index.insert(doc)
+            return self.add_documents([(email_text, metadata)])[0]
+
+        def add_documents(
+            self,
+            items: Sequence[Tuple[str, Dict[str, Any]]],
+            batch_size: Optional[int] = None,
+        ) -> List[str]:
+            """
+            Ingestão em massa: os documentos passam pelo node parser do índice (os mesmos chunks
+            de `VectorStoreIndex.insert`), os embeddings são calculados em lotes de `batch_size`
+            documentos sobre o texto que o LlamaIndex embute (`MetadataMode.EMBED`), e cada lote
+            é escrito no Chroma numa única operação.
+            Retorna os IDs dos documentos, pela ordem de entrada.
+            """
+            # Valida tudo antes do primeiro lote, como o fallback: um item inválido não deixa a ingestão a meio
+            for email_text, metadata in items:
+                _validar_documento(email_text, metadata)
+            batch_size = batch_size or RAG_INGEST_BATCH_SIZE
+            ids: List[str] = []
+            for inicio in range(0, len(items), batch_size):
+                lote = items[inicio:inicio + batch_size]
+                docs = []
+                # Os lotes anteriores já estão no Chroma; só o atual precisa de verificação local
+                assinaturas_lote: List[Tuple[int, str]] = []
+                for email_text, metadata in lote:
+                    metadata, assinatura = _preparar_metadados(email_text, metadata)
+                    if assinatura is not None:
+                        duplicado = _duplicado_no_lote(assinatura, assinaturas_lote) or self._procurar_duplicado(assinatura)
+                        if duplicado is not None:
+                            ids.append(self._registar_duplicado(duplicado))
+                            continue
+                    # ID estável do documento (os nodes referem-no em ref_doc_id)
+                    doc_id = metadata.get("id") or str(uuid4())
+                    if assinatura is not None:
+                        assinaturas_lote.append((assinatura, doc_id))
+                    docs.append(Document(
+                        text=email_text,
+                        metadata=metadata,
+                        doc_id=doc_id,
+                        excluded_embed_metadata_keys=list(_METADADOS_INTERNOS),
+                        excluded_llm_metadata_keys=list(_METADADOS_INTERNOS),
+                    ))
+                    ids.append(doc_id)
+                if not docs:
+                    continue
+                nodes = run_transformations(docs, self._transformations)
+                embeddings = self._embed_model.get_text_embedding_batch(
+                    [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+                )
+                for node, embedding in zip(nodes, embeddings):
+                    node.embedding = embedding
+                self._vector_store.add(nodes)
+                self._ingest_stats["ingeridos"] += len(docs)
+            return ids
+
+        def _procurar_duplicado(self, assinatura: int) -> Optional[str]:
+            """Procura no Chroma (filtro indexado por banda) um documento a distância <= limite."""
+            filtros = [{f"simhash_b{i}": banda} for i, banda in enumerate(_bandas_simhash(assinatura))]
+            candidatos = self._chroma_collection.get(where={"$or": filtros}, include=["metadatas"])
+            for chroma_id, meta in zip(candidatos["ids"], candidatos["metadatas"] or []):
+                meta = meta or {}
+                outra = meta.get("simhash")
+                if outra and _distancia_hamming(assinatura, int(outra, 16)) <= RAG_DEDUP_MAX_HAMMING:
+                    return meta.get("id") or meta.get("ref_doc_id") or chroma_id
+            return None
+
+        def _registar_duplicado(self, doc_id: str) -> str:
+            """
+            O documento existente volta a contar como recente: `ingerido_em` e `ultimo_acesso`
+            passam para agora em todos os seus nodes, para que a retenção não o remova enquanto
+            continuarem a chegar e-mails iguais.
+            """
+            self._ingest_stats["duplicados"] += 1
+            logger.debug(f"Documento quase duplicado de {doc_id} não foi ingerido no RAG.")
+            agora = time.time()
+            try:
+                ids = self._chroma_collection.get(where={"ref_doc_id": doc_id}, include=[])["ids"]
+                if ids:
+                    self._chroma_collection.update(
+                        ids=ids, metadatas=[{"ingerido_em": agora, "ultimo_acesso": agora} for _ in ids]
+                    )
+                    self._acessos[doc_id] = agora
+            except Exception as e:
+                logger.warning(f"Falha ao renovar o documento {doc_id} do RAG: {e}")
             return doc_id
 
+        def ingest_stats(self) -> Dict[str, int]:
+            """Documentos ingeridos e quase-duplicados suprimidos por este processo."""
+            return dict(self._ingest_stats)
+
         def query_context(self, query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
             """
             Consulta o índice por exemplos semelhantes. Retorna uma lista de entradas:
@@ -100,13 +411,15 @@ if _HAS_RAG_BACKEND:
             if top_k <= 0:
                 raise ValueError("top_k deve ser > 0")
 
-            # Cria query engine SEM LLM (apenas similaridade por embeddings)
-            qe = self._index.as_query_engine(similarity_top_k=top_k)
-            resp = qe.query(query_text)
+            # Só precisamos dos nodes: retriever direto (sem query engine/sintetizador),
+            # com o embedding da consulta já calculado para que não seja recalculado
+            embedding = self._query_embeddings.obter(query_text, self._embed_model.get_query_embedding)
+            nodes = self._retriever(top_k).retrieve(QueryBundle(query_str=query_text, embedding=embedding))
+            self._registar_acessos([sn.node.node_id for sn in nodes])
 
             results: List[Dict[str, Any]] = []
-            # source_nodes contém nodes com .text, .score e .metadata
-            for sn in getattr(resp, "source_nodes", []) or []:
+            # Cada node tem .text, .score e .metadata
+            for sn in nodes:
                 results.append(
                     {
                         "text": sn.text,
@@ -115,53 +428,570 @@ if _HAS_RAG_BACKEND:
                     }
                 )
             return results
+
+        def _registar_acessos(self, node_ids: List[str]) -> None:
+            """Atualiza `ultimo_acesso` nos metadados do Chroma (no máximo uma vez por intervalo)."""
+            agora = time.time()
+            ids = _acessos_a_registar(self._acessos, node_ids, agora)
+            if not ids:
+                return
+            try:
+                # update com metadados parciais: o Chroma junta as chaves às existentes
+                self._chroma_collection.update(ids=ids, metadatas=[{"ultimo_acesso": agora} for _ in ids])
+            except Exception as e:
+                logger.warning(f"Falha ao registar acesso a documentos do RAG: {e}")
+
+        def apply_retention(
+            self,
+            max_docs: Optional[int] = None,
+            max_age_days: Optional[float] = None,
+            lru: Optional[bool] = None,
+        ) -> Dict[str, int]:
+            """
+            Remove documentos pela política de retenção (idade máxima, depois capacidade, por
+            último acesso ou por antiguidade), em lotes de RAG_DELETE_BATCH_SIZE. O espaço só
+            volta ao disco com `compact_storage()`, que corre com o cliente Chroma fechado.
+            """
+            max_docs, max_age_days, lru = _politica_retencao(max_docs, max_age_days, lru)
+            itens: List[Tuple[str, Dict[str, Any]]] = []
+            total = self._chroma_collection.count()
+            for offset in range(0, total, RAG_DELETE_BATCH_SIZE):
+                pagina = self._chroma_collection.get(include=["metadatas"], limit=RAG_DELETE_BATCH_SIZE, offset=offset)
+                itens.extend(zip(pagina["ids"], [m or {} for m in pagina["metadatas"]]))
+
+            por_idade, por_capacidade = _selecionar_para_remocao(itens, max_docs, max_age_days, lru, time.time())
+            remover = por_idade + por_capacidade
+            for inicio in range(0, len(remover), RAG_DELETE_BATCH_SIZE):
+                self._chroma_collection.delete(ids=remover[inicio:inicio + RAG_DELETE_BATCH_SIZE])
+            return {
+                "removidos_idade": len(por_idade),
+                "removidos_capacidade": len(por_capacidade),
+                "restantes": len(itens) - len(remover),
+            }
+
+        def close(self) -> None:
+            """Liberta o cliente Chroma (ligações ao SQLite e threads do runtime)."""
+            self._retrievers.clear()
+            fechar = getattr(self._chroma_client, "close", None)
+            if fechar is not None:
+                fechar()
+            else:
+                # chromadb sem Client.close(): para o System partilhado e esquece-o
+                self._chroma_client._system.stop()
+                self._chroma_client.clear_system_cache()
+
+        def _retriever(self, top_k: int):
+            retriever = self._retrievers.get(top_k)
+            if retriever is None:
+                retriever = self._retrievers[top_k] = self._index.as_retriever(similarity_top_k=top_k)
+            return retriever
+
+        def query_cache_stats(self) -> Dict[str, Any]:
+            """Hits/misses da cache de embeddings de consultas deste processo."""
+            return self._query_embeddings.stats()
+
+        def warm_up(self) -> None:
+            """Força a inicialização preguiçosa do tokenizer/modelo com um embedding descartável."""
+            self._embed_model.get_query_embedding("aquecimento")
+            self._retriever(3)
+
+        # Aliases semânticos para futura integração com módulos de e-mail
+        def ingest_email(self, email_text: str, metadata: Dict[str, Any]) -> str:
+            return self.add_document(email_text, metadata)
+
+        def ingest_emails(
+            self, items: Sequence[Tuple[str, Dict[str, Any]]], batch_size: Optional[int] = None
+        ) -> List[str]:
+            return self.add_documents(items, batch_size)
+
+        def retrieve_similar(self, query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
+            return self.query_context(query_text, top_k)
 else:
+    try:
+        import fcntl
+    except ImportError:  # Windows: sem flock, as escritas concorrentes ficam por conta do SO
+        fcntl = None
+
+    # Documentos novos (ainda só no log) acima dos quais o índice compacto é reconstruído
+    RAG_FALLBACK_COMPACT_EVERY = int(os.getenv("RAG_FALLBACK_COMPACT_EVERY", 1000))
+
+    def _carregar_array(caminho: str) -> np.ndarray:
+        try:
+            return np.load(caminho, mmap_mode="r")
+        except ValueError:
+            # Não é possível mapear um array vazio
+            return np.load(caminho)
+
+    def _proximos(assinaturas: np.ndarray, assinatura: int) -> np.ndarray:
+        """Posições das assinaturas a distância de Hamming <= limite (XOR + popcount vetorizados)."""
+        return np.flatnonzero(np.bitwise_count(assinaturas ^ np.uint64(assinatura)) <= RAG_DEDUP_MAX_HAMMING)
+
+    class _Buffer:
+        """Array numpy com crescimento amortizado (capacidade duplica quando enche)."""
+
+        def __init__(self, dtype, capacidade: int = 8) -> None:
+            self._dados = np.zeros(capacidade, dtype=dtype)
+            self.n = 0
+
+        def append(self, valor) -> None:
+            if self.n == len(self._dados):
+                self._dados = np.resize(self._dados, 2 * len(self._dados))
+            self._dados[self.n] = valor
+            self.n += 1
+
+        def view(self) -> np.ndarray:
+            return self._dados[:self.n]
+
     class RagStore:
-        """Fallback em memória usando sobreposição simples de palavras (sem deps externas)."""
+        """
+        Fallback sem ChromaDB/LlamaIndex: índice invertido termo -> (docs, tf) e ranking BM25.
+
+        Persistência em `persist_path/fallback/`:
+        - `docs.jsonl`: log append-only com um documento por linha (a posição da linha é o
+          número do documento);
+        - `indice-<geração>/`: índice compacto (offsets no log, comprimentos, postings
+          concatenadas e dicionário termo -> intervalo), carregado via mmap;
+        - `indice.json`: aponta para a geração atual e indica até que byte do log ela cobre.
+
+        Cada processo mapeia o índice compacto e o prefixo do log (as páginas são partilhadas
+        pelo SO entre workers) e só mantém em memória o delta: documentos acrescentados ao log
+        depois da última compactação, por qualquer worker. Antes de cada operação o store
+        verifica se o log cresceu ou se há uma nova geração. Com `persist_path=None` fica
+        apenas em memória.
+        """
+
+        # Parâmetros BM25 habituais
+        K1 = 1.5
+        B = 0.75
 
         def __init__(
             self,
-            persist_path: str = "./rag_test_db",
+            persist_path: Optional[str] = "./rag_test_db",
             collection_name: str = "emails_cotacoes",
             embed_model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
         ) -> None:
             # Para compatibilidade com a interface, aceitamos os mesmos parâmetros.
-            # Armazenamento simples em memória.
-            self._docs: List[Dict[str, Any]] = []
+            self._dir = os.path.join(persist_path, "fallback") if persist_path else None
+            if self._dir:
+                os.makedirs(self._dir, exist_ok=True)
+                self._ponteiro_path = os.path.join(self._dir, "indice.json")
+                self._acessos_path = os.path.join(self._dir, "acessos.jsonl")
+            self._lock = threading.RLock()
+            self._ingest_stats = {"ingeridos": 0, "duplicados": 0}
+            # id -> último acesso já registado por este processo
+            self._acessos: Dict[str, float] = {}
+            # id -> última reingestão (quase-duplicado) registada por este processo
+            self._renovados: Dict[str, float] = {}
+            self._carregar_compacto(self._ler_ponteiro() if self._dir else None)
+
+        # -------------------------
+        # Índice compacto (mmap)
+        # -------------------------
+        def _carregar_compacto(self, ponteiro: Optional[Dict[str, Any]]) -> None:
+            ponteiro = ponteiro or {}
+            if self._dir:
+                # A retenção reescreve o log num ficheiro novo; o ponteiro indica qual é o atual
+                self._log_nome = ponteiro.get("log", "docs.jsonl")
+                self._log_path = os.path.join(self._dir, self._log_nome)
+            if self._dir and ponteiro.get("n_docs"):
+                geracao = os.path.join(self._dir, f"indice-{ponteiro['geracao']}")
+                self._c_offsets = _carregar_array(os.path.join(geracao, "doc_offsets.npy"))
+                self._c_doc_len = _carregar_array(os.path.join(geracao, "doc_len.npy"))
+                self._c_post_docs = _carregar_array(os.path.join(geracao, "postings_docs.npy"))
+                self._c_post_tf = _carregar_array(os.path.join(geracao, "postings_tf.npy"))
+                self._c_simhash = _carregar_array(os.path.join(geracao, "simhash.npy"))
+                with open(os.path.join(geracao, "termos.json"), "r", encoding="utf-8") as f:
+                    self._c_termos: Dict[str, List[int]] = json.load(f)
+                with open(self._log_path, "rb") as f:
+                    self._c_log = mmap.mmap(f.fileno(), ponteiro["log_bytes"], access=mmap.ACCESS_READ)
+                self._c_n = ponteiro["n_docs"]
+                self._c_total_len = ponteiro["total_len"]
+                self._lido_ate = ponteiro["log_bytes"]
+            else:
+                self._c_offsets = np.zeros(1, dtype=np.int64)
+                self._c_doc_len = np.zeros(0, dtype=np.float32)
+                self._c_post_docs = np.zeros(0, dtype=np.int32)
+                self._c_post_tf = np.zeros(0, dtype=np.float32)
+                self._c_simhash = np.zeros(0, dtype=np.uint64)
+                self._c_termos = {}
+                self._c_log = None
+                self._c_n = 0
+                self._c_total_len = 0
+                self._lido_ate = 0
+            self._ponteiro_assinatura = self._assinatura(self._ponteiro_path) if self._dir else None
+            self._limpar_delta()
+
+        def _limpar_delta(self) -> None:
+            self._d_docs: List[Dict[str, Any]] = []
+            self._d_offsets: List[int] = []
+            self._d_doc_len = _Buffer(np.float32)
+            self._d_simhash = _Buffer(np.uint64)
+            self._d_total_len = 0
+            self._d_postings: Dict[str, Tuple[_Buffer, _Buffer]] = {}
+
+        @staticmethod
+        def _assinatura(caminho: str) -> Optional[Tuple[int, int]]:
+            # os.replace cria um novo inode: deteta uma nova geração mesmo com o mesmo mtime
+            try:
+                estado = os.stat(caminho)
+            except FileNotFoundError:
+                return None
+            return estado.st_ino, estado.st_mtime_ns
+
+        def _ler_ponteiro(self) -> Optional[Dict[str, Any]]:
+            try:
+                with open(self._ponteiro_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                return None
+
+        # -------------------------
+        # Sincronização com o disco
+        # -------------------------
+        @contextmanager
+        def _bloqueio_exclusivo(self):
+            """Serializa escritas no log e compactações entre processos."""
+            with self._lock, open(os.path.join(self._dir, ".lock"), "a") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+        def _sincronizar(self) -> None:
+            """Carrega uma nova geração do índice, se existir, e indexa o que foi acrescentado ao log."""
+            if not self._dir:
+                return
+            with self._lock:
+                if self._assinatura(self._ponteiro_path) != self._ponteiro_assinatura:
+                    self._carregar_compacto(self._ler_ponteiro())
+                try:
+                    tamanho = os.path.getsize(self._log_path)
+                except FileNotFoundError:
+                    return
+                if tamanho <= self._lido_ate:
+                    return
+                with open(self._log_path, "rb") as f:
+                    f.seek(self._lido_ate)
+                    dados = f.read(tamanho - self._lido_ate)
+                # Uma linha sem '\n' ainda está a ser escrita por outro processo
+                dados = dados[:dados.rfind(b"\n") + 1]
+                offset = self._lido_ate
+                for linha in dados.splitlines(keepends=True):
+                    self._indexar_delta(json.loads(linha), offset)
+                    offset += len(linha)
+                self._lido_ate = offset
+
+        def _indexar_delta(self, doc: Dict[str, Any], offset: int) -> None:
+            posicao = self._c_n + len(self._d_docs)
+            self._d_docs.append(doc)
+            self._d_offsets.append(offset)
+            tokens = _tokenizar(doc["text"])
+            self._d_doc_len.append(len(tokens))
+            self._d_total_len += len(tokens)
+            assinatura = doc.get("metadata", {}).get("simhash")
+            self._d_simhash.append(int(assinatura, 16) if assinatura else 0)
+            for termo, tf in Counter(tokens).items():
+                if termo not in self._d_postings:
+                    self._d_postings[termo] = (_Buffer(np.int32, 4), _Buffer(np.float32, 4))
+                docs, tfs = self._d_postings[termo]
+                docs.append(posicao)
+                tfs.append(tf)
+
+        def compactar(self) -> None:
+            """Reescreve o índice compacto para cobrir todo o log (nova geração, troca atómica)."""
+            if not self._dir:
+                return
+            with self._bloqueio_exclusivo():
+                self._sincronizar()
+                if self._d_docs:
+                    self._escrever_geracao()
 
+        def _escrever_geracao(self) -> None:
+            """Grava o índice de todo o log (compacto + delta) numa nova geração. Requer o bloqueio exclusivo."""
+            n_docs = self._c_n + len(self._d_docs)
+            offsets = np.concatenate([
+                np.asarray(self._c_offsets[:-1]),
+                np.asarray(self._d_offsets, dtype=np.int64),
+                np.asarray([self._lido_ate], dtype=np.int64),
+            ])
+            doc_len = np.concatenate([np.asarray(self._c_doc_len), self._d_doc_len.view()])
+            assinaturas = np.concatenate([np.asarray(self._c_simhash), self._d_simhash.view()])
+
+            termos: Dict[str, List[int]] = {}
+            blocos_docs, blocos_tf = [], []
+            inicio = 0
+            for termo in self._c_termos.keys() | self._d_postings.keys():
+                docs, tfs = self._postings(termo)
+                blocos_docs.append(docs)
+                blocos_tf.append(tfs)
+                termos[termo] = [inicio, inicio + len(docs)]
+                inicio += len(docs)
+
+            ponteiro = self._ler_ponteiro()
+            nova = (ponteiro["geracao"] + 1) if ponteiro else 1
+            destino = os.path.join(self._dir, f"indice-{nova}")
+            os.makedirs(destino, exist_ok=True)
+            np.save(os.path.join(destino, "doc_offsets.npy"), offsets)
+            np.save(os.path.join(destino, "doc_len.npy"), doc_len.astype(np.float32))
+            np.save(os.path.join(destino, "simhash.npy"), assinaturas.astype(np.uint64))
+            np.save(
+                os.path.join(destino, "postings_docs.npy"),
+                np.concatenate(blocos_docs).astype(np.int32) if blocos_docs else np.zeros(0, np.int32),
+            )
+            np.save(
+                os.path.join(destino, "postings_tf.npy"),
+                np.concatenate(blocos_tf).astype(np.float32) if blocos_tf else np.zeros(0, np.float32),
+            )
+            with open(os.path.join(destino, "termos.json"), "w", encoding="utf-8") as f:
+                json.dump(termos, f)
+
+            novo_ponteiro = {
+                "geracao": nova,
+                "log": self._log_nome,
+                "n_docs": n_docs,
+                "log_bytes": self._lido_ate,
+                "total_len": self._c_total_len + self._d_total_len,
+            }
+            temporario = self._ponteiro_path + ".tmp"
+            with open(temporario, "w", encoding="utf-8") as f:
+                json.dump(novo_ponteiro, f)
+            os.replace(temporario, self._ponteiro_path)
+            self._carregar_compacto(novo_ponteiro)
+
+            # Mantém a geração anterior para processos que ainda a estejam a abrir
+            for antiga in range(1, nova - 1):
+                shutil.rmtree(os.path.join(self._dir, f"indice-{antiga}"), ignore_errors=True)
+            logger.info(f"Índice RAG (fallback) compactado: geração {nova}, {n_docs} documentos.")
+
+        # -------------------------
+        # Public API
+        # -------------------------
         def add_document(self, email_text: str, metadata: Dict[str, Any]) -> str:
-            if not isinstance(email_text, str) or not email_text.strip():
-                raise ValueError("email_text deve ser uma string não vazia")
-            if not isinstance(metadata, dict):
-                raise ValueError("metadata deve ser um dict")
-
-            doc_id = metadata.get("id") or str(uuid4())
-            self._docs.append({
-                "id": doc_id,
-                "text": email_text,
-                "metadata": metadata or {},
-            })
+            return self.add_documents([(email_text, metadata)])[0]
+
+        def add_documents(
+            self,
+            items: Sequence[Tuple[str, Dict[str, Any]]],
+            batch_size: Optional[int] = None,
+        ) -> List[str]:
+            # Sem embeddings: o lote inteiro é escrito no log numa única operação
+            for email_text, metadata in items:
+                _validar_documento(email_text, metadata)
+            bloqueio = self._bloqueio_exclusivo() if self._dir else self._lock
+            with bloqueio:
+                # A verificação de duplicados e a escrita ficam sob o mesmo lock
+                self._sincronizar()
+                ids: List[str] = []
+                docs = []
+                assinaturas_lote = _Buffer(np.uint64)
+                for email_text, metadata in items:
+                    metadata, assinatura = _preparar_metadados(email_text, metadata)
+                    if assinatura is not None:
+                        duplicado = self._procurar_duplicado(assinatura)
+                        if duplicado is None:
+                            proximos = _proximos(assinaturas_lote.view(), assinatura)
+                            if len(proximos):
+                                duplicado = docs[proximos[0]]["id"]
+                        if duplicado is not None:
+                            ids.append(self._registar_duplicado(duplicado))
+                            continue
+                    doc = {"id": metadata.get("id") or str(uuid4()), "text": email_text, "metadata": metadata}
+                    assinaturas_lote.append(assinatura or 0)
+                    docs.append(doc)
+                    ids.append(doc["id"])
+
+                if not self._dir:
+                    for doc in docs:
+                        self._indexar_delta(doc, 0)
+                elif docs:
+                    with open(self._log_path, "ab") as f:
+                        f.write(b"".join(
+                            json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n" for doc in docs
+                        ))
+                    self._sincronizar()
+                self._ingest_stats["ingeridos"] += len(docs)
+            if self._dir and len(self._d_docs) >= RAG_FALLBACK_COMPACT_EVERY:
+                self.compactar()
+            return ids
+
+        def _procurar_duplicado(self, assinatura: int) -> Optional[str]:
+            """Compara com todas as assinaturas guardadas de uma vez (sem ler os documentos)."""
+            proximos = _proximos(self._c_simhash, assinatura)
+            if len(proximos):
+                return self._documento(int(proximos[0]))["id"]
+            proximos = _proximos(self._d_simhash.view(), assinatura)
+            if len(proximos):
+                return self._d_docs[int(proximos[0])]["id"]
+            return None
+
+        def _registar_duplicado(self, doc_id: str) -> str:
+            """O documento existente volta a contar como recente (ver `_registar_acessos`)."""
+            self._ingest_stats["duplicados"] += 1
+            logger.debug(f"Documento quase duplicado de {doc_id} não foi ingerido no RAG.")
+            self._registar_acessos([doc_id], reingerido=True)
             return doc_id
 
-        def _score(self, query: str, text: str) -> float:
-            """Calcula uma similaridade simples com base na sobreposição de palavras (Jaccard).
-            Retorna valor em [0,1].
+        def ingest_stats(self) -> Dict[str, int]:
+            """Documentos ingeridos e quase-duplicados suprimidos por este processo."""
+            return dict(self._ingest_stats)
+
+        # -------------------------
+        # Retenção
+        # -------------------------
+        def _registar_acessos(self, doc_ids: List[str], reingerido: bool = False) -> None:
+            """
+            O log de documentos é imutável: os acessos vão para `acessos.jsonl` (append-only).
+            Com `reingerido`, regista também uma nova ingestão (`[id, instante, 1]`), que
+            renova `ingerido_em` na retenção; essa não é limitada por RAG_ACCESS_UPDATE_SECONDS.
             """
+            agora = time.time()
+            if reingerido:
+                novos = list(doc_ids)
+                for doc_id in novos:
+                    self._acessos[doc_id] = self._renovados[doc_id] = agora
+            else:
+                novos = _acessos_a_registar(self._acessos, doc_ids, agora)
+            if not novos or not self._dir:
+                return
+            registo = [agora, 1] if reingerido else [agora]
             try:
-                def tokens(s: str) -> set:
-                    # Quebra por caracteres não alfanuméricos e remove vazios
-                    import re
-                    return {t for t in re.split(r"[^\w]+", s.lower()) if t}
-
-                q = tokens(query)
-                t = tokens(text)
-                if not q or not t:
-                    return 0.0
-                inter = len(q & t)
-                union = len(q | t)
-                return inter / union if union else 0.0
-            except Exception:
-                return 0.0
+                with open(self._acessos_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps([doc_id] + registo) + "\n" for doc_id in novos))
+            except OSError as e:
+                logger.warning(f"Falha ao registar acesso a documentos do RAG: {e}")
+
+        def _ler_acessos(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+            """Devolve (último acesso, última reingestão) por documento."""
+            acessos = dict(self._acessos)
+            renovados = dict(self._renovados)
+            if self._dir and os.path.exists(self._acessos_path):
+                with open(self._acessos_path, "r", encoding="utf-8") as f:
+                    for linha in f:
+                        try:
+                            doc_id, instante, *reingerido = json.loads(linha)
+                        except ValueError:
+                            continue  # linha truncada
+                        acessos[doc_id] = max(acessos.get(doc_id, 0.0), instante)
+                        if reingerido:
+                            renovados[doc_id] = max(renovados.get(doc_id, 0.0), instante)
+            return acessos, renovados
+
+        def apply_retention(
+            self,
+            max_docs: Optional[int] = None,
+            max_age_days: Optional[float] = None,
+            lru: Optional[bool] = None,
+        ) -> Dict[str, int]:
+            """
+            Aplica a política de retenção (idade máxima, depois capacidade, por último acesso ou
+            por antiguidade). Os documentos retidos são reescritos num log novo, com o último
+            acesso incorporado nos metadados, e o índice é reconstruído numa nova geração; sem
+            remoções, apenas compacta o delta pendente.
+            """
+            max_docs, max_age_days, lru = _politica_retencao(max_docs, max_age_days, lru)
+            bloqueio = self._bloqueio_exclusivo() if self._dir else self._lock
+            with bloqueio:
+                self._sincronizar()
+                acessos, renovados = self._ler_acessos()
+                docs = []
+                for posicao in range(self._c_n + len(self._d_docs)):
+                    doc = self._documento(posicao)
+                    if doc["id"] in acessos:
+                        metadata = dict(doc.get("metadata") or {})
+                        metadata["ultimo_acesso"] = max(metadata.get("ultimo_acesso") or 0.0, acessos[doc["id"]])
+                        if doc["id"] in renovados:
+                            metadata["ingerido_em"] = max(metadata.get("ingerido_em") or 0.0, renovados[doc["id"]])
+                        doc = dict(doc, metadata=metadata)
+                    docs.append(doc)
+
+                por_idade, por_capacidade = _selecionar_para_remocao(
+                    [(posicao, doc.get("metadata") or {}) for posicao, doc in enumerate(docs)],
+                    max_docs, max_age_days, lru, time.time(),
+                )
+                remover = set(por_idade) | set(por_capacidade)
+                resumo = {
+                    "removidos_idade": len(por_idade),
+                    "removidos_capacidade": len(por_capacidade),
+                    "restantes": len(docs) - len(remover),
+                }
+                retidos = [doc for posicao, doc in enumerate(docs) if posicao not in remover]
+
+                if not self._dir:
+                    if remover:
+                        self._carregar_compacto(None)
+                        for doc in retidos:
+                            self._indexar_delta(doc, 0)
+                    return resumo
+                if not remover:
+                    if self._d_docs:
+                        self._escrever_geracao()
+                    return resumo
+
+                ponteiro = self._ler_ponteiro()
+                log_anterior = self._log_nome
+                novo_log = f"docs-{(ponteiro['geracao'] + 1) if ponteiro else 1}.jsonl"
+                with open(os.path.join(self._dir, novo_log), "wb") as f:
+                    for inicio in range(0, len(retidos), RAG_DELETE_BATCH_SIZE):
+                        f.write(b"".join(
+                            json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n"
+                            for doc in retidos[inicio:inicio + RAG_DELETE_BATCH_SIZE]
+                        ))
+                # Reindexa o log novo de raiz e publica-o como nova geração
+                self._carregar_compacto({"log": novo_log})
+                self._sincronizar()
+                self._escrever_geracao()
+                # Os acessos já estão incorporados nos metadados do log novo
+                open(self._acessos_path, "w").close()
+                for nome in os.listdir(self._dir):
+                    if nome.startswith("docs") and nome.endswith(".jsonl") and nome not in (novo_log, log_anterior):
+                        os.remove(os.path.join(self._dir, nome))
+                logger.info(f"Retenção do RAG (fallback): {resumo}")
+                return resumo
+
+        def _postings(self, termo: str) -> Tuple[np.ndarray, np.ndarray]:
+            """Postings de um termo: parte compacta (mmap) seguida do delta em memória."""
+            partes_docs, partes_tf = [], []
+            intervalo = self._c_termos.get(termo)
+            if intervalo:
+                partes_docs.append(self._c_post_docs[intervalo[0]:intervalo[1]])
+                partes_tf.append(self._c_post_tf[intervalo[0]:intervalo[1]])
+            if termo in self._d_postings:
+                docs, tfs = self._d_postings[termo]
+                partes_docs.append(docs.view())
+                partes_tf.append(tfs.view())
+            if len(partes_docs) == 1:
+                return partes_docs[0], partes_tf[0]
+            if not partes_docs:
+                return np.zeros(0, np.int32), np.zeros(0, np.float32)
+            return np.concatenate(partes_docs), np.concatenate(partes_tf)
+
+        def _documento(self, posicao: int) -> Dict[str, Any]:
+            if posicao >= self._c_n:
+                return self._d_docs[posicao - self._c_n]
+            inicio, fim = int(self._c_offsets[posicao]), int(self._c_offsets[posicao + 1])
+            return json.loads(self._c_log[inicio:fim])
+
+        def _bm25(self, termos: Sequence[str]) -> np.ndarray:
+            """Pontuação BM25 de todos os documentos (zero para os que não contêm nenhum termo)."""
+            n_docs = self._c_n + len(self._d_docs)
+            pontuacoes = np.zeros(n_docs, dtype=np.float32)
+            if not n_docs:
+                return pontuacoes
+            media_len = (self._c_total_len + self._d_total_len) / n_docs or 1.0
+            doc_len = np.concatenate([self._c_doc_len, self._d_doc_len.view()])
+            norma = self.K1 * (1 - self.B + self.B * doc_len / media_len)
+            for termo in termos:
+                docs, tfs = self._postings(termo)
+                df = len(docs)
+                if not df:
+                    continue
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                # Cada documento aparece no máximo uma vez por lista de postings
+                pontuacoes[docs] += idf * tfs * (self.K1 + 1) / (tfs + norma[docs])
+            return pontuacoes
 
         def query_context(self, query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
             if not isinstance(query_text, str) or not query_text.strip():
@@ -169,90 +999,164 @@ else:
             if top_k <= 0:
                 raise ValueError("top_k deve ser > 0")
 
-            scored = [
-                {
-                    "text": d["text"],
-                    "metadata": d.get("metadata", {}) or {},
-                    "score": self._score(query_text, d["text"]),
-                }
-                for d in self._docs
-            ]
-            scored.sort(key=lambda x: x["score"], reverse=True)
-            return scored[:top_k]
-
-    # -------------------------
-    # Public API
-    # -------------------------
-    def add_document(self, email_text: str, metadata: Dict[str, Any]) -> str:
-        """
-        Adiciona um documento ao índice/ChromaDB.
-        Retorna o ID do documento.
-        """
-        if not isinstance(email_text, str) or not email_text.strip():
-            raise ValueError("email_text deve ser uma string não vazia")
-        if not isinstance(metadata, dict):
-            raise ValueError("metadata deve ser um dict")
-
-        # Gera um ID estável para o documento e retorna este ID, já que insert() pode não retornar
-        doc_id = metadata.get("id") or str(uuid4())
-        doc = Document(text=email_text, metadata=metadata, doc_id=doc_id)
-        # Insere no índice (irá persistir no Chroma via vector store)
-        self._index.insert(doc)
-        return doc_id
-
-    def query_context(self, query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
-        """
-        Consulta o índice por exemplos semelhantes. Retorna uma lista de entradas:
-        [{ 'text': str, 'score': float | None, 'metadata': dict }]
-        """
-        if not isinstance(query_text, str) or not query_text.strip():
-            raise ValueError("query_text deve ser uma string não vazia")
-        if top_k <= 0:
-            raise ValueError("top_k deve ser > 0")
-
-        # Cria query engine SEM LLM (apenas similaridade por embeddings)
-        qe = self._index.as_query_engine(similarity_top_k=top_k)
-        resp = qe.query(query_text)
-
-        results: List[Dict[str, Any]] = []
-        # source_nodes contém nodes com .text, .score e .metadata
-        for sn in getattr(resp, "source_nodes", []) or []:
-            results.append(
-                {
-                    "text": sn.text,
-                    "score": getattr(sn, "score", None),
-                    "metadata": getattr(sn, "metadata", {}) or {},
-                }
-            )
-        return results
+            with self._lock:
+                self._sincronizar()
+                pontuacoes = self._bm25(set(_tokenizar(query_text)))
+                candidatos = np.flatnonzero(pontuacoes > 0)
+                if len(candidatos) > top_k:
+                    candidatos = candidatos[np.argpartition(-pontuacoes[candidatos], top_k)[:top_k]]
+                # Ordem estável: em caso de empate, o documento mais antigo primeiro
+                candidatos = candidatos[np.lexsort((candidatos, -pontuacoes[candidatos]))]
+                resultados = []
+                ids = []
+                for posicao in candidatos:
+                    doc = self._documento(int(posicao))
+                    ids.append(doc["id"])
+                    resultados.append({
+                        "text": doc["text"],
+                        "metadata": doc.get("metadata", {}) or {},
+                        "score": float(pontuacoes[posicao]),
+                    })
+                self._registar_acessos(ids)
+                return resultados
+
+        def warm_up(self) -> None:
+            # Só há que apanhar o que outros workers acrescentaram ao log
+            self._sincronizar()
+
+        # Aliases semânticos para futura integração com módulos de e-mail
+        def ingest_email(self, email_text: str, metadata: Dict[str, Any]) -> str:
+            return self.add_document(email_text, metadata)
 
-    # Aliases semânticos para futura integração com módulos de e-mail
-    def ingest_email(self, email_text: str, metadata: Dict[str, Any]) -> str:
-        return self.add_document(email_text, metadata)
+        def ingest_emails(
+            self, items: Sequence[Tuple[str, Dict[str, Any]]], batch_size: Optional[int] = None
+        ) -> List[str]:
+            return self.add_documents(items, batch_size)
 
-    def retrieve_similar(self, query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
-        return self.query_context(query_text, top_k)
+        def retrieve_similar(self, query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
+            return self.query_context(query_text, top_k)
 
 
 # Helpers modulares (funções de nível de módulo) se preferir evitar estado de classe fora
 _default_store: Optional[RagStore] = None
+_default_store_lock = threading.Lock()
+_primeira_consulta_pendente = True
 
 
 def get_default_store() -> RagStore:
     global _default_store
     if _default_store is None:
-        _default_store = RagStore()
+        # Um warm-up em segundo plano e o primeiro job podem chegar aqui ao mesmo tempo:
+        # o segundo espera pelo primeiro em vez de carregar o modelo outra vez
+        with _default_store_lock:
+            if _default_store is None:
+                inicio = time.perf_counter()
+                _default_store = RagStore()
+                logger.info(f"RAG store inicializado em {time.perf_counter() - inicio:.2f}s (cold start).")
     return _default_store
 
 
+def warm_up(background: bool = False) -> Optional[threading.Thread]:
+    """
+    Carrega o store por omissão (modelo de embeddings, Chroma e índice) antes de chegarem jobs.
+    Com `background=True` corre numa thread daemon e devolve-a; caso contrário bloqueia.
+    """
+    def _aquecer() -> None:
+        try:
+            inicio = time.perf_counter()
+            get_default_store().warm_up()
+            logger.info(f"Warm-up do RAG concluído em {time.perf_counter() - inicio:.2f}s.")
+        except Exception as e:
+            logger.warning(f"Falha no warm-up do RAG: {e}")
+
+    if not background:
+        _aquecer()
+        return None
+    thread = threading.Thread(target=_aquecer, name="rag-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_up_before_fork() -> None:
+    """
+    Warm-up para um processo que vai fazer fork de filhos (worker RQ pré-aquecido).
+
+    Só carrega o que sobrevive a um fork. O fallback é carregado por inteiro, porque usa
+    arrays em mmap e não tem threads nem ligações abertas. No backend Chroma carregam-se
+    apenas os pesos do modelo de embeddings. O cliente Chroma (SQLite e threads do
+    runtime), a sessão ONNX e a primeira inferência ficam para cada processo filho.
+    """
+    if not _HAS_RAG_BACKEND:
+        warm_up()
+        return
+    try:
+        inicio = time.perf_counter()
+        obter_embedder()
+        logger.info(f"Modelo de embeddings do RAG pré-carregado em {time.perf_counter() - inicio:.2f}s.")
+    except Exception as e:
+        logger.warning(f"Falha ao pré-carregar o modelo de embeddings do RAG: {e}")
+
+
 def add_document(email_text: str, metadata: Dict[str, Any]) -> str:
     return get_default_store().add_document(email_text, metadata)
 
 
+def add_documents(
+    items: Sequence[Tuple[str, Dict[str, Any]]], batch_size: Optional[int] = None
+) -> List[str]:
+    return get_default_store().add_documents(items, batch_size)
+
+
+def apply_retention(
+    max_docs: Optional[int] = None,
+    max_age_days: Optional[float] = None,
+    lru: Optional[bool] = None,
+) -> Dict[str, int]:
+    return get_default_store().apply_retention(max_docs, max_age_days, lru)
+
+
+def compact_storage() -> bool:
+    """
+    VACUUM ao SQLite do Chroma do store por omissão, para devolver ao disco o espaço dos
+    documentos removidos. O store é fechado antes (o PersistentClient não pode ter a base de
+    dados aberta durante o VACUUM) e volta a ser criado no próximo uso. Uma falha propaga-se.
+    Devolve False se não houve nada a compactar: store por criar ou fallback, que já
+    compacta o log e o índice na própria retenção.
+    """
+    global _default_store
+    with _default_store_lock:
+        store = _default_store
+        if not _HAS_RAG_BACKEND or store is None:
+            return False
+        _default_store = None
+        store.close()
+        conn = sqlite3.connect(os.path.join(store.persist_path, "chroma.sqlite3"), timeout=30)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    return True
+
+
+def ingest_stats() -> Dict[str, int]:
+    """Contadores de ingestão do store por omissão (zeros se ainda não foi criado)."""
+    if _default_store is None:
+        return {"ingeridos": 0, "duplicados": 0}
+    return _default_store.ingest_stats()
+
+
 def query_context(query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
-    return get_default_store().query_context(query_text, top_k)
+    global _primeira_consulta_pendente
+    if not _primeira_consulta_pendente:
+        return get_default_store().query_context(query_text, top_k)
+    _primeira_consulta_pendente = False
+    inicio = time.perf_counter()
+    resultados = get_default_store().query_context(query_text, top_k)
+    logger.info(f"Primeira consulta RAG neste processo em {time.perf_counter() - inicio:.3f}s.")
+    return resultados
 
 
 # Aliases solicitados
 ingest_email = add_document
+ingest_emails = add_documents
 retrieve_similar = query_context
@@ -0,0 +1,24 @@
+"""
+Ligação partilhada ao Redis para os módulos que guardam estado fora da fila RQ
+(caches, checkpoints, métricas).
+
+Configuração: REDIS_URL (padrão: redis://localhost:6379/0).
+"""
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+from redis import Redis
+
+_redis: Optional[Redis] = None
+_redis_pid: Optional[int] = None
+
+
+def get_redis() -> Redis:
+    """Devolve um cliente Redis por processo (os sockets não sobrevivem a um fork)."""
+    global _redis, _redis_pid
+    if _redis is None or _redis_pid != os.getpid():
+        _redis = Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        _redis_pid = os.getpid()
+    return _redis
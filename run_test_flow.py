@@ -89,6 +89,7 @@ if __name__ == "__main__":
 
         # Mocks para as funções de email
         with patch('main.obter_emails', side_effect=mock_obter_emails), \
+             patch('main.enfileirar_pipelines', return_value=[[mock_job]]), \
              patch('tasks.enviar_email_cotacao', side_effect=mock_enviar_email_cotacao):
 
             # Importar e executar main.py APÓS os mocks serem aplicados
@@ -1,79 +1,201 @@
+import hashlib
+import json
+import os
 import traceback
-from rq import get_current_job
+from rq import Callback, Queue, Retry, get_current_job
+from rq.job import JobStatus
 
 from logger_config import logger
 from agent import analisar_email
 from cotador import calcular_cotacao
-from email_sender import enviar_email_cotacao
+from email_reader import identificador_email
+from metricas import medir, medir_tarefa
+from email_sender import SMTP_SEND_TIMEOUT_SECONDS, enviar_email_cotacao
+from redis_client import get_redis
 # RAG: import resiliente
 try:
     from rag_store import ingest_email as rag_ingest_email
 except Exception:
     rag_ingest_email = None
 
+# --- Pipeline por etapas ---
+# Cada e-mail passa por extração (LLM) → cotação → envio (SMTP) → ingestão (RAG), cada etapa
+# num job e numa fila próprios, encadeados por dependências do RQ. Assim cada etapa tem o seu
+# número de workers, timeout e política de retentativa, e uma retentativa só repete a etapa que
+# falhou. O resultado de cada etapa é passado à seguinte através do Redis.
+#
+# Idempotência: cada e-mail tem um `pipeline_id` determinístico (hash do Message-ID ou do
+# conteúdo). Um e-mail já enfileirado é descartado no enfileiramento, e o resultado gravado
+# de cada etapa serve de checkpoint: uma retentativa ou uma reexecução salta as etapas já
+# concluídas (sem nova chamada ao LLM nem segunda cotação ao cliente).
+ETAPAS = ("extracao", "cotacao", "envio", "ingestao")
+PIPELINE_ETAPAS = os.getenv("PIPELINE_ETAPAS", "true").lower() == "true"
+PIPELINE_TTL_SECONDS = int(os.getenv("PIPELINE_TTL_SECONDS", 7 * 24 * 3600))
+# Corpos acima deste tamanho (bytes) são gravados à parte e os jobs levam só a referência
+PIPELINE_CORPO_INLINE_MAX = int(os.getenv("PIPELINE_CORPO_INLINE_MAX", 512))
+
+
+def id_pipeline(email):
+    """Identificador determinístico do processamento de um e-mail (ver `email_reader.identificador_email`)."""
+    return hashlib.sha256(identificador_email(email).encode("utf-8")).hexdigest()[:32]
+
+
+def _config_etapa(etapa, timeout, intervalos):
+    """Fila, timeout e retentativas de uma etapa (PIPELINE_<ETAPA>_FILA/_TIMEOUT/_RETRIES)."""
+    prefixo = f"PIPELINE_{etapa.upper()}"
+    return {
+        "fila": os.getenv(f"{prefixo}_FILA", etapa),
+        "timeout": int(os.getenv(f"{prefixo}_TIMEOUT", timeout)),
+        "retries": int(os.getenv(f"{prefixo}_RETRIES", len(intervalos))),
+        "intervalos": intervalos,
+    }
+
+
+CONFIG_ETAPAS = {
+    # O Ollama pode demorar minutos com a fila cheia
+    "extracao": _config_etapa("extracao", 600, [10, 30, 60]),
+    # Geocoding/OSRM só quando o destino não está na tabela
+    "cotacao": _config_etapa("cotacao", 120, [5, 30, 120]),
+    # Falhas de SMTP costumam ser transitórias: espaçar mais as tentativas
+    "envio": _config_etapa("envio", 120, [30, 120, 600]),
+    "ingestao": _config_etapa("ingestao", 300, [60, 300]),
+}
+
+
 def on_failure(job, connection, type, value, traceback):
     """
     Manipulador de falhas customizado para o RQ.
     Registra a falha e move o job para a fila 'failed'.
     """
     logger.error(f"Falha na tarefa {job.id}. Motivo: {value}")
-    logger.error(f"Email original: {job.args[0]}")
+    logger.error(f"Argumentos da tarefa: {job.args}")
     logger.error(traceback)
 
+
+# O RQ aceita uma função solta em `on_failure`, mas está obsoleto: os jobs levam o Callback
+CALLBACK_FALHA = Callback(on_failure)
+
+
+def _dados_completos(dados_extraidos):
+    return bool(dados_extraidos) and all(dados_extraidos.get(k) for k in ["destino", "peso", "volume"])
+
+
+def _chave_corpo(digest):
+    return f"corpo:{digest}"
+
+
+def referenciar_corpo(email, pipeline):
+    """
+    Devolve o e-mail a enfileirar. Um corpo com mais de PIPELINE_CORPO_INLINE_MAX bytes é
+    gravado no Redis (no `pipeline` dado) sob o seu hash, e o e-mail passa a levar só a
+    referência `corpo_ref`. E-mails com o mesmo corpo partilham uma única entrada.
+    """
+    dados = (email.get("corpo") or "").encode("utf-8")
+    if len(dados) <= PIPELINE_CORPO_INLINE_MAX:
+        return email
+    digest = hashlib.sha256(dados).hexdigest()
+    pipeline.set(_chave_corpo(digest), dados, ex=PIPELINE_TTL_SECONDS)
+    email = {k: v for k, v in email.items() if k != "corpo"}
+    email["corpo_ref"] = digest
+    return email
+
+
+def corpo_do_email(email):
+    """Corpo do e-mail, lido do Redis se o job só trouxer a referência."""
+    if "corpo_ref" not in email:
+        return email["corpo"]
+    valor = get_redis().get(_chave_corpo(email["corpo_ref"]))
+    if valor is None:
+        raise RuntimeError(f"Corpo do e-mail {email['corpo_ref']} não encontrado no Redis (expirado?)")
+    return valor.decode("utf-8")
+
+
+def _ingerir_no_rag(job_id, email, cotacao):
+    """Persiste o e-mail cotado como exemplo no vector store (se disponível)."""
+    if rag_ingest_email is None:
+        return
+    texto_para_ingestao = f"Assunto: {email['assunto']}\nCorpo: {corpo_do_email(email)}"
+    meta = {
+        "destino": cotacao.get("destino"),
+        "peso": cotacao.get("peso"),
+        "volume": cotacao.get("volume"),
+        "temperatura": cotacao.get("temperatura"),
+        "tipo_transporte": cotacao.get("tipo_transporte"),
+        "fonte": "cotacao_enviada",
+    }
+    with medir("ingestao_rag"):
+        rag_ingest_email(texto_para_ingestao, meta)
+    logger.info(f"[TAREFA {job_id}] Exemplo persistido no RAG store.")
+
+
+@medir_tarefa("processar_email")
 def processar_email_task(email):
     """
     Tarefa que será executada por um worker da fila.
     Recebe um dicionário de e-mail, processa-o e envia a resposta.
+
+    Processa todas as etapas num único job. Com PIPELINE_ETAPAS=true (padrão) o produtor
+    enfileira o pipeline por etapas (`enfileirar_pipelines`); esta tarefa mantém-se para
+    PIPELINE_ETAPAS=false e para jobs enfileirados antes dessa mudança. Grava os mesmos
+    checkpoints que o pipeline por etapas, pelo que uma retentativa retoma na etapa que falhou.
     """
     job = get_current_job()
     logger.info(f"Iniciando tarefa {job.id} para o e-mail de: {email['remetente']}")
+    pipeline_id = email.get("pipeline_id") or id_pipeline(email)
 
     try:
         assunto = email["assunto"]
-        corpo = email["corpo"]
+        corpo = corpo_do_email(email)
         remetente = email["remetente"]
 
-        logger.info(f"[TAREFA {job.id}] 1. Analisando e-mail com IA...")
-        dados_extraidos = analisar_email(corpo)
-
-        if not dados_extraidos or not all(dados_extraidos.get(k) for k in ["destino", "peso", "volume"]):
-            logger.warning(f"[TAREFA {job.id}] Não foi possível extrair todos os dados do e-mail. E-mail: {corpo[:150]}...")
-            return # Termina a tarefa, pois não é uma falha, mas sim dados insuficientes
+        extracao = _checkpoint(pipeline_id, "extracao")
+        if extracao is None:
+            logger.info(f"[TAREFA {job.id}] 1. Analisando e-mail com IA...")
+            dados_extraidos = analisar_email(corpo)
+            if not _dados_completos(dados_extraidos):
+                logger.warning(f"[TAREFA {job.id}] Não foi possível extrair todos os dados do e-mail. E-mail: {corpo[:150]}...")
+                _marcar_checkpoint(pipeline_id, "extracao", {"parar": "dados insuficientes"})
+                return # Termina a tarefa, pois não é uma falha, mas sim dados insuficientes
+            _marcar_checkpoint(pipeline_id, "extracao", {"email": _email_da_etapa(email), "dados": dados_extraidos})
+        elif "parar" in extracao:
+            logger.info(f"[TAREFA {job.id}] E-mail já analisado sem dados suficientes (checkpoint).")
+            return
+        else:
+            dados_extraidos = extracao["dados"]
+            logger.info(f"[TAREFA {job.id}] 1. Extração já concluída (checkpoint), sem nova chamada à IA.")
 
         logger.info(f"[TAREFA {job.id}] Dados extraídos com sucesso: {dados_extraidos}")
 
-        logger.info(f"[TAREFA {job.id}] 2. Calculando cotação...")
-        cotacao_encontrada = calcular_cotacao(dados_extraidos)
-
-        if not cotacao_encontrada:
-            logger.warning(f"[TAREFA {job.id}] Nenhuma cotação encontrada para os dados: {dados_extraidos}")
+        cotacao = _checkpoint(pipeline_id, "cotacao")
+        if cotacao is None:
+            logger.info(f"[TAREFA {job.id}] 2. Calculando cotação...")
+            cotacao_encontrada = calcular_cotacao(dados_extraidos)
+            if not cotacao_encontrada:
+                logger.warning(f"[TAREFA {job.id}] Nenhuma cotação encontrada para os dados: {dados_extraidos}")
+                _marcar_checkpoint(pipeline_id, "cotacao", {"parar": "sem cotação"})
+                return
+            _marcar_checkpoint(pipeline_id, "cotacao", {"cotacao": cotacao_encontrada})
+        elif "parar" in cotacao:
             return
+        else:
+            cotacao_encontrada = cotacao["cotacao"]
 
         logger.info(f"[TAREFA {job.id}] Cotação encontrada: {cotacao_encontrada}")
 
+        if _checkpoint(pipeline_id, "envio") is not None:
+            logger.info(f"[TAREFA {job.id}] 3. Cotação já enviada a {remetente} (checkpoint), envio não repetido.")
+            return
+
         logger.info(f"[TAREFA {job.id}] 3. Enviando e-mail de resposta para {remetente}...")
-        sucesso = enviar_email_cotacao(
-            destinatario=remetente,
-            assunto_original=assunto,
-            cotacao=cotacao_encontrada
-        )
+        sucesso = _enviar_uma_vez(pipeline_id, remetente, assunto, cotacao_encontrada)
 
         if sucesso:
             logger.info(f"[TAREFA {job.id}] E-mail enviado com sucesso para {remetente}")
+            _marcar_checkpoint(pipeline_id, "envio", {"enviado": True})
             # Persistir exemplo no vector store (se disponível)
             try:
-                if rag_ingest_email is not None:
-                    texto_para_ingestao = f"Assunto: {assunto}\nCorpo: {corpo}"
-                    meta = {
-                        "destino": cotacao_encontrada.get("destino"),
-                        "peso": cotacao_encontrada.get("peso"),
-                        "volume": cotacao_encontrada.get("volume"),
-                        "temperatura": cotacao_encontrada.get("temperatura"),
-                        "tipo_transporte": cotacao_encontrada.get("tipo_transporte"),
-                        "fonte": "cotacao_enviada",
-                    }
-                    rag_ingest_email(texto_para_ingestao, meta)
-                    logger.info(f"[TAREFA {job.id}] Exemplo persistido no RAG store.")
+                _ingerir_no_rag(job.id, email, cotacao_encontrada)
+                _marcar_checkpoint(pipeline_id, "ingestao", {"ingerido": rag_ingest_email is not None})
             except Exception as e:
                 logger.warning(f"[TAREFA {job.id}] Falha ao persistir no RAG store: {e}")
         else:
@@ -85,3 +207,278 @@ def processar_email_task(email):
         # Re-lança a exceção para que o RQ a capture e chame o on_failure
         raise
 
+
+# --- Passagem de resultados entre etapas (Redis) ---
+
+def _chave_etapa(pipeline_id, etapa):
+    return f"pipeline:{pipeline_id}:{etapa}"
+
+
+def _json_default(valor):
+    # Escalares numpy/pandas vindos da tabela de preços
+    return valor.item() if hasattr(valor, "item") else str(valor)
+
+
+def guardar_resultado_etapa(pipeline_id, etapa, resultado):
+    get_redis().set(
+        _chave_etapa(pipeline_id, etapa),
+        json.dumps(resultado, default=_json_default),
+        ex=PIPELINE_TTL_SECONDS,
+    )
+
+
+def ler_resultado_etapa(pipeline_id, etapa):
+    valor = get_redis().get(_chave_etapa(pipeline_id, etapa))
+    if valor is None:
+        raise RuntimeError(f"Resultado da etapa '{etapa}' do pipeline {pipeline_id} não encontrado (expirado?)")
+    return json.loads(valor)
+
+
+def _checkpoint(pipeline_id, etapa):
+    """Resultado já gravado de uma etapa, ou None. Sem Redis, processa-se sem checkpoints."""
+    try:
+        valor = get_redis().get(_chave_etapa(pipeline_id, etapa))
+    except Exception as e:
+        logger.warning(f"Checkpoint da etapa '{etapa}' indisponível ({e}).")
+        return None
+    return json.loads(valor) if valor is not None else None
+
+
+def _marcar_checkpoint(pipeline_id, etapa, resultado):
+    try:
+        guardar_resultado_etapa(pipeline_id, etapa, resultado)
+    except Exception as e:
+        logger.warning(f"Falha ao gravar o checkpoint da etapa '{etapa}': {e}")
+
+
+def _email_da_etapa(email):
+    # O corpo segue por referência, se foi gravado à parte no enfileiramento
+    return {k: email[k] for k in ("assunto", "corpo", "corpo_ref", "remetente") if k in email}
+
+
+def _espera_smtp():
+    """Espera pelo SMTP: SMTP_SEND_TIMEOUT_SECONDS, mas sempre abaixo do timeout do job atual."""
+    limite = getattr(get_current_job(), "timeout", None)
+    if isinstance(limite, (int, float)) and limite > 0:
+        # Margem para o resto do job: o RQ não pode interromper o job antes de o envio ter resposta
+        return min(SMTP_SEND_TIMEOUT_SECONDS, 0.8 * limite)
+    return SMTP_SEND_TIMEOUT_SECONDS
+
+
+class EnvioPorVerificar(RuntimeError):
+    """O envio pode ter chegado ao cliente: não é repetido e o job falha para verificação manual."""
+
+
+def _falhar_para_verificacao(pipeline_id, destinatario, motivo):
+    job = get_current_job()
+    if job is not None:
+        # Repetir não resolve a dúvida: o job vai logo para o registo de falhados do RQ
+        job.retries_left = 0
+    raise EnvioPorVerificar(
+        f"[PIPELINE {pipeline_id}] {motivo}: a cotação para {destinatario} pode ter sido enviada. "
+        f"Verifique manualmente; para reenviar, apague {_chave_etapa(pipeline_id, 'envio:em_curso')} "
+        f"e volte a enfileirar o job."
+    )
+
+
+def _enviar_uma_vez(pipeline_id, destinatario, assunto, cotacao):
+    """
+    Envia a cotação no máximo uma vez por e-mail e devolve True (enviado) ou False (não enviado).
+    Antes do SMTP grava `pipeline:<id>:envio:em_curso`. A marca só é apagada se o envio falhar
+    de certeza (False): a retentativa volta a enviar. Se o resultado for desconhecido
+    (timeout já com o envio em curso), ou se a marca já existir porque um envio anterior foi
+    interrompido (job morto por timeout, worker morto), o envio não se repete: lança
+    `EnvioPorVerificar` e o job fica no registo de falhados do RQ.
+    """
+    chave = _chave_etapa(pipeline_id, "envio:em_curso")
+    try:
+        redis = get_redis()
+        marcado = redis.set(chave, 1, nx=True, ex=PIPELINE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"[PIPELINE {pipeline_id}] Marca de envio indisponível ({e}). A enviar sem proteção contra duplicados.")
+        redis, marcado = None, True
+    if not marcado:
+        _falhar_para_verificacao(pipeline_id, destinatario, "Envio anterior interrompido sem confirmação")
+    sucesso = enviar_email_cotacao(
+        destinatario=destinatario, assunto_original=assunto, cotacao=cotacao, timeout=_espera_smtp()
+    )
+    if sucesso is None:
+        _falhar_para_verificacao(pipeline_id, destinatario, "Resultado do envio desconhecido (timeout)")
+    if not sucesso and redis is not None:
+        redis.delete(chave)
+    return bool(sucesso)
+
+
+def _entrada_da_etapa(pipeline_id, etapa_anterior, etapa):
+    """
+    Lê o resultado da etapa anterior. Se o pipeline foi interrompido (dados insuficientes,
+    sem cotação), propaga a interrupção e devolve None: os jobs dependentes correm na
+    mesma, mas terminam sem fazer nada.
+    """
+    anterior = ler_resultado_etapa(pipeline_id, etapa_anterior)
+    if "parar" in anterior:
+        guardar_resultado_etapa(pipeline_id, etapa, anterior)
+        return None
+    return anterior
+
+
+@medir_tarefa("extracao")
+def extrair_dados_task(pipeline_id, email):
+    """Etapa 1: extração dos dados do pedido com o LLM."""
+    job = get_current_job()
+    if _checkpoint(pipeline_id, "extracao") is not None:
+        logger.info(f"[PIPELINE {pipeline_id}] Extração já concluída (checkpoint), sem nova chamada à IA.")
+        return
+    logger.info(f"[PIPELINE {pipeline_id}] Extração (job {job.id}) para o e-mail de: {email['remetente']}")
+    corpo = corpo_do_email(email)
+    dados_extraidos = analisar_email(corpo)
+    if not _dados_completos(dados_extraidos):
+        logger.warning(f"[PIPELINE {pipeline_id}] Dados insuficientes no e-mail: {corpo[:150]}...")
+        guardar_resultado_etapa(pipeline_id, "extracao", {"parar": "dados insuficientes"})
+        return
+    logger.info(f"[PIPELINE {pipeline_id}] Dados extraídos: {dados_extraidos}")
+    guardar_resultado_etapa(pipeline_id, "extracao", {"email": _email_da_etapa(email), "dados": dados_extraidos})
+
+
+@medir_tarefa("cotacao")
+def calcular_cotacao_task(pipeline_id):
+    """Etapa 2: cotação a partir dos dados extraídos."""
+    if _checkpoint(pipeline_id, "cotacao") is not None:
+        return
+    extracao = _entrada_da_etapa(pipeline_id, "extracao", "cotacao")
+    if extracao is None:
+        return
+    cotacao = calcular_cotacao(extracao["dados"])
+    if not cotacao:
+        logger.warning(f"[PIPELINE {pipeline_id}] Nenhuma cotação encontrada para os dados: {extracao['dados']}")
+        guardar_resultado_etapa(pipeline_id, "cotacao", {"parar": "sem cotação"})
+        return
+    logger.info(f"[PIPELINE {pipeline_id}] Cotação encontrada: {cotacao}")
+    guardar_resultado_etapa(pipeline_id, "cotacao", {"cotacao": cotacao})
+
+
+@medir_tarefa("envio")
+def enviar_cotacao_task(pipeline_id):
+    """Etapa 3: envio da resposta ao cliente."""
+    if _checkpoint(pipeline_id, "envio") is not None:
+        logger.info(f"[PIPELINE {pipeline_id}] Cotação já enviada (checkpoint), envio não repetido.")
+        return
+    cotacao = _entrada_da_etapa(pipeline_id, "cotacao", "envio")
+    if cotacao is None:
+        return
+    email = ler_resultado_etapa(pipeline_id, "extracao")["email"]
+    sucesso = _enviar_uma_vez(pipeline_id, email["remetente"], email["assunto"], cotacao["cotacao"])
+    if not sucesso:
+        # Falha a etapa: o RQ repete só o envio, e a ingestão fica à espera
+        raise RuntimeError(f"Falha no envio do e-mail para {email['remetente']}")
+    logger.info(f"[PIPELINE {pipeline_id}] E-mail enviado com sucesso para {email['remetente']}")
+    guardar_resultado_etapa(pipeline_id, "envio", {"enviado": True})
+
+
+@medir_tarefa("ingestao")
+def ingerir_exemplo_task(pipeline_id):
+    """Etapa 4: persistência do e-mail cotado como exemplo no RAG store."""
+    if _checkpoint(pipeline_id, "ingestao") is not None:
+        return
+    if _entrada_da_etapa(pipeline_id, "envio", "ingestao") is None:
+        return
+    email = ler_resultado_etapa(pipeline_id, "extracao")["email"]
+    cotacao = ler_resultado_etapa(pipeline_id, "cotacao")["cotacao"]
+    _ingerir_no_rag(pipeline_id, email, cotacao)
+    guardar_resultado_etapa(pipeline_id, "ingestao", {"ingerido": rag_ingest_email is not None})
+
+
+FUNCOES_ETAPAS = {
+    "extracao": extrair_dados_task,
+    "cotacao": calcular_cotacao_task,
+    "envio": enviar_cotacao_task,
+    "ingestao": ingerir_exemplo_task,
+}
+
+
+def _opcoes_job(etapa, pipeline_id):
+    config = CONFIG_ETAPAS[etapa]
+    return {
+        "timeout": config["timeout"],
+        "retry": Retry(max=config["retries"], interval=config["intervalos"]) if config["retries"] else None,
+        "on_failure": CALLBACK_FALHA,
+        "description": f"{etapa} {pipeline_id}",
+    }
+
+
+def reservar_emails(emails, connection):
+    """
+    Dá a cada e-mail o seu `pipeline_id` e reserva-o com SET NX (`pipeline:<id>:enfileirado`),
+    numa única ida ao Redis. Devolve cópias dos e-mails ainda não enfileirados, com o campo
+    `pipeline_id`. Os repetidos no próprio lote e os já enfileirados antes (p.ex. depois de uma
+    falha entre o enfileiramento e a marcação como lido, ou numa reexecução manual) são descartados.
+    """
+    unicos = {}
+    for email in emails:
+        unicos.setdefault(email.get("pipeline_id") or id_pipeline(email), email)
+    with connection.pipeline(transaction=False) as pipe:
+        for pipeline_id in unicos:
+            pipe.set(_chave_etapa(pipeline_id, "enfileirado"), 1, nx=True, ex=PIPELINE_TTL_SECONDS)
+        reservados = pipe.execute()
+    novos = [dict(email, pipeline_id=pipeline_id) for (pipeline_id, email), novo in zip(unicos.items(), reservados) if novo]
+    if len(novos) < len(emails):
+        logger.info(f"{len(emails) - len(novos)} e-mails ignorados no enfileiramento por já estarem enfileirados.")
+    return novos
+
+
+def libertar_emails(emails, connection):
+    """Desfaz `reservar_emails` (o enfileiramento falhou e os e-mails voltam a poder ser enfileirados)."""
+    if emails:
+        connection.delete(*[_chave_etapa(email["pipeline_id"], "enfileirado") for email in emails])
+
+
+def enfileirar_pipelines(emails, connection):
+    """
+    Enfileira as quatro etapas de cada e-mail numa única transação Redis (MULTI/EXEC).
+    Devolve, por e-mail enfileirado, os jobs pela ordem das etapas. Os e-mails já enfileirados
+    antes são descartados (`reservar_emails`), e os jobs têm IDs determinísticos
+    (`<pipeline_id>-<etapa>`).
+
+    `enqueue(depends_on=...)` faz um WATCH e várias idas ao Redis por job dependente. Aqui
+    as etapas 2–4 são gravadas como adiadas e registadas como dependentes na mesma
+    transação em que as primeiras etapas entram na fila (`Queue.enqueue_many`). Assim
+    nenhuma etapa pode terminar antes de os seus dependentes estarem registados, e um
+    lote inteiro da caixa de correio segue numa única transação.
+    """
+    novos = reservar_emails(emails, connection)
+    if not novos:
+        return []
+    filas = {etapa: Queue(CONFIG_ETAPAS[etapa]["fila"], connection=connection) for etapa in ETAPAS}
+    por_email = []
+    primeiras_etapas = []
+    try:
+        with connection.pipeline() as pipe:
+            for email in novos:
+                pipeline_id = email["pipeline_id"]
+                email = referenciar_corpo(email, pipe)
+                ids = [f"{pipeline_id}-{etapa}" for etapa in ETAPAS]
+                primeiras_etapas.append(Queue.prepare_data(
+                    FUNCOES_ETAPAS[ETAPAS[0]], (pipeline_id, email), job_id=ids[0], **_opcoes_job(ETAPAS[0], pipeline_id)
+                ))
+                dependentes = []
+                for indice, etapa in enumerate(ETAPAS[1:], start=1):
+                    job = filas[etapa].create_job(
+                        FUNCOES_ETAPAS[etapa], args=(pipeline_id,), depends_on=ids[indice - 1], job_id=ids[indice],
+                        status=JobStatus.DEFERRED, **_opcoes_job(etapa, pipeline_id),
+                    )
+                    job.save(pipeline=pipe)
+                    job.register_dependency(pipeline=pipe)
+                    dependentes.append(job)
+                por_email.append(dependentes)
+            primeiros = filas[ETAPAS[0]].enqueue_many(primeiras_etapas, pipeline=pipe)
+            pipe.execute()
+    except Exception:
+        libertar_emails(novos, connection)
+        raise
+    return [[primeiro] + dependentes for primeiro, dependentes in zip(primeiros, por_email)]
+
+
+def enfileirar_pipeline(email, connection):
+    """Enfileira as etapas de um único e-mail (ver `enfileirar_pipelines`); None se já estava enfileirado."""
+    jobs = enfileirar_pipelines([email], connection)
+    return jobs[0] if jobs else None
@@ -0,0 +1,121 @@
+"""
+Peças partilhadas pelos testes.
+
+`FakeRedis` é um stand-in em memória para os comandos Redis que o código usa diretamente
+(strings, hashes e pipelines), com respostas em bytes como o redis-py. Os pipelines guardam
+os comandos que receberam, para os testes contarem idas ao Redis; os comandos que o fake não
+implementa (p.ex. os que o RQ usa para gravar jobs) são apenas registados.
+
+Para correr jobs num worker do RQ é preciso um Redis completo: `redis_para_rq()` devolve uma
+ligação ao `fakeredis`, se estiver instalado, ou a um Redis dedicado em TESTES_REDIS_URL,
+com a base de dados esvaziada; caso contrário o teste é saltado.
+"""
+import os
+import unittest
+
+
+def _bytes(valor):
+    if isinstance(valor, bytes):
+        return valor
+    return str(valor).encode("utf-8")
+
+
+class FakeRedis:
+    """Stand-in mínimo do Redis: get/set (ex, nx)/delete/exists, hashes e pipelines."""
+
+    def __init__(self):
+        self.dados = {}
+        self.hashes = {}
+        # Pipelines criados e número de pipelines executados (uma ida ao Redis cada)
+        self.pipelines = []
+        self.execucoes = 0
+
+    def info(self, *args, **kwargs):
+        return {"redis_version": "7.2.0"}
+
+    def get(self, chave):
+        return self.dados.get(chave)
+
+    def set(self, chave, valor, ex=None, nx=False):
+        if nx and chave in self.dados:
+            return None
+        self.dados[chave] = _bytes(valor)
+        return True
+
+    def delete(self, *chaves):
+        return sum(
+            (self.dados.pop(chave, None) is not None) + (self.hashes.pop(chave, None) is not None)
+            for chave in chaves
+        )
+
+    def exists(self, chave):
+        return int(chave in self.dados or chave in self.hashes)
+
+    def hgetall(self, chave):
+        return {campo.encode("utf-8"): valor for campo, valor in self.hashes.get(chave, {}).items()}
+
+    def hset(self, chave, campo=None, valor=None, mapping=None):
+        tabela = self.hashes.setdefault(chave, {})
+        novos = dict(mapping or {})
+        if campo is not None:
+            novos[campo] = valor
+        for campo, valor in novos.items():
+            tabela[campo] = _bytes(valor)
+        return len(novos)
+
+    def hincrbyfloat(self, chave, campo, valor):
+        tabela = self.hashes.setdefault(chave, {})
+        total = float(tabela.get(campo, b"0")) + float(valor)
+        tabela[campo] = _bytes(repr(total))
+        return total
+
+    def smembers(self, chave):
+        return set()
+
+    def pipeline(self, transaction=True):
+        self.pipelines.append(FakePipeline(self))
+        return self.pipelines[-1]
+
+
+class FakePipeline:
+    """Acumula os comandos e aplica-os ao FakeRedis em `execute()`."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.comandos = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __getattr__(self, nome):
+        return lambda *args, **kwargs: self.comandos.append((nome, args, kwargs))
+
+    def execute(self):
+        self.redis.execucoes += 1
+        resultados = []
+        for nome, args, kwargs in self.comandos:
+            comando = getattr(self.redis, nome, None)
+            resultados.append(comando(*args, **kwargs) if comando else True)
+        return resultados
+
+
+def redis_para_rq():
+    """Ligação a um Redis onde o RQ possa correr jobs (fakeredis ou TESTES_REDIS_URL), ou SkipTest."""
+    try:
+        import fakeredis
+    except ImportError:
+        fakeredis = None
+    if fakeredis is not None:
+        ligacao = fakeredis.FakeStrictRedis()
+    else:
+        url = os.getenv("TESTES_REDIS_URL")
+        if not url:
+            raise unittest.SkipTest("Requer o pacote fakeredis ou um Redis dedicado em TESTES_REDIS_URL")
+        from redis import Redis
+
+        ligacao = Redis.from_url(url)
+    ligacao.flushdb()
+    return ligacao
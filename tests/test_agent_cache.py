@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import agent
+from llm_cache import LlmCache
+from conftest import FakeRedis
+
+
+def resposta_ollama(dados):
+    return {"message": {"content": json.dumps(dados)}}
+
+
+class TestAgentLlmCache(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.cache = LlmCache(agent.PROMPT_VERSAO, redis_conn=self.redis)
+        self.dados_brutos = {
+            "destino_texto": "Porto", "peso_texto": "100 kg", "volume_texto": "40 m3",
+            "tipo_transporte": None, "temperatura": "frio",
+        }
+
+    @patch('agent._build_rag_context', return_value="")
+    @patch('agent.ollama.chat')
+    def test_email_repetido_nao_chama_llm(self, mock_chat, _mock_rag):
+        mock_chat.return_value = resposta_ollama(self.dados_brutos)
+        with patch('agent._llm_cache', self.cache):
+            primeiro = agent.analisar_email("Pedido: 100 kg,  40 m3 para Porto.\n")
+            segundo = agent.analisar_email("  Pedido: 100 kg, 40 m3 para Porto.")
+
+        self.assertEqual(mock_chat.call_count, 1)
+        self.assertEqual(primeiro, segundo)
+        self.assertEqual(segundo["destino"], "porto")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    @patch('agent._build_rag_context', return_value="")
+    @patch('agent.ollama.chat')
+    def test_nova_versao_do_prompt_invalida_cache(self, mock_chat, _mock_rag):
+        mock_chat.return_value = resposta_ollama(self.dados_brutos)
+        with patch('agent._llm_cache', self.cache):
+            agent.analisar_email("Pedido: 100 kg, 40 m3 para Porto.")
+        with patch('agent._llm_cache', LlmCache("outra-versao", redis_conn=self.redis)):
+            agent.analisar_email("Pedido: 100 kg, 40 m3 para Porto.")
+
+        self.assertEqual(mock_chat.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import agent
+
+
+class FakeAsyncClient:
+    """Servidor Ollama simulado: responde com o destino indicado no e-mail, com latência."""
+
+    em_curso = 0
+    max_em_curso = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def chat(self, model, messages, format=None, **kwargs):
+        cls = FakeAsyncClient
+        cls.em_curso += 1
+        cls.max_em_curso = max(cls.max_em_curso, cls.em_curso)
+        try:
+            corpo = messages[-1]["content"]
+            destino = corpo.split("DESTINO=")[1].split()[0]
+            await asyncio.sleep(0.5 if destino == "lento" else 0.01 * (hash(destino) % 5))
+            dados = {"destino_texto": destino, "peso_texto": "100 kg", "volume_texto": "2 m3",
+                     "tipo_transporte": None, "temperatura": "ambiente"}
+            return {"message": {"content": json.dumps(dados)}}
+        finally:
+            cls.em_curso -= 1
+
+
+class TestAnalisarEmailsLote(unittest.TestCase):
+
+    def setUp(self):
+        FakeAsyncClient.em_curso = 0
+        FakeAsyncClient.max_em_curso = 0
+        self.patches = [
+            patch('agent.ollama.AsyncClient', FakeAsyncClient),
+            patch('agent._build_rag_context', return_value=""),
+            patch('agent._llm_cache.enabled', False),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_resultados_na_ordem_de_entrada_com_concorrencia_limitada(self):
+        destinos = [f"cidade{i}" for i in range(12)]
+        resultados = agent.analisar_emails_lote([f"DESTINO={d} urgente" for d in destinos], max_concorrencia=3)
+
+        self.assertEqual([r["destino"] for r in resultados], destinos)
+        self.assertLessEqual(FakeAsyncClient.max_em_curso, 3)
+        self.assertGreater(FakeAsyncClient.max_em_curso, 1)
+
+    def test_timeout_por_pedido(self):
+        resultados = agent.analisar_emails_lote(
+            ["DESTINO=porto x", "DESTINO=lento x", "DESTINO=faro x"], max_concorrencia=3, timeout=0.2
+        )
+        self.assertEqual(resultados[0]["destino"], "porto")
+        self.assertIsNone(resultados[1])
+        self.assertEqual(resultados[2]["destino"], "faro")
+
+    def test_cache_e_rag_fora_do_event_loop(self):
+        loop = threading.get_ident()
+        threads = {"rag": [], "get": [], "set": []}
+
+        def registar(nome, valor=None):
+            def chamada(*args, **kwargs):
+                threads[nome].append(threading.get_ident())
+                return valor
+            return chamada
+
+        with patch('agent._build_rag_context', side_effect=registar("rag", "")), \
+                patch('agent._llm_cache.get', side_effect=registar("get")), \
+                patch('agent._llm_cache.set', side_effect=registar("set")):
+            resultados = agent.analisar_emails_lote(["DESTINO=porto x", "DESTINO=faro x"], max_concorrencia=2)
+
+        self.assertEqual([r["destino"] for r in resultados], ["porto", "faro"])
+        for nome, idents in threads.items():
+            self.assertEqual(len(idents), 2, nome)
+            self.assertNotIn(loop, idents, nome)
+
+
+class TestLayoutDoPrompt(unittest.TestCase):
+
+    @patch('agent._build_rag_context')
+    def test_prefixo_estavel_entre_emails(self, mock_rag):
+        mock_rag.side_effect = ["Ex1: destino=porto", "Ex1: destino=faro | outro"]
+        a = agent._montar_mensagens("Pedido A para Porto")
+        b = agent._montar_mensagens("Pedido B para Faro")
+
+        self.assertEqual(a[0], b[0])
+        self.assertTrue(a[1]["content"].startswith(agent.PROMPT_EXTRACAO))
+        self.assertTrue(b[1]["content"].startswith(agent.PROMPT_EXTRACAO))
+        # Apenas a parte final (contexto RAG + e-mail) varia
+        self.assertTrue(a[1]["content"].endswith("Pedido A para Porto\n---"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import agent
+
+
+class TestExtracaoPorRegras(unittest.TestCase):
+
+    def setUp(self):
+        self.destinos = patch('agent.destinos_validos', ["meimoa", "lisboa", "porto"])
+        self.destinos.start()
+
+    def tearDown(self):
+        self.destinos.stop()
+
+    def test_email_semi_estruturado(self):
+        dados = agent.extrair_por_regras("\nVols: Fruta\nPeso (kgs): 800\nM3: 5\nEntrega: Meimoa\n")
+        self.assertEqual(dados["destino_texto"], "meimoa")
+        self.assertEqual(agent.normalizar_peso(dados["peso_texto"]), 800)
+        self.assertEqual(agent.normalizar_volume(dados["volume_texto"]), 5)
+
+    def test_dimensoes_e_aeroporto(self):
+        corpo = (
+            "Carga:\nQty: 1 plt\nDms: 112x47x80 cm\nWght: 190 kg\n"
+            "Entrega:\nAeroporto de Lisboa a/c JTM\nDestino - LIS / HAV - CUBA\n"
+        )
+        dados = agent.extrair_por_regras(corpo)
+        self.assertEqual(dados["destino_texto"], "lisboa")
+        self.assertEqual(agent.normalizar_volume(dados["volume_texto"]), 0.42)
+        self.assertEqual(agent.normalizar_peso(dados["peso_texto"]), 190)
+
+    def test_unidade_no_rotulo(self):
+        dados = agent.extrair_por_regras("Peso (ton): 2\nVolume: 10 m3\nDestino: Porto")
+        self.assertEqual(agent.normalizar_peso(dados["peso_texto"]), 2000)
+
+    def test_inconclusivo_segue_para_llm(self):
+        # Destino fora da tabela, valores ambíguos ou texto livre
+        self.assertIsNone(agent.extrair_por_regras("Peso: 800\nM3: 5\nEntrega: Faro"))
+        self.assertIsNone(agent.extrair_por_regras("Peso: 800\nPeso: 900\nM3: 5\nEntrega: Porto"))
+        self.assertIsNone(agent.extrair_por_regras("Preciso de 8 toneladas para Porto, 3m x 3m x 5m."))
+
+    @patch('agent.ollama.chat')
+    def test_analisar_email_nao_chama_llm(self, mock_chat):
+        dados = agent.analisar_email("Vols: Fruta\nPeso (kgs): 800\nM3: 5\nEntrega: Meimoa")
+        mock_chat.assert_not_called()
+        self.assertEqual(dados["destino"], "meimoa")
+        self.assertEqual(dados["peso"], 800)
+        self.assertEqual(dados["volume"], 5)
+        # Heurística de cadeia de frio continua a aplicar-se ("fruta")
+        self.assertEqual(dados["temperatura"], "frio")
+        self.assertGreaterEqual(agent.estatisticas_fast_path()["hits"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
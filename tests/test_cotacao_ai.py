@@ -21,6 +21,7 @@ class TestCotacaoAI(unittest.TestCase):
         os.environ["SMTP_SERVIDOR"] = "smtp.test.com"
         os.environ["SMTP_PORTA"] = "587"
 
+    @patch('main.enfileirar_pipelines') # Enfileiramento por etapas (sem Redis real)
     @patch('main.obter_emails')
     @patch('tasks.enviar_email_cotacao') # Patch no local onde é USADO em tasks.py
     @patch('redis.Redis') # Mock da classe Redis
@@ -29,7 +30,7 @@ class TestCotacaoAI(unittest.TestCase):
     @patch('tasks.get_current_job')
     @patch('tasks.analisar_email') # Re-adicionar este mock
     @patch('tasks.calcular_cotacao') # Re-adicionar este mock
-    def test_main_flow_with_mocked_emails(self, mock_calcular_cotacao, mock_analisar_email, mock_get_current_job, mock_main_q, MockQueueClass, mock_Redis, mock_enviar_email_cotacao, mock_obter_emails):
+    def test_main_flow_with_mocked_emails(self, mock_calcular_cotacao, mock_analisar_email, mock_get_current_job, mock_main_q, MockQueueClass, mock_Redis, mock_enviar_email_cotacao, mock_obter_emails, mock_enfileirar_pipeline):
         # Configurar o mock para obter_emails para retornar uma lista de e-mails de teste
         mock_obter_emails.return_value = [
             {
@@ -46,6 +47,7 @@ class TestCotacaoAI(unittest.TestCase):
 
         # Configurar o mock para a instância de Queue em main.py
         mock_main_q.enqueue.return_value = mock_job
+        mock_enfileirar_pipeline.return_value = [[mock_job]]
 
         # Configurar o mock para get_current_job
         mock_get_current_job.return_value = mock_job
@@ -75,8 +77,9 @@ class TestCotacaoAI(unittest.TestCase):
         # Verificar se obter_emails foi chamado
         mock_obter_emails.assert_called_once()
 
-        # Verificar se a tarefa de processar_email_task foi enfileirada através da variável global 'q'
-        mock_main_q.enqueue.assert_called_once()
+        # Verificar se o lote de e-mails foi enfileirado no pipeline por etapas
+        mock_enfileirar_pipeline.assert_called_once()
+        self.assertEqual(mock_enfileirar_pipeline.call_args[0][0], mock_obter_emails.return_value)
 
         # Chamar processar_email_task diretamente para testar sua lógica
         processar_email_task(mock_obter_emails.return_value[0])
@@ -0,0 +1,107 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cotador import Cotador
+
+
+class TestCotadorIndice(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        n = 2000
+        destinos = [f"destino_{i}" for i in range(40)]
+        self.df = pd.DataFrame({
+            "destino": rng.choice(destinos, n),
+            "peso_maximo": rng.choice([100, 500, 1000, 5000, 20000], n),
+            "volume_maximo": rng.choice([1, 5, 10, 40, 90], n),
+            "tipo_transporte": rng.choice(["Pequeno", "Médio", "Camiao"], n),
+            "temperatura": rng.choice(["ambiente", "frio"], n),
+            # Preços com empates para validar a ordem de desempate
+            "preco": rng.integers(50, 80, n).astype(float),
+        })
+        fd, self.tabela_path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.df.to_csv(self.tabela_path, index=False)
+        self.cotador = Cotador(tabela_path=self.tabela_path)
+
+    def tearDown(self):
+        os.remove(self.tabela_path)
+
+    def test_indice_coincide_com_pesquisa_na_tabela(self):
+        rng = np.random.default_rng(7)
+        for _ in range(500):
+            destino = f"destino_{rng.integers(0, 45)}"
+            peso = float(rng.integers(1, 25000))
+            volume = float(rng.uniform(0, 100))
+            temperatura = str(rng.choice(["ambiente", "frio"]))
+
+            via_indice = self.cotador._procurar_no_indice(destino, peso, volume, temperatura)
+            via_tabela = self.cotador._procurar_na_tabela(destino, peso, volume, temperatura)
+
+            if via_tabela is None:
+                self.assertIsNone(via_indice)
+            else:
+                self.assertIsNotNone(via_indice)
+                self.assertEqual(via_indice.name, via_tabela.name)
+
+    def test_encontrar_cotacao_normaliza_destino(self):
+        linha = self.df.iloc[0]
+        resultado = self.cotador.encontrar_cotacao(
+            destino=f"  {linha['destino'].upper()} ",
+            peso=float(linha["peso_maximo"]),
+            volume=float(linha["volume_maximo"]),
+            temperatura=linha["temperatura"].capitalize(),
+        )
+        self.assertIsNotNone(resultado)
+        self.assertEqual(resultado["destino"], linha["destino"])
+        self.assertLessEqual(resultado["preco"], linha["preco"])
+
+    def test_lote_coincide_com_cotacao_individual(self):
+        rng = np.random.default_rng(11)
+        pedidos = [
+            (
+                f"Destino_{rng.integers(0, 40)}",
+                float(rng.integers(1, 20000)),
+                float(rng.uniform(0, 90)),
+                str(rng.choice(["ambiente", "frio"])),
+            )
+            for _ in range(300)
+        ]
+        with patch.object(Cotador, "_cotar_por_api", return_value=None):
+            lote = self.cotador.encontrar_cotacoes_lote(pedidos)
+            individuais = [self.cotador.encontrar_cotacao(*p) for p in pedidos]
+
+        self.assertEqual(len(lote), len(pedidos))
+        for a, b in zip(lote, individuais):
+            self.assertEqual(a is None, b is None)
+            if a is not None:
+                self.assertEqual(a.name, b.name)
+
+    def test_lote_envia_apenas_falhas_para_api(self):
+        linha = self.df.iloc[3]
+        pedidos = pd.DataFrame({
+            "destino": ["inexistente", linha["destino"], "outro_inexistente"],
+            "peso": [10, linha["peso_maximo"], 20],
+            "volume": [1, linha["volume_maximo"], 2],
+        })
+        with patch.object(Cotador, "precarregar_distancias") as mock_precarregar, \
+                patch.object(Cotador, "_cotar_por_api", side_effect=lambda d, p, v, t: {"destino": d, "fonte": "api"}) as mock_api:
+            resultados = self.cotador.encontrar_cotacoes_lote(pedidos)
+
+        self.assertEqual(mock_api.call_count, 2)
+        mock_precarregar.assert_called_once_with(["inexistente", "outro_inexistente"])
+        self.assertEqual(resultados[0], {"destino": "inexistente", "fonte": "api"})
+        self.assertEqual(resultados[1]["destino"], linha["destino"])
+        self.assertEqual(resultados[2], {"destino": "outro_inexistente", "fonte": "api"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,286 @@
+import base64
+import os
+import socket
+import threading
+import time
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import email_reader
+from conftest import FakeRedis
+
+
+TEXTO_PLAIN = b'("text" "plain" ("charset" "utf-8") NIL NIL "base64" 120 5 NIL NIL NIL NIL)'
+ANEXO_PDF = b'("application" "pdf" ("name" "guia.pdf") NIL NIL "base64" 900000 NIL NIL NIL NIL)'
+
+
+class FakeIMAP:
+    """Servidor IMAP simulado: responde a UID SEARCH/FETCH/STORE a partir de mensagens em memória."""
+
+    def __init__(self, mensagens):
+        # uid -> (assunto, corpo, bodystructure)
+        self.mensagens = mensagens
+        self.comandos = []
+        self.vistos = set()
+        # UIDs cujo FETCH de cabeçalhos ou de corpo responde NO
+        self.falhas_cabecalho = set()
+        self.falhas_corpo = set()
+
+    def login(self, *args):
+        return "OK", [b""]
+
+    def select(self, *args):
+        return "OK", [str(len(self.mensagens)).encode()]
+
+    def logout(self):
+        return "BYE", [b""]
+
+    def _uids(self, conjunto):
+        uids = []
+        for parte in conjunto.split(","):
+            if ":" in parte:
+                a, b = parte.split(":")
+                uids.extend(range(int(a), int(b) + 1))
+            else:
+                uids.append(int(parte))
+        return [u for u in uids if u in self.mensagens]
+
+    uidvalidity = 7
+
+    def response(self, nome):
+        return nome, [None]
+
+    def status(self, pasta, itens):
+        uidnext = max(self.mensagens, default=0) + 1
+        return "OK", [f"{pasta} (UIDVALIDITY {self.uidvalidity} UIDNEXT {uidnext})".encode()]
+
+    def uid(self, comando, *args):
+        self.comandos.append((comando,) + args)
+        if comando == "SEARCH":
+            criterio = list(args[1:])
+            uids = sorted(self.mensagens)
+            if "UNSEEN" in criterio:
+                uids = [u for u in uids if u not in self.vistos]
+            if "UID" in criterio:
+                inicio = int(criterio[criterio.index("UID") + 1].split(":")[0])
+                # Como num servidor real, "n:*" inclui sempre a última mensagem
+                uids = [u for u in uids if u >= inicio] or uids[-1:]
+            return "OK", [b" ".join(str(u).encode() for u in uids)]
+        if comando == "STORE":
+            self.vistos.update(self._uids(args[0]))
+            return "OK", []
+        conjunto, itens = args
+        falhas = self.falhas_cabecalho if "HEADER.FIELDS" in itens else self.falhas_corpo
+        if falhas.intersection(self._uids(conjunto)):
+            return "NO", [b"Falha temporaria"]
+        dados = []
+        for i, uid in enumerate(self._uids(conjunto), 1):
+            assunto, corpo, estrutura = self.mensagens[uid]
+            if "HEADER.FIELDS" in itens:
+                cab = f"Subject: {assunto}\r\nFrom: cliente{uid}@example.com\r\nMessage-ID: <{uid}@example.com>\r\n\r\n".encode()
+                meta = b"%d (UID %d BODYSTRUCTURE %s BODY[HEADER.FIELDS (SUBJECT FROM MESSAGE-ID)] {%d}" % (i, uid, estrutura, len(cab))
+                dados.extend([(meta, cab), b")"])
+            else:
+                secao = itens.split("[")[1].split("]")[0]
+                literal = base64.b64encode(corpo.encode())
+                meta = b"%d (UID %d BODY[%s] {%d}" % (i, uid, secao.encode(), len(literal))
+                dados.extend([(meta, literal), b")"])
+        return "OK", dados
+
+
+class TestObterEmails(unittest.TestCase):
+
+    def setUp(self):
+        self.env = patch.dict(os.environ, {"APP_TEST_MODE": "false", "EMAIL_SERVIDOR": "imap.test.com"})
+        self.env.start()
+        self.redis = FakeRedis()
+        self.redis_patch = patch('email_reader.get_redis', return_value=self.redis)
+        self.redis_patch.start()
+
+    def tearDown(self):
+        self.redis_patch.stop()
+        self.env.stop()
+
+    def obter(self, fake):
+        with patch('email_reader.imaplib.IMAP4_SSL', return_value=fake):
+            return email_reader.obter_emails()
+
+    def test_busca_em_lote_e_marca_apenas_relevantes(self):
+        fake = FakeIMAP({
+            10: ("Pedido de cotação", "Peso: 800 kg\nEntrega: Porto", b"(" + TEXTO_PLAIN + ANEXO_PDF + b' "mixed")'),
+            11: ("Newsletter", "Promoções da semana", TEXTO_PLAIN),
+            12: ("Transporte", "Preciso de orçamento urgente para Faro", TEXTO_PLAIN),
+        })
+        emails = self.obter(fake)
+
+        self.assertEqual([e["uid"] for e in emails], ["10", "12"])
+        self.assertEqual(emails[0]["corpo"], "Peso: 800 kg\nEntrega: Porto")
+        self.assertEqual(emails[0]["message_id"], "<10@example.com>")
+        # Nada é marcado como lido antes de os e-mails serem enfileirados
+        self.assertEqual(fake.vistos, set())
+        with patch('email_reader.imaplib.IMAP4_SSL', return_value=fake):
+            email_reader.confirmar_emails(emails)
+        self.assertEqual(fake.vistos, {10, 12})
+
+        fetches = [c for c in fake.comandos if c[0] == "FETCH"]
+        # Um FETCH de cabeçalhos e um de corpos (mesma secção "1" para todas as mensagens)
+        self.assertEqual(len(fetches), 2)
+        self.assertEqual(fetches[0][1], "10:12")
+        self.assertIn("BODY.PEEK[1]", fetches[1][2])
+        self.assertEqual(len([c for c in fake.comandos if c[0] == "STORE"]), 1)
+
+    def test_checkpoint_le_apenas_uids_novos(self):
+        fake = FakeIMAP({
+            10: ("Pedido de cotação", "Entrega: Porto", TEXTO_PLAIN),
+            11: ("Newsletter", "Promoções", TEXTO_PLAIN),
+        })
+        emails = self.obter(fake)
+        self.assertEqual([e["uid"] for e in emails], ["10"])
+        email_reader.confirmar_emails(emails)
+
+        # Nova mensagem já aberta por alguém na caixa: continua a ser processada
+        fake.mensagens[12] = ("Pedido urgente", "Entrega: Faro", TEXTO_PLAIN)
+        fake.vistos.add(12)
+        fake.comandos.clear()
+        emails = self.obter(fake)
+        self.assertEqual([e["uid"] for e in emails], ["12"])
+        pesquisa = [c for c in fake.comandos if c[0] == "SEARCH"][0]
+        self.assertEqual(pesquisa[2:], ("UID", "12:*"))
+
+    def test_sem_confirmacao_o_email_volta_a_ser_lido(self):
+        fake = FakeIMAP({10: ("Pedido de cotação", "Entrega: Porto", TEXTO_PLAIN)})
+        self.assertEqual(len(self.obter(fake)), 1)
+        # Falha entre a leitura e o enfileiramento: o e-mail não se perde
+        emails = self.obter(fake)
+        self.assertEqual([e["uid"] for e in emails], ["10"])
+        email_reader.confirmar_emails(emails)
+        self.assertEqual(self.obter(fake), [])
+
+    def test_idempotente_por_message_id(self):
+        fake = FakeIMAP({10: ("Pedido de cotação", "Entrega: Porto", TEXTO_PLAIN)})
+        email_reader.confirmar_emails(self.obter(fake))
+        # UIDVALIDITY muda (pasta recriada): UIDs reiniciam, mas o Message-ID já foi processado
+        fake.uidvalidity = 8
+        fake.vistos.clear()
+        self.assertEqual(self.obter(fake), [])
+
+    def test_falha_no_enfileiramento_nao_marca_como_lido(self):
+        import main
+        fake = FakeIMAP({10: ("Pedido de cotação", "Entrega: Porto", TEXTO_PLAIN)})
+        with patch('email_reader.imaplib.IMAP4_SSL', return_value=fake), \
+                patch('main.enfileirar_emails', side_effect=ConnectionError("Redis em baixo")):
+            with self.assertLogs(level="ERROR"):
+                main.main()
+        self.assertEqual(fake.vistos, set())
+        self.assertFalse([c for c in fake.comandos if c[0] == "STORE"])
+        # O e-mail continua disponível para o ciclo seguinte
+        self.assertEqual([e["uid"] for e in self.obter(fake)], ["10"])
+
+    def test_lote_que_falha_volta_a_ser_lido(self):
+        fake = FakeIMAP({
+            10: ("Pedido de cotação", "Entrega: Porto", TEXTO_PLAIN),
+            11: ("Pedido urgente", "Entrega: Faro", TEXTO_PLAIN),
+            12: ("Cotação", "Entrega: Braga", TEXTO_PLAIN),
+            13: ("Orçamento", "Entrega: Évora", TEXTO_PLAIN),
+        })
+        fake.falhas_cabecalho.add(11)
+        fake.falhas_corpo.add(13)
+        with patch.object(email_reader, "IMAP_FETCH_BATCH", 1), self.assertLogs(level="WARNING"):
+            emails = self.obter(fake)
+            self.assertEqual([e["uid"] for e in emails], ["10", "12"])
+            email_reader.confirmar_emails(emails)
+            # O checkpoint fica antes da primeira mensagem que não foi lida
+            self.assertEqual(email_reader.ler_checkpoint("inbox")["ultimo_uid"], 10)
+
+            fake.falhas_cabecalho.clear()
+            fake.falhas_corpo.clear()
+            # 12 já foi enfileirado (Message-ID registado) e não se repete
+            emails = self.obter(fake)
+        self.assertEqual([e["uid"] for e in emails], ["11", "13"])
+
+    def test_conjunto_uids(self):
+        self.assertEqual(email_reader._conjunto_uids(["7", "1", "2", "3", "9", "10"]), "1:3,7,9:10")
+
+
+class FakeIdle:
+    """Ligação IMAP simulada sobre um socketpair, para exercitar o ciclo IDLE/DONE."""
+
+    def __init__(self):
+        self.cliente, self.servidor = socket.socketpair()
+        self.file = self.cliente.makefile("rb")
+        self.enviados = []
+        # Respostas enviadas no mesmo pacote que o "+ idling"
+        self.junto_ao_idle = b""
+
+    def _new_tag(self):
+        return b"A001"
+
+    def send(self, dados):
+        self.enviados.append(dados)
+        if dados.endswith(b"IDLE\r\n"):
+            self.servidor.sendall(b"+ idling\r\n" + self.junto_ao_idle)
+        elif dados == b"DONE\r\n":
+            self.servidor.sendall(b"A001 OK IDLE terminated\r\n")
+
+    def readline(self):
+        return self.file.readline()
+
+    def socket(self):
+        return self.cliente
+
+    def close(self):
+        self.file.close()
+        self.cliente.close()
+        self.servidor.close()
+
+
+class TestImapIdle(unittest.TestCase):
+
+    def setUp(self):
+        self.mail = FakeIdle()
+
+    def tearDown(self):
+        self.mail.close()
+
+    def test_exists_termina_idle(self):
+        threading.Timer(0.05, self.mail.servidor.sendall, args=(b"* 4 EXISTS\r\n",)).start()
+        self.assertTrue(email_reader.aguardar_novos_emails(self.mail, timeout=5))
+        self.assertEqual(self.mail.enviados, [b"A001 IDLE\r\n", b"DONE\r\n"])
+
+    def test_exists_ja_no_buffer(self):
+        # A linha EXISTS chega com o "+ idling" e fica no buffer do ficheiro, fora da vista do select()
+        self.mail.junto_ao_idle = b"* 4 EXISTS\r\n"
+        inicio = time.monotonic()
+        self.assertTrue(email_reader.aguardar_novos_emails(self.mail, timeout=5))
+        self.assertLess(time.monotonic() - inicio, 1)
+
+    def test_timeout_sem_novidades(self):
+        self.assertFalse(email_reader.aguardar_novos_emails(self.mail, timeout=0.1))
+        self.assertEqual(self.mail.enviados[-1], b"DONE\r\n")
+
+    def test_ligacao_fechada_lanca_abort(self):
+        threading.Timer(0.05, self.mail.servidor.shutdown, args=(socket.SHUT_WR,)).start()
+        with self.assertRaises(email_reader.imaplib.IMAP4.abort):
+            email_reader.aguardar_novos_emails(self.mail, timeout=5)
+
+
+class TestEscuta(unittest.TestCase):
+
+    def test_backoff_so_reinicia_depois_de_um_idle_completo(self):
+        import main
+        # Liga-se, mas a ligação cai sempre antes do IDLE: o backoff não pode voltar a 1 s
+        ler = patch('main.ler_emails_novos', side_effect=[
+            email_reader.imaplib.IMAP4.abort("caiu"), email_reader.imaplib.IMAP4.abort("caiu"), [], [],
+        ])
+        idle = patch('main.aguardar_novos_emails', side_effect=[False, email_reader.imaplib.IMAP4.abort("caiu"), KeyboardInterrupt])
+        with patch('main.conectar_imap', return_value=FakeIMAP({})), ler, idle, \
+                patch('main.time.sleep') as dormir, self.assertLogs(level="WARNING"):
+            main.escutar()
+        self.assertEqual([c.args[0] for c in dormir.call_args_list], [1.0, 2.0, 1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import socket
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import email_sender
+from email_sender import SmtpSpool, enviar_email_cotacao
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:  # Dependência apenas de testes
+    Controller = None
+
+
+class Recetor:
+    def __init__(self):
+        self.mensagens = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.mensagens.append(envelope)
+        return "250 OK"
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+COTACAO = {
+    "destino": "Porto", "tipo_transporte": "Camiao Grande", "peso": 100,
+    "volume": 40, "preco_final": 850.0, "temperatura": "frio",
+}
+
+
+@unittest.skipIf(Controller is None, "aiosmtpd não instalado")
+class TestSmtpSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.porta = porta_livre()
+        self.recetor = Recetor()
+        self.controller = Controller(self.recetor, hostname="127.0.0.1", port=self.porta)
+        self.controller.start()
+        self.spool = SmtpSpool("127.0.0.1", self.porta, starttls=False, pool_size=1, batch_size=10)
+
+    def tearDown(self):
+        self.spool.close(timeout=5)
+        self.controller.stop()
+
+    def test_reutiliza_a_mesma_sessao(self):
+        env = {"APP_TEST_MODE": "false", "EMAIL_USUARIO": "cotacoes@example.com"}
+        with patch.dict(os.environ, env), patch.object(email_sender, "get_spool", return_value=self.spool):
+            for i in range(5):
+                self.assertTrue(enviar_email_cotacao(f"cliente{i}@example.com", "Pedido", COTACAO))
+
+        self.assertEqual(len(self.recetor.mensagens), 5)
+        self.assertEqual(self.recetor.mensagens[0].rcpt_tos, ["cliente0@example.com"])
+        stats = self.spool.stats()
+        self.assertEqual(stats["ligacoes"], 1)
+        self.assertEqual(stats["enviados"], 5)
+
+    def test_volta_a_ligar_quando_a_sessao_cai(self):
+        futuros = [self.spool.enqueue(self._mensagem("a@example.com"))]
+        self.assertTrue(futuros[0].result(timeout=5))
+
+        # Servidor reinicia: a sessão persistente deixa de ser válida
+        self.controller.stop()
+        self.controller = Controller(self.recetor, hostname="127.0.0.1", port=self.porta)
+        self.controller.start()
+
+        futuros = [self.spool.enqueue(self._mensagem(f"b{i}@example.com")) for i in range(3)]
+        self.assertTrue(all(f.result(timeout=5) for f in futuros))
+        self.assertEqual(len(self.recetor.mensagens), 4)
+        self.assertGreaterEqual(self.spool.stats()["ligacoes"], 2)
+
+    def test_close_envia_o_que_esta_na_fila(self):
+        futuros = [self.spool.enqueue(self._mensagem(f"c{i}@example.com")) for i in range(10)]
+        self.spool.close(timeout=5)
+        self.assertTrue(all(f.result(timeout=1) for f in futuros))
+        self.assertEqual(len(self.recetor.mensagens), 10)
+
+    def test_credenciais_sem_auth_no_servidor_falham(self):
+        # O servidor de teste não anuncia AUTH: com credenciais configuradas, o envio falha
+        spool = SmtpSpool("127.0.0.1", self.porta, usuario="u", senha="s", starttls=False, pool_size=1)
+        try:
+            with self.assertLogs(level="ERROR"):
+                self.assertFalse(spool.enqueue(self._mensagem("d@example.com")).result(timeout=5))
+        finally:
+            spool.close(timeout=5)
+        self.assertEqual(self.recetor.mensagens, [])
+
+    @staticmethod
+    def _mensagem(destinatario):
+        from email.mime.text import MIMEText
+        msg = MIMEText("teste")
+        msg["From"] = "cotacoes@example.com"
+        msg["To"] = destinatario
+        msg["Subject"] = "Re: Pedido"
+        return msg
+
+
+class SessaoLenta:
+    """Sessão SMTP falsa que só conclui cada envio quando o teste o permitir."""
+
+    def __init__(self, liberar):
+        self.liberar = liberar
+        self.enviadas = []
+
+    def send_message(self, msg):
+        self.liberar.wait(5)
+        self.enviadas.append(msg["To"])
+
+    def noop(self):
+        return 250, b"OK"
+
+    def quit(self):
+        pass
+
+
+class TestTimeoutDoEnvio(unittest.TestCase):
+
+    def setUp(self):
+        self.liberar = threading.Event()
+        self.sessao = SessaoLenta(self.liberar)
+        self.ligar = patch.object(SmtpSpool, "_ligar", return_value=self.sessao)
+        self.ligar.start()
+        self.spool = SmtpSpool("127.0.0.1", 25, starttls=False, pool_size=1, batch_size=1)
+
+    def tearDown(self):
+        self.liberar.set()
+        self.ligar.stop()
+
+    def test_sem_espera_proibido_dentro_de_um_job(self):
+        with patch("rq.get_current_job", return_value=object()), patch.dict(os.environ, {"APP_TEST_MODE": "false"}):
+            with self.assertRaises(ValueError):
+                enviar_email_cotacao("a@example.com", "Pedido", COTACAO, aguardar=False)
+
+    def test_timeout_cancela_o_que_ainda_esta_na_fila(self):
+        env = {"APP_TEST_MODE": "false", "EMAIL_USUARIO": "cotacoes@example.com"}
+        with patch.dict(os.environ, env), patch.object(email_sender, "get_spool", return_value=self.spool):
+            # A primeira mensagem já está a ser enviada: o resultado fica desconhecido
+            self.assertIsNone(enviar_email_cotacao("a@example.com", "Pedido", COTACAO, timeout=0.3))
+            # A segunda ainda está na fila: é retirada e não chega a ser enviada
+            self.assertIs(enviar_email_cotacao("b@example.com", "Pedido", COTACAO, timeout=0.3), False)
+        self.liberar.set()
+        self.spool.close(timeout=5)
+        self.assertEqual(self.sessao.enviadas, ["a@example.com"])
+        self.assertEqual(self.spool.stats()["cancelados"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
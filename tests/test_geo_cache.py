@@ -0,0 +1,147 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from geo_cache import GeoCache, normalizar_chave
+from cotador import Cotador
+
+
+class TestGeoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "geo_cache.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hit_miss_e_negativo(self):
+        cache = GeoCache(db_path=self.db_path, ttl_seconds=60, negative_ttl_seconds=60)
+        self.assertEqual(cache.get("geocode", "meimoa"), (False, None))
+        cache.set("geocode", "meimoa", [40.2, -7.1])
+        cache.set("geocode", "nenhures", None)
+        self.assertEqual(cache.get("geocode", "meimoa"), (True, [40.2, -7.1]))
+        self.assertEqual(cache.get("geocode", "nenhures"), (True, None))
+
+        stats = cache.stats()["geocode"]
+        self.assertEqual((stats["hits"], stats["negative_hits"], stats["misses"]), (1, 1, 1))
+
+    def test_partilhada_entre_instancias_e_expira(self):
+        GeoCache(db_path=self.db_path, ttl_seconds=60, negative_ttl_seconds=0.01).set("geocode", "nenhures", None)
+        outra = GeoCache(db_path=self.db_path)
+        time.sleep(0.02)
+        self.assertEqual(outra.get("geocode", "nenhures"), (False, None))
+
+    def test_normalizar_chave(self):
+        self.assertEqual(normalizar_chave("  Lisboa,   Portugal "), "lisboa, portugal")
+
+
+class TestCotadorGeocodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.tabela_path = os.path.join(self.tmpdir, "tabela.csv")
+        with open(self.tabela_path, "w", encoding="utf-8") as f:
+            f.write("destino,peso_maximo,volume_maximo,tipo_transporte,temperatura,preco\n")
+            f.write("porto,1000,10,Normal,ambiente,150\n")
+        self.env = patch.dict(os.environ, {"GEOCACHE_PATH": os.path.join(self.tmpdir, "geo.sqlite3")})
+        self.env.start()
+        # Sem espera entre pedidos ao Nominatim, exceto no teste do espaçamento
+        self.intervalo = patch('cotador.NOMINATIM_MIN_INTERVAL_SECONDS', 0.0)
+        self.intervalo.start()
+        self.cotador = Cotador(tabela_path=self.tabela_path)
+
+    def tearDown(self):
+        self.intervalo.stop()
+        self.env.stop()
+        shutil.rmtree(self.tmpdir)
+
+    @patch('cotador.requests.get')
+    def test_geocode_consulta_nominatim_uma_vez(self, mock_get):
+        resposta = MagicMock()
+        resposta.json.return_value = [{"lat": "38.72", "lon": "-9.14"}]
+        mock_get.return_value = resposta
+
+        self.assertEqual(self.cotador._geocode("Lisboa, Portugal"), (38.72, -9.14))
+        self.assertEqual(self.cotador._geocode("lisboa,  portugal"), (38.72, -9.14))
+        # Outro processo/instância reutiliza o mesmo ficheiro
+        self.assertEqual(Cotador(tabela_path=self.tabela_path)._geocode("LISBOA, PORTUGAL"), (38.72, -9.14))
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('cotador.requests.get')
+    def test_erro_de_rede_nao_fica_em_cache(self, mock_get):
+        mock_get.side_effect = ConnectionError("sem rede")
+        self.assertIsNone(self.cotador._geocode("Meimoa"))
+        self.assertIsNone(self.cotador._geocode("Meimoa"))
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('cotador.requests.get')
+    def test_distancia_em_cache_por_coordenadas_arredondadas(self, mock_get):
+        resposta = MagicMock()
+        resposta.json.return_value = {"routes": [{"distance": 313000.0}]}
+        mock_get.return_value = resposta
+
+        self.assertEqual(self.cotador._osrm_distance_km((38.72231, -9.13931), (41.15, -8.61)), 313.0)
+        self.assertEqual(self.cotador._osrm_distance_km((38.722311, -9.139312), (41.15, -8.61)), 313.0)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(self.cotador.estatisticas_cache()["osrm"]["hits"], 1)
+
+    @patch('cotador.requests.get')
+    def test_precarregar_distancias_usa_endpoint_table(self, mock_get):
+        locais = {"lisboa, portugal": (38.72, -9.14), "porto": (41.15, -8.61), "faro": (37.02, -7.93)}
+        self.cotador._geo_cache.set_many("geocode", {k: list(v) for k, v in locais.items()})
+
+        resposta = MagicMock()
+        resposta.json.return_value = {"code": "Ok", "distances": [[0.0, 313000.0, 278500.0]]}
+        mock_get.return_value = resposta
+
+        distancias = self.cotador.precarregar_distancias(["Porto", "Faro", "Porto"])
+        self.assertEqual(distancias, {"Porto": 313.0, "Faro": 278.5})
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIn("/table/v1/driving/", mock_get.call_args[0][0])
+
+        # Depois do aquecimento, o fallback não faz pedidos de rede
+        self.assertEqual(self.cotador._osrm_distance_km(locais["lisboa, portugal"], locais["faro"]), 278.5)
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('cotador.requests.get')
+    def test_precarregar_distancias_espacia_pedidos_ao_nominatim(self, mock_get):
+        self.cotador._geo_cache.set_many("geocode", {"lisboa, portugal": [38.72, -9.14], "porto": [41.15, -8.61]})
+        relogio = [1000.0]
+        pedidos = []
+
+        def responder(url, params=None, **kwargs):
+            resposta = MagicMock()
+            if "nominatim" in url:
+                pedidos.append((params["q"], relogio[0]))
+                resposta.json.return_value = [{"lat": "37.0", "lon": "-7.9"}]
+            else:
+                resposta.json.return_value = {"code": "Ok", "distances": [[0.0, 1000.0, 2000.0, 3000.0, 4000.0]]}
+            relogio[0] += 0.2
+            return resposta
+
+        def dormir(segundos):
+            relogio[0] += segundos
+
+        mock_get.side_effect = responder
+        with patch('cotador.time.monotonic', side_effect=lambda: relogio[0]), \
+                patch('cotador.time.sleep', side_effect=dormir) as sleep, \
+                patch('cotador._nominatim_ultimo_pedido', float("-inf")), \
+                patch('cotador.NOMINATIM_MIN_INTERVAL_SECONDS', 1.0):
+            self.cotador.precarregar_distancias(["Faro", "Porto", "Beja", "Evora"])
+
+        # Os três destinos fora da cache, a pelo menos 1 s uns dos outros
+        self.assertEqual([q for q, _ in pedidos], ["Faro", "Beja", "Evora"])
+        self.assertTrue(all(b - a >= 1.0 for (_, a), (_, b) in zip(pedidos, pedidos[1:])))
+        # A origem e o Porto vêm da cache e não esperam
+        self.assertEqual(sleep.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import metricas
+from conftest import FakeRedis
+
+
+class RedisEmBaixo:
+
+    def pipeline(self, transaction=True):
+        raise ConnectionError("Redis em baixo")
+
+
+def amostras(texto):
+    """Linhas de amostras do formato Prometheus -> {amostra com labels: valor}."""
+    return {
+        linha.rsplit(" ", 1)[0]: float(linha.rsplit(" ", 1)[1])
+        for linha in texto.splitlines() if linha and not linha.startswith("#")
+    }
+
+
+class TestMetricas(unittest.TestCase):
+
+    def setUp(self):
+        metricas._reiniciar_no_filho()
+        self.redis = FakeRedis()
+
+    def test_histograma_cumulativo_numa_so_ida_ao_redis(self):
+        for valor in (0.0002, 0.3, 0.3, 400):
+            metricas.observar("cotacoes_operacao_segundos", valor, operacao="ollama")
+        metricas.publicar(self.redis)
+        self.assertEqual(self.redis.execucoes, 1)
+
+        texto = metricas.exportar_prometheus(self.redis)
+        self.assertIn("# TYPE cotacoes_operacao_segundos histogram", texto)
+        valores = amostras(texto)
+        self.assertEqual(valores['cotacoes_operacao_segundos_bucket{operacao="ollama",le="0.0001"}'], 0)
+        self.assertEqual(valores['cotacoes_operacao_segundos_bucket{operacao="ollama",le="0.0005"}'], 1)
+        self.assertEqual(valores['cotacoes_operacao_segundos_bucket{operacao="ollama",le="0.5"}'], 3)
+        self.assertEqual(valores['cotacoes_operacao_segundos_bucket{operacao="ollama",le="300"}'], 3)
+        self.assertEqual(valores['cotacoes_operacao_segundos_bucket{operacao="ollama",le="+Inf"}'], 4)
+        self.assertEqual(valores['cotacoes_operacao_segundos_count{operacao="ollama"}'], 4)
+        self.assertAlmostEqual(valores['cotacoes_operacao_segundos_sum{operacao="ollama"}'], 400.6002)
+        # Buckets por ordem crescente de `le`
+        linhas = [l for l in texto.splitlines() if l.startswith("cotacoes_operacao_segundos_bucket")]
+        self.assertTrue(linhas[-1].startswith('cotacoes_operacao_segundos_bucket{operacao="ollama",le="+Inf"}'))
+        self.assertLess(linhas.index(next(l for l in linhas if 'le="2.5"' in l)),
+                        linhas.index(next(l for l in linhas if 'le="10"' in l)))
+
+    def test_agregado_entre_workers(self):
+        for _ in range(2):
+            # Cada worker publica o seu acumulado no mesmo hash
+            metricas.contar_cache("llm", True)
+            metricas.contar_cache("llm", False)
+            metricas.contar_cache("llm", True)
+            metricas.publicar(self.redis)
+        valores = amostras(metricas.exportar_prometheus(self.redis))
+        self.assertEqual(valores['cotacoes_cache_total{cache="llm",resultado="hit"}'], 4)
+        self.assertEqual(valores['cotacoes_cache_total{cache="llm",resultado="miss"}'], 2)
+        self.assertAlmostEqual(valores['cotacoes_cache_taxa_acerto{cache="llm"}'], 4 / 6)
+
+    def test_medir_conta_erros_e_serve_de_decorador(self):
+        @metricas.medir("geocoding")
+        def falha():
+            raise ValueError("sem rede")
+
+        with self.assertRaises(ValueError):
+            falha()
+        with metricas.medir("geocoding"):
+            pass
+        metricas.publicar(self.redis)
+        valores = amostras(metricas.exportar_prometheus(self.redis))
+        self.assertEqual(valores['cotacoes_operacao_segundos_count{operacao="geocoding"}'], 2)
+        self.assertEqual(valores['cotacoes_operacao_erros_total{operacao="geocoding"}'], 1)
+
+    def test_medir_tarefa_regista_resultado_e_publica(self):
+        @metricas.medir_tarefa("envio")
+        def tarefa(falhar):
+            if falhar:
+                raise RuntimeError("SMTP")
+            return "ok"
+
+        with patch.object(metricas, "get_redis", return_value=self.redis):
+            self.assertEqual(tarefa(False), "ok")
+            with self.assertRaises(RuntimeError):
+                tarefa(True)
+        self.assertEqual(self.redis.execucoes, 2)
+        valores = amostras(metricas.exportar_prometheus(self.redis))
+        self.assertEqual(valores['cotacoes_tarefas_total{resultado="ok",tarefa="envio"}'], 1)
+        self.assertEqual(valores['cotacoes_tarefas_total{resultado="erro",tarefa="envio"}'], 1)
+        self.assertEqual(valores['cotacoes_tarefa_segundos_count{tarefa="envio"}'], 2)
+
+    def test_falha_na_publicacao_guarda_para_a_seguinte(self):
+        metricas.incrementar("cotacoes_cotacoes_total", fonte="tabela")
+        metricas.publicar(RedisEmBaixo())
+        metricas.incrementar("cotacoes_cotacoes_total", fonte="tabela")
+        metricas.publicar(self.redis)
+        valores = amostras(metricas.exportar_prometheus(self.redis))
+        self.assertEqual(valores['cotacoes_cotacoes_total{fonte="tabela"}'], 2)
+
+    def test_desativadas(self):
+        with patch.object(metricas, "METRICAS_ENABLED", False):
+            metricas.incrementar("cotacoes_cotacoes_total", fonte="api")
+            metricas.observar("cotacoes_operacao_segundos", 1.0, operacao="smtp")
+        metricas.publicar(self.redis)
+        self.assertEqual(self.redis.execucoes, 0)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requer fork")
+    def test_filho_nao_herda_observacoes_do_pai(self):
+        metricas.incrementar("cotacoes_cotacoes_total", fonte="tabela")
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if not metricas._buffer else 1)
+        _, estado = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(estado), 0)
+        self.assertTrue(metricas._buffer)
+
+    def test_textfile(self):
+        metricas.incrementar("cotacoes_cotacoes_total", fonte="api")
+        metricas.publicar(self.redis)
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, "cotacoes.prom")
+            with patch.object(metricas, "get_redis", return_value=self.redis):
+                metricas.escrever_textfile(caminho)
+            with open(caminho, encoding="utf-8") as f:
+                self.assertIn('cotacoes_cotacoes_total{fonte="api"} 1', f.read())
+            self.assertEqual(os.listdir(diretorio), ["cotacoes.prom"])
+
+
+if __name__ == '__main__':
+    unittest.main()
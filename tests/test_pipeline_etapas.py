@@ -0,0 +1,340 @@
+import importlib
+import json
+import os
+import sys
+import unittest
+import zlib
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+from rq import Queue, SimpleWorker
+from rq.job import Job, JobStatus
+from rq.registry import FailedJobRegistry
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import main
+import metricas
+import redis_client
+import tasks
+from conftest import FakeRedis, redis_para_rq
+
+
+EMAIL = {"remetente": "cliente@example.com", "assunto": "Pedido", "corpo": "100 kg, 2 m3 para Porto"}
+DADOS = {"destino": "porto", "peso": 100.0, "volume": 2.0, "temperatura": "ambiente"}
+COTACAO = {"destino": "Porto", "tipo_transporte": "Pequeno", "peso": 100.0, "volume": 2.0,
+           "preco_final": np.float64(120.5), "temperatura": "ambiente"}
+
+
+class TestPipelineEtapas(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.patches = {
+            "get_redis": patch.object(tasks, "get_redis", return_value=self.redis),
+            "get_current_job": patch.object(tasks, "get_current_job", return_value=MagicMock(id="job")),
+            "analisar_email": patch.object(tasks, "analisar_email", return_value=dict(DADOS)),
+            "calcular_cotacao": patch.object(tasks, "calcular_cotacao", return_value=dict(COTACAO)),
+            "enviar_email_cotacao": patch.object(tasks, "enviar_email_cotacao", return_value=True),
+            "rag_ingest_email": patch.object(tasks, "rag_ingest_email"),
+        }
+        self.mocks = {nome: p.start() for nome, p in self.patches.items()}
+
+    def tearDown(self):
+        for p in self.patches.values():
+            p.stop()
+
+    def correr(self, pipeline_id="p1"):
+        tasks.extrair_dados_task(pipeline_id, EMAIL)
+        tasks.calcular_cotacao_task(pipeline_id)
+        tasks.enviar_cotacao_task(pipeline_id)
+        tasks.ingerir_exemplo_task(pipeline_id)
+
+    def test_etapas_passam_resultados_pelo_redis(self):
+        self.correr()
+        self.mocks["calcular_cotacao"].assert_called_once_with(DADOS)
+        kwargs = self.mocks["enviar_email_cotacao"].call_args.kwargs
+        self.assertEqual(kwargs["destinatario"], EMAIL["remetente"])
+        self.assertEqual(kwargs["assunto_original"], EMAIL["assunto"])
+        self.assertEqual(kwargs["cotacao"]["preco_final"], 120.5)
+        texto, meta = self.mocks["rag_ingest_email"].call_args[0]
+        self.assertIn(EMAIL["corpo"], texto)
+        self.assertEqual(meta["fonte"], "cotacao_enviada")
+        self.assertEqual(tasks.ler_resultado_etapa("p1", "ingestao"), {"ingerido": True})
+
+    def test_dados_insuficientes_param_as_etapas_seguintes(self):
+        self.mocks["analisar_email"].return_value = {"destino": "porto", "peso": None, "volume": None}
+        self.correr()
+        self.mocks["calcular_cotacao"].assert_not_called()
+        self.mocks["enviar_email_cotacao"].assert_not_called()
+        self.mocks["rag_ingest_email"].assert_not_called()
+        self.assertIn("parar", tasks.ler_resultado_etapa("p1", "ingestao"))
+
+    def test_retentativa_do_envio_nao_repete_a_extracao(self):
+        self.mocks["enviar_email_cotacao"].side_effect = [False, True]
+        tasks.extrair_dados_task("p1", EMAIL)
+        tasks.calcular_cotacao_task("p1")
+        with self.assertRaises(RuntimeError):
+            tasks.enviar_cotacao_task("p1")
+        # O RQ volta a correr só o job de envio
+        tasks.enviar_cotacao_task("p1")
+        tasks.ingerir_exemplo_task("p1")
+        self.assertEqual(self.mocks["analisar_email"].call_count, 1)
+        self.assertEqual(self.mocks["calcular_cotacao"].call_count, 1)
+        self.assertEqual(self.mocks["enviar_email_cotacao"].call_count, 2)
+        self.mocks["rag_ingest_email"].assert_called_once()
+
+    def test_reexecucao_salta_etapas_concluidas(self):
+        self.correr()
+        self.correr()
+        self.mocks["analisar_email"].assert_called_once()
+        self.mocks["calcular_cotacao"].assert_called_once()
+        self.mocks["enviar_email_cotacao"].assert_called_once()
+        self.mocks["rag_ingest_email"].assert_called_once()
+
+    def test_envio_interrompido_falha_para_verificacao(self):
+        tasks.extrair_dados_task("p1", EMAIL)
+        tasks.calcular_cotacao_task("p1")
+        # Job morto (timeout do RQ, worker morto) depois de marcar o envio e antes de gravar o resultado
+        self.redis.set("pipeline:p1:envio:em_curso", 1)
+        with self.assertRaises(tasks.EnvioPorVerificar):
+            tasks.enviar_cotacao_task("p1")
+        self.mocks["enviar_email_cotacao"].assert_not_called()
+        # Sem retentativas: o job vai logo para o registo de falhados
+        self.assertEqual(self.mocks["get_current_job"].return_value.retries_left, 0)
+        self.assertIsNone(self.redis.get("pipeline:p1:envio"))
+
+    def test_timeout_com_envio_em_curso_nao_e_repetido(self):
+        # enviar_email_cotacao devolve None: o tempo esgotou com a mensagem já a ser enviada
+        self.mocks["enviar_email_cotacao"].return_value = None
+        tasks.extrair_dados_task("p1", EMAIL)
+        tasks.calcular_cotacao_task("p1")
+        for _ in range(2):
+            with self.assertRaises(tasks.EnvioPorVerificar):
+                tasks.enviar_cotacao_task("p1")
+        self.mocks["enviar_email_cotacao"].assert_called_once()
+        self.assertIsNotNone(self.redis.get("pipeline:p1:envio:em_curso"))
+        self.assertEqual(self.mocks["get_current_job"].return_value.retries_left, 0)
+
+    def test_envio_rejeitado_liberta_a_marca(self):
+        self.mocks["enviar_email_cotacao"].return_value = False
+        tasks.extrair_dados_task("p1", EMAIL)
+        tasks.calcular_cotacao_task("p1")
+        with self.assertRaises(RuntimeError) as erro:
+            tasks.enviar_cotacao_task("p1")
+        self.assertNotIsInstance(erro.exception, tasks.EnvioPorVerificar)
+        self.assertIsNone(self.redis.get("pipeline:p1:envio:em_curso"))
+
+    def test_tarefa_unica_com_resultado_desconhecido(self):
+        self.mocks["enviar_email_cotacao"].return_value = None
+        with self.assertRaises(tasks.EnvioPorVerificar):
+            tasks.processar_email_task(EMAIL)
+        with self.assertRaises(tasks.EnvioPorVerificar):
+            tasks.processar_email_task(EMAIL)
+        self.mocks["enviar_email_cotacao"].assert_called_once()
+        self.mocks["rag_ingest_email"].assert_not_called()
+
+    def test_tarefa_unica_retoma_na_etapa_que_falhou(self):
+        self.mocks["enviar_email_cotacao"].side_effect = [False, True]
+        with self.assertRaises(RuntimeError):
+            tasks.processar_email_task(EMAIL)
+        tasks.processar_email_task(EMAIL)
+        tasks.processar_email_task(EMAIL)
+        self.mocks["analisar_email"].assert_called_once()
+        self.mocks["calcular_cotacao"].assert_called_once()
+        self.assertEqual(self.mocks["enviar_email_cotacao"].call_count, 2)
+        self.mocks["rag_ingest_email"].assert_called_once()
+        pipeline_id = tasks.id_pipeline(EMAIL)
+        self.assertEqual(tasks.ler_resultado_etapa(pipeline_id, "envio"), {"enviado": True})
+
+    def test_id_pipeline_deterministico(self):
+        self.assertEqual(tasks.id_pipeline(EMAIL), tasks.id_pipeline(dict(EMAIL)))
+        self.assertEqual(
+            tasks.id_pipeline(dict(EMAIL, message_id="<a@b>")),
+            tasks.id_pipeline({"message_id": "<a@b>", "corpo": "outro"}),
+        )
+        self.assertNotEqual(tasks.id_pipeline(EMAIL), tasks.id_pipeline(dict(EMAIL, corpo="outro")))
+
+    def test_resultado_em_falta(self):
+        with self.assertRaises(RuntimeError):
+            tasks.calcular_cotacao_task("inexistente")
+
+    def test_resultados_sao_json(self):
+        tasks.guardar_resultado_etapa("p1", "cotacao", {"cotacao": COTACAO, "n": np.int64(3)})
+        guardado = json.loads(self.redis.get("pipeline:p1:cotacao"))
+        self.assertEqual(guardado["n"], 3)
+
+
+class TestEnfileirarPipelines(unittest.TestCase):
+
+    def setUp(self):
+        self.ligacao = FakeRedis()
+
+    def comandos(self, nome):
+        return [c for p in self.ligacao.pipelines for c in p.comandos if c[0] == nome]
+
+    def test_lote_inteiro_numa_so_ida_ao_redis(self):
+        emails = [dict(EMAIL, remetente=f"c{i}@example.com") for i in range(20)]
+        por_email = tasks.enfileirar_pipelines(emails, self.ligacao)
+
+        # Uma ida para reservar os e-mails e uma transação para os jobs
+        self.assertEqual(self.ligacao.execucoes, 2)
+        self.assertEqual(len(por_email), 20)
+        for jobs in por_email:
+            self.assertEqual([j.func for j in jobs], [tasks.FUNCOES_ETAPAS[e] for e in tasks.ETAPAS])
+            self.assertEqual([j.origin for j in jobs], [tasks.CONFIG_ETAPAS[e]["fila"] for e in tasks.ETAPAS])
+            pipeline_id = jobs[0].args[0]
+            self.assertEqual(pipeline_id, tasks.id_pipeline(emails[por_email.index(jobs)]))
+            self.assertEqual([j.id for j in jobs], [f"{pipeline_id}-{etapa}" for etapa in tasks.ETAPAS])
+            self.assertTrue(all(j.args[0] == pipeline_id for j in jobs))
+            for anterior, job in zip(jobs, jobs[1:]):
+                self.assertEqual(job._dependency_ids, [anterior.id])
+            self.assertEqual(jobs[0].timeout, tasks.CONFIG_ETAPAS["extracao"]["timeout"])
+            self.assertEqual(jobs[2].retries_left, tasks.CONFIG_ETAPAS["envio"]["retries"])
+
+        # Cada etapa dependente fica registada como dependente da anterior
+        dependentes = {args[0] for _, args, _ in self.comandos("sadd") if args[0].endswith(":dependents")}
+        self.assertEqual(len(dependentes), 20 * 3)
+
+    def test_corpo_grande_gravado_uma_vez_e_job_so_com_referencia(self):
+        corpo = "Pedido de transporte para o Porto. " * 200
+        emails = [dict(EMAIL, corpo=corpo, remetente=f"c{i}@example.com") for i in range(3)]
+        por_email = tasks.enfileirar_pipelines(emails, self.ligacao)
+
+        corpos = {args[0] for _, args, _ in self.comandos("set") if args[0].startswith("corpo:")}
+        self.assertEqual(len(corpos), 1)
+        email_no_job = por_email[0][0].args[1]
+        self.assertNotIn("corpo", email_no_job)
+        self.assertEqual(corpos, {f"corpo:{email_no_job['corpo_ref']}"})
+        # O payload gravado do job não contém o corpo
+        for _, args, kwargs in self.comandos("hset"):
+            dados = kwargs.get("mapping", {}).get("data")
+            if dados:
+                self.assertNotIn(corpo[:100].encode("utf-8"), zlib.decompress(dados))
+
+    def test_corpo_pequeno_fica_no_job(self):
+        por_email = tasks.enfileirar_pipelines([EMAIL], self.ligacao)
+        self.assertEqual(por_email[0][0].args[1]["corpo"], EMAIL["corpo"])
+        self.assertFalse([c for c in self.comandos("set") if c[1][0].startswith("corpo:")])
+
+    def test_duplicados_descartados_no_enfileiramento(self):
+        outro = dict(EMAIL, remetente="outro@example.com")
+        por_email = tasks.enfileirar_pipelines([EMAIL, dict(EMAIL), outro], self.ligacao)
+        self.assertEqual([jobs[0].args[1]["remetente"] for jobs in por_email], [EMAIL["remetente"], outro["remetente"]])
+        # Reexecução (p.ex. falha antes de marcar os e-mails como lidos)
+        execucoes = self.ligacao.execucoes
+        self.assertEqual(tasks.enfileirar_pipelines([EMAIL, outro], self.ligacao), [])
+        self.assertIsNone(tasks.enfileirar_pipeline(EMAIL, self.ligacao))
+        self.assertEqual(self.ligacao.execucoes, execucoes + 2)
+
+    def test_falha_no_enfileiramento_liberta_os_emails(self):
+        with patch.object(tasks.Queue, "enqueue_many", side_effect=ConnectionError("Redis em baixo")):
+            with self.assertRaises(ConnectionError):
+                tasks.enfileirar_pipelines([EMAIL], self.ligacao)
+        self.assertEqual(len(tasks.enfileirar_pipelines([EMAIL], self.ligacao)), 1)
+
+    def test_corpo_do_email_resolve_referencia(self):
+        redis = FakeRedis()
+        email = tasks.referenciar_corpo(dict(EMAIL, corpo="x" * 1000), redis)
+        with patch.object(tasks, "get_redis", return_value=redis):
+            self.assertEqual(tasks.corpo_do_email(email), "x" * 1000)
+            with self.assertRaises(RuntimeError):
+                tasks.corpo_do_email({"corpo_ref": "inexistente"})
+
+
+class TestCadeiaNoWorker(unittest.TestCase):
+    """As quatro etapas de um e-mail, enfileiradas e corridas por um SimpleWorker do RQ."""
+
+    def setUp(self):
+        self.redis = redis_para_rq()
+        self.enviar = MagicMock(return_value=True)
+        self.ingerir = MagicMock()
+        self.patches = [
+            patch.object(tasks, "get_redis", return_value=self.redis),
+            patch.object(metricas, "get_redis", return_value=self.redis),
+            patch.object(tasks, "analisar_email", return_value=DADOS),
+            patch.object(tasks, "calcular_cotacao", return_value=COTACAO),
+            patch.object(tasks, "enviar_email_cotacao", self.enviar),
+            patch.object(tasks, "rag_ingest_email", self.ingerir),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def correr(self):
+        jobs = tasks.enfileirar_pipeline(EMAIL, self.redis)
+        filas = [Queue(tasks.CONFIG_ETAPAS[etapa]["fila"], connection=self.redis) for etapa in tasks.ETAPAS]
+        SimpleWorker(filas, connection=self.redis).work(burst=True)
+        for job in jobs:
+            job.refresh()
+        return jobs
+
+    def test_etapas_correm_pela_ordem(self):
+        jobs = self.correr()
+        self.assertEqual([job.get_status() for job in jobs], [JobStatus.FINISHED] * 4)
+        self.enviar.assert_called_once()
+        self.assertEqual(self.enviar.call_args.kwargs["destinatario"], EMAIL["remetente"])
+        self.ingerir.assert_called_once()
+        self.assertEqual(tasks.ler_resultado_etapa(jobs[0].args[0], "ingestao"), {"ingerido": True})
+
+    def test_resultado_desconhecido_falha_sem_retentativas(self):
+        self.enviar.return_value = None
+        with patch.object(tasks, "on_failure") as on_failure, self.assertLogs(level="ERROR"):
+            jobs = self.correr()
+        self.assertEqual([job.get_status() for job in jobs],
+                         [JobStatus.FINISHED, JobStatus.FINISHED, JobStatus.FAILED, JobStatus.DEFERRED])
+        self.assertIn(jobs[2].id, FailedJobRegistry(queue=Queue(jobs[2].origin, connection=self.redis)))
+        # O Callback do job chama tasks.on_failure pelo nome
+        on_failure.assert_called_once()
+        self.ingerir.assert_not_called()
+
+
+class TestProdutorUsaRedisUrl(unittest.TestCase):
+    """O produtor grava corpos e jobs no mesmo Redis (REDIS_URL) em que os workers os leem."""
+
+    URL = "redis://redis-cotacoes:6380/3"
+
+    def setUp(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        self.servidor = fakeredis.FakeServer()
+        self.urls = []
+
+        def from_url(url, **kwargs):
+            self.urls.append(url)
+            return fakeredis.FakeStrictRedis(server=self.servidor)
+
+        self.patches = [
+            patch.dict(os.environ, {"REDIS_URL": self.URL}),
+            patch("redis_client.Redis.from_url", side_effect=from_url),
+            patch.object(redis_client, "_redis", None),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        # Repõe as ligações do produtor fora do REDIS_URL do teste
+        importlib.reload(main)
+
+    def test_corpo_enfileirado_e_lido_pelo_mesmo_redis(self):
+        importlib.reload(main)
+        corpo = "Pedido de transporte para o Porto. " * 200
+        email = dict(EMAIL, corpo=corpo, message_id="<redis-url@example.com>")
+        self.assertEqual(main.enfileirar_emails([email]), 1)
+
+        # O worker é outro processo: nova ligação, pelo mesmo REDIS_URL
+        redis_client._redis = None
+        worker = redis_client.get_redis()
+        etapa = f"{tasks.id_pipeline(email)}-{tasks.ETAPAS[0] if tasks.PIPELINE_ETAPAS else 'email'}"
+        job = Job.fetch(etapa, connection=worker)
+        self.assertEqual(tasks.corpo_do_email(job.args[-1]), corpo)
+        self.assertEqual(set(self.urls), {self.URL})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_backfill
+from rag_store import RagStore
+
+
+class TestAddDocuments(unittest.TestCase):
+
+    def test_ingestao_em_lote_preserva_ordem_e_ids(self):
+        store = RagStore(persist_path=tempfile.mkdtemp())
+        ids = store.ingest_emails(
+            [
+                ("Transporte para Porto, 100 kg, frio.", {"id": "a", "destino": "porto"}),
+                ("Carga para Leiria, 30 m3.", {"id": "b", "destino": "leiria"}),
+            ],
+            batch_size=1,
+        )
+        self.assertEqual(ids, ["a", "b"])
+        resultados = store.retrieve_similar("Porto frio", top_k=1)
+        self.assertEqual(resultados[0]["metadata"]["destino"], "porto")
+
+    def test_documento_invalido(self):
+        store = RagStore(persist_path=tempfile.mkdtemp())
+        with self.assertRaises(ValueError):
+            store.add_documents([("   ", {})])
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.arquivo = os.path.join(self.tmpdir, "arquivo.jsonl")
+        with open(self.arquivo, "w", encoding="utf-8") as f:
+            for i in range(5):
+                f.write(json.dumps({"assunto": f"Pedido {i}", "corpo": f"{i}00 kg para Porto", "remetente": "a@b.pt"}) + "\n")
+            f.write("isto não é json\n")
+            f.write(json.dumps({"text": "Cotação antiga para Faro", "metadata": {"destino": "faro"}}) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_ingere_em_lotes_e_guarda_progresso(self):
+        lotes = []
+        with patch.object(rag_backfill, "ingest_emails", side_effect=lambda lote, n: lotes.append(lote)):
+            resumo = rag_backfill.backfill(self.arquivo, batch_size=2)
+
+        self.assertEqual([len(l) for l in lotes], [2, 2, 2])
+        self.assertEqual(resumo["documentos"], 6)
+        self.assertEqual(rag_backfill.ler_progresso(self.arquivo + ".progresso.json"), 7)
+        texto, meta = lotes[0][0]
+        self.assertIn("Corpo: 000 kg para Porto", texto)
+        self.assertTrue(meta["id"].startswith("backfill:"))
+        self.assertEqual(lotes[-1][-1][1]["destino"], "faro")
+
+    def test_retoma_apos_interrupcao(self):
+        chamadas = []
+
+        def falha_no_segundo_lote(lote, n):
+            if chamadas:
+                raise KeyboardInterrupt
+            chamadas.append(lote)
+
+        with patch.object(rag_backfill, "ingest_emails", side_effect=falha_no_segundo_lote):
+            with self.assertRaises(KeyboardInterrupt):
+                rag_backfill.backfill(self.arquivo, batch_size=2)
+        self.assertEqual(rag_backfill.ler_progresso(self.arquivo + ".progresso.json"), 2)
+
+        lotes = []
+        with patch.object(rag_backfill, "ingest_emails", side_effect=lambda lote, n: lotes.append(lote)):
+            resumo = rag_backfill.backfill(self.arquivo, batch_size=2)
+        self.assertEqual(resumo["documentos"], 4)
+        self.assertIn("Pedido 2", lotes[0][0][0])
+
+    def test_ids_estaveis_entre_execucoes(self):
+        registo = {"assunto": "Pedido", "corpo": "100 kg para Porto"}
+        self.assertEqual(
+            rag_backfill.registo_para_documento(registo)[1]["id"],
+            rag_backfill.registo_para_documento(dict(registo))[1]["id"],
+        )
+        self.assertIsNone(rag_backfill.registo_para_documento({"assunto": "Sem corpo", "corpo": ""}))
+
+
+if __name__ == "__main__":
+    unittest.main()
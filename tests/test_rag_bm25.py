@@ -0,0 +1,121 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_store
+
+
+@unittest.skipIf(rag_store._HAS_RAG_BACKEND, "Testa apenas o fallback sem ChromaDB/LlamaIndex")
+class TestRagFallbackBM25(unittest.TestCase):
+
+    def setUp(self):
+        self.store = rag_store.RagStore(persist_path=None)
+        textos = [
+            ("Transporte de 100 kg para Porto, carga fria", "porto"),
+            ("Transporte de 200 kg para Lisboa, carga ambiente", "lisboa"),
+            ("Transporte de 300 kg para Faro, carga ambiente, urgente", "faro"),
+            ("Transporte de paletes para Braga", "braga"),
+        ]
+        for texto, destino in textos:
+            self.store.add_document(texto, {"destino": destino})
+
+    def test_termo_raro_pesa_mais_que_termo_comum(self):
+        resultados = self.store.query_context("transporte carga urgente", top_k=2)
+        self.assertEqual(resultados[0]["metadata"]["destino"], "faro")
+        self.assertEqual(len(resultados), 2)
+        self.assertGreater(resultados[0]["score"], resultados[1]["score"])
+
+    def test_documentos_sem_termos_em_comum_nao_sao_devolvidos(self):
+        self.assertEqual(self.store.query_context("Viseu", top_k=3), [])
+        resultados = self.store.query_context("paletes", top_k=3)
+        self.assertEqual([r["metadata"]["destino"] for r in resultados], ["braga"])
+
+    def test_empates_por_ordem_de_ingestao(self):
+        resultados = self.store.query_context("transporte", top_k=4)
+        # "transporte" aparece uma vez em todos; o documento mais curto pontua mais
+        self.assertEqual(resultados[0]["metadata"]["destino"], "braga")
+        self.assertEqual([r["metadata"]["destino"] for r in resultados[1:3]], ["porto", "lisboa"])
+
+    def test_indice_cresce_alem_da_capacidade_inicial(self):
+        for i in range(50):
+            self.store.add_document(f"Pedido {i} para Coimbra", {"destino": "coimbra", "id": str(i)})
+        resultados = self.store.query_context("Coimbra", top_k=3)
+        self.assertEqual(len(resultados), 3)
+        self.assertTrue(all(r["metadata"]["destino"] == "coimbra" for r in resultados))
+
+
+@unittest.skipIf(rag_store._HAS_RAG_BACKEND, "Testa apenas o fallback sem ChromaDB/LlamaIndex")
+class TestRagFallbackPersistente(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # Os documentos destes testes seguem o mesmo modelo: sem supressão de quase-duplicados
+        self.sem_dedup = patch.object(rag_store, "RAG_DEDUP_ENABLED", False)
+        self.sem_dedup.start()
+
+    def tearDown(self):
+        self.sem_dedup.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_documentos_visiveis_noutra_instancia(self):
+        escritor = rag_store.RagStore(persist_path=self.tmpdir)
+        leitor = rag_store.RagStore(persist_path=self.tmpdir)
+        escritor.add_document("Transporte para Porto, carga fria", {"destino": "porto"})
+        # O leitor já existia: apanha o acréscimo ao log na consulta seguinte
+        self.assertEqual(leitor.query_context("Porto")[0]["metadata"]["destino"], "porto")
+
+        leitor.add_document("Transporte para Faro", {"destino": "faro"})
+        self.assertEqual(escritor.query_context("Faro")[0]["metadata"]["destino"], "faro")
+
+    def test_compactacao_preserva_resultados_e_e_partilhada(self):
+        store = rag_store.RagStore(persist_path=self.tmpdir)
+        for i in range(30):
+            store.add_document(f"Pedido {i} de transporte para Braga", {"destino": "braga", "id": str(i)})
+        store.add_document("Carga fria urgente para Porto", {"destino": "porto"})
+        antes = store.query_context("porto urgente transporte", top_k=5)
+
+        store.compactar()
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, "fallback", "indice-1", "postings_docs.npy")))
+        self.assertEqual(store.query_context("porto urgente transporte", top_k=5), antes)
+
+        # Um processo novo arranca do índice compacto (mmap) sem reindexar o log
+        novo = rag_store.RagStore(persist_path=self.tmpdir)
+        self.assertEqual(novo.query_context("porto urgente transporte", top_k=5), antes)
+        self.assertEqual((novo._c_n, len(novo._d_docs)), (31, 0))
+
+        # Acréscimos depois da compactação ficam no delta e somam-se ao índice mapeado
+        store.add_document("Mais um pedido para Porto", {"destino": "porto", "id": "x"})
+        store.compactar()
+        resultados = novo.query_context("porto", top_k=5)
+        self.assertEqual({r["metadata"]["destino"] for r in resultados}, {"porto"})
+        self.assertEqual(len(resultados), 2)
+
+    def test_compactacao_automatica(self):
+        with patch.object(rag_store, "RAG_FALLBACK_COMPACT_EVERY", 5):
+            store = rag_store.RagStore(persist_path=self.tmpdir)
+            store.add_documents([(f"Pedido {i} para Leiria", {"id": str(i)}) for i in range(6)])
+        self.assertEqual(store._c_n, 6)
+        self.assertEqual(len(store._d_docs), 0)
+
+    def test_escritas_de_varios_processos(self):
+        codigo = (
+            "import sys; sys.path.insert(0, %r); import rag_store; "
+            "s = rag_store.RagStore(persist_path=%r); "
+            "[s.add_document('Pedido %%d do processo %%s para Evora' %% (i, sys.argv[1]), {'p': sys.argv[1]}) for i in range(20)]"
+        ) % (os.path.abspath(os.path.join(os.path.dirname(__file__), '..')), self.tmpdir)
+        env = dict(os.environ, RAG_DEDUP_ENABLED="false")
+        processos = [subprocess.Popen([sys.executable, "-c", codigo, str(p)], env=env) for p in range(3)]
+        for p in processos:
+            self.assertEqual(p.wait(timeout=60), 0)
+        store = rag_store.RagStore(persist_path=self.tmpdir)
+        self.assertEqual(len(store.query_context("Evora", top_k=100)), 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,226 @@
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_embeddings
+import rag_store
+
+DIA = 86400
+
+
+@unittest.skipUnless(rag_store._HAS_RAG_BACKEND, "Backend de embeddings configurado indisponível")
+class TestRagChroma(unittest.TestCase):
+    """Backend Chroma com um embedder sintético do LlamaIndex (sem descarregar modelos)."""
+
+    TEXTO = "Pedido de cotação: 2 paletes de fruta refrigerada de Lisboa para o Porto, 800 kg, entrega amanhã"
+
+    def setUp(self):
+        pytest.importorskip("chromadb")
+        pytest.importorskip("llama_index.vector_stores.chroma")
+        from llama_index.core.embeddings import MockEmbedding
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(rag_store, "obter_embedder", return_value=MockEmbedding(embed_dim=16)),
+            patch.object(rag_store, "RAG_DEDUP_ENABLED", True),
+        ]
+        for p in self.patches:
+            p.start()
+        self.store = rag_store.RagStore(persist_path=self.tmpdir)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_validacao_igual_nos_dois_caminhos(self):
+        for texto, metadata in (("", {}), ("   ", {}), (None, {}), ("Pedido", None)):
+            with self.assertRaises(ValueError):
+                self.store.add_document(texto, metadata)
+            with self.assertRaises(ValueError):
+                self.store.add_documents([(texto, metadata)])
+
+    def test_item_invalido_num_lote_posterior_nao_ingere_nada(self):
+        itens = [(f"Pedido {i} para Faro", {"id": f"faro{i}"}) for i in range(3)] + [("", {})]
+        with self.assertRaises(ValueError):
+            self.store.add_documents(itens, batch_size=2)
+        self.assertEqual(self.store._chroma_collection.count(), 0)
+
+    def test_duplicado_renova_o_documento_existente(self):
+        antigo = time.time() - 400 * DIA
+        self.store.add_documents([(self.TEXTO, {"id": "repetido", "ingerido_em": antigo})])
+        self.assertEqual(self.store.add_document(self.TEXTO + ".", {"id": "novo"}), "repetido")
+        self.assertEqual(self.store.ingest_stats(), {"ingeridos": 1, "duplicados": 1})
+
+        metadados = self.store._chroma_collection.get(include=["metadatas"])["metadatas"]
+        self.assertTrue(all(m["ingerido_em"] > time.time() - DIA for m in metadados))
+        self.assertEqual(self.store.apply_retention(max_docs=0, max_age_days=365)["removidos_idade"], 0)
+
+    def test_compactar_fecha_o_cliente_antes_do_vacuum(self):
+        self.store.add_documents([(f"Pedido {i} para Faro", {"id": f"faro{i}"}) for i in range(3)])
+        self.store.apply_retention(max_docs=1, max_age_days=0)
+        with patch.object(rag_store, "_default_store", self.store):
+            self.assertTrue(rag_store.compact_storage())
+            self.assertIsNone(rag_store._default_store)
+        # A base de dados continua utilizável por um cliente novo
+        self.assertEqual(rag_store.RagStore(persist_path=self.tmpdir)._chroma_collection.count(), 1)
+
+
+class MetadataMode:
+    EMBED = "embed"
+    LLM = "llm"
+
+
+class DocumentFalso:
+    """Document/node do LlamaIndex reduzido ao que o RagStore usa."""
+
+    def __init__(self, text, metadata, doc_id, excluded_embed_metadata_keys=None, excluded_llm_metadata_keys=None):
+        self.text = text
+        self.metadata = metadata
+        self.doc_id = doc_id
+        self.excluded_embed_metadata_keys = excluded_embed_metadata_keys or []
+        self.excluded_llm_metadata_keys = excluded_llm_metadata_keys or []
+        self.embedding = None
+
+    def get_content(self, metadata_mode):
+        assert metadata_mode == MetadataMode.EMBED
+        cabecalho = "\n".join(
+            f"{k}: {v}" for k, v in self.metadata.items() if k not in self.excluded_embed_metadata_keys
+        )
+        return f"{cabecalho}\n\n{self.text}"
+
+
+def dividir_em_frases(docs, transformations):
+    """Node parser falso: um node por frase, como um chunking que o caminho do lote tem de respeitar."""
+    assert transformations == ["node_parser"]
+    return [
+        DocumentFalso(
+            frase.strip(), doc.metadata, doc.doc_id,
+            doc.excluded_embed_metadata_keys, doc.excluded_llm_metadata_keys,
+        )
+        for doc in docs for frase in doc.text.split(".") if frase.strip()
+    ]
+
+
+def carregar_rag_store_chroma():
+    """Carrega uma cópia de rag_store com ChromaDB/LlamaIndex substituídos por stubs."""
+    core = types.SimpleNamespace(
+        VectorStoreIndex=MagicMock(), StorageContext=MagicMock(), Document=DocumentFalso,
+        Settings=types.SimpleNamespace(transformations=["node_parser"]),
+    )
+    modulos = {
+        "chromadb": MagicMock(),
+        "chromadb.config": MagicMock(),
+        "llama_index": MagicMock(),
+        "llama_index.core": core,
+        "llama_index.core.ingestion": types.SimpleNamespace(run_transformations=dividir_em_frases),
+        "llama_index.core.schema": types.SimpleNamespace(MetadataMode=MetadataMode, QueryBundle=MagicMock()),
+        "llama_index.vector_stores": MagicMock(),
+        "llama_index.vector_stores.chroma": MagicMock(),
+    }
+    spec = importlib.util.spec_from_file_location("rag_store_chroma", rag_store.__file__)
+    modulo = importlib.util.module_from_spec(spec)
+    with patch.dict(sys.modules, modulos), patch.object(rag_embeddings, "verificar_dependencias"):
+        spec.loader.exec_module(modulo)
+    return modulo
+
+
+class TestRagChromaComStubs(unittest.TestCase):
+    """Caminho Chroma sem chromadb instalado: o que chega ao embedder e ao vector store."""
+
+    def setUp(self):
+        self.modulo = carregar_rag_store_chroma()
+        self.assertTrue(self.modulo._HAS_RAG_BACKEND)
+        self.embedder = MagicMock()
+        self.embedder.get_text_embedding_batch.side_effect = lambda textos: [[float(len(t))] for t in textos]
+        self.tmpdir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(self.modulo, "obter_embedder", return_value=self.embedder),
+            patch.object(self.modulo, "RAG_DEDUP_ENABLED", False),
+        ]
+        for p in self.patches:
+            p.start()
+        self.store = self.modulo.RagStore(persist_path=self.tmpdir)
+        self.vector_store = self.store._vector_store
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def escritos(self):
+        return [node for chamada in self.vector_store.add.call_args_list for node in chamada.args[0]]
+
+    def test_documento_isolado_e_lote_geram_os_mesmos_nodes(self):
+        metadata = {"destino": "porto", "ingerido_em": 1.0}
+        texto = "Pedido de transporte. Duas paletes para o Porto"
+        self.store.add_document(texto, dict(metadata, id="isolado"))
+        self.store.add_documents([(texto, dict(metadata, id="lote"))])
+
+        isolado = [n for n in self.escritos() if n.doc_id == "isolado"]
+        lote = [n for n in self.escritos() if n.doc_id == "lote"]
+        # Os dois caminhos passam pelo node parser do índice (dois chunks cada)
+        self.assertEqual([n.text for n in isolado], ["Pedido de transporte", "Duas paletes para o Porto"])
+        self.assertEqual([n.text for n in lote], [n.text for n in isolado])
+        # E embutem o conteúdo de MetadataMode.EMBED, não o texto cru
+        embutidos = [t for chamada in self.embedder.get_text_embedding_batch.call_args_list for t in chamada.args[0]]
+        self.assertEqual(embutidos, [n.get_content(MetadataMode.EMBED) for n in isolado + lote])
+        self.assertFalse(any("ingerido_em" in t for t in embutidos))
+        self.assertTrue(all(n.embedding is not None for n in isolado + lote))
+        self.store._index.insert.assert_not_called()
+
+    def test_metadados_internos_fora_do_embedding_e_do_llm(self):
+        with patch.object(self.modulo, "RAG_DEDUP_ENABLED", True):
+            self.store._chroma_collection.get.return_value = {"ids": [], "metadatas": []}
+            self.store.add_document("Pedido de transporte para Braga", {"id": "braga", "destino": "braga"})
+
+        [node] = self.escritos()
+        internos = ["simhash"] + [f"simhash_b{i}" for i in range(8)] + ["ingerido_em", "ultimo_acesso"]
+        # Continuam nos metadados (dedup e retenção leem-nos do Chroma)...
+        self.assertTrue(set(internos) <= set(node.metadata))
+        # ...mas não entram no texto embutido nem no contexto do LLM
+        self.assertEqual(sorted(node.excluded_embed_metadata_keys), sorted(internos))
+        self.assertEqual(sorted(node.excluded_llm_metadata_keys), sorted(internos))
+        [[texto]] = [c.args[0] for c in self.embedder.get_text_embedding_batch.call_args_list]
+        self.assertEqual(texto, "id: braga\ndestino: braga\n\nPedido de transporte para Braga")
+
+    def test_vacuum_so_depois_de_fechar_o_cliente(self):
+        cliente = self.store._chroma_client
+        sqlite3 = MagicMock()
+
+        def ligar(*args, **kwargs):
+            cliente.close.assert_called_once_with()
+            return sqlite3.connect.return_value
+
+        sqlite3.connect.side_effect = ligar
+        with patch.object(self.modulo, "_default_store", self.store), patch.object(self.modulo, "sqlite3", sqlite3):
+            self.assertTrue(self.modulo.compact_storage())
+            self.assertIsNone(self.modulo._default_store)
+        sqlite3.connect.return_value.execute.assert_called_once_with("VACUUM")
+
+    def test_falha_no_vacuum_propaga(self):
+        with open(os.path.join(self.tmpdir, "chroma.sqlite3"), "wb") as f:
+            f.write(b"isto nao e uma base de dados sqlite" * 100)
+        with patch.object(self.modulo, "_default_store", self.store):
+            with self.assertRaises(self.modulo.sqlite3.DatabaseError):
+                self.modulo.compact_storage()
+
+    def test_lotes_de_escrita(self):
+        itens = [(f"Pedido {i} para Faro", {"id": f"faro{i}"}) for i in range(5)]
+        self.assertEqual(self.store.add_documents(itens, batch_size=2), [f"faro{i}" for i in range(5)])
+        self.assertEqual([len(c.args[0]) for c in self.vector_store.add.call_args_list], [2, 2, 1])
+        self.assertEqual(self.store.ingest_stats(), {"ingeridos": 5, "duplicados": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
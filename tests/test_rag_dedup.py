@@ -0,0 +1,68 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_store
+from rag_store import simhash, _distancia_hamming
+
+PEDIDO = (
+    "Bom dia, Solicito cotação para transporte de 2 paletes, 800 kg, 3 m3, de Lisboa para o Porto, "
+    "carga refrigerada. Recolha amanhã de manhã. Obrigado, João Silva, Frutas do Oeste Lda"
+)
+PEDIDO_DO_DIA_SEGUINTE = PEDIDO.replace("800 kg", "850 kg").replace("Bom dia, ", "Bom dia,\n\n")
+OUTRO_PEDIDO = (
+    "Boa tarde, precisamos de um camião para levar 20 toneladas de cimento de Leiria para Faro "
+    "na próxima semana. Cumprimentos, Ana"
+)
+
+
+class TestSimHash(unittest.TestCase):
+
+    def test_textos_quase_iguais_ficam_proximos(self):
+        self.assertEqual(simhash(PEDIDO), simhash(PEDIDO.upper()))
+        self.assertLessEqual(_distancia_hamming(simhash(PEDIDO), simhash(PEDIDO_DO_DIA_SEGUINTE)), 6)
+        self.assertGreater(_distancia_hamming(simhash(PEDIDO), simhash(OUTRO_PEDIDO)), 15)
+
+
+@unittest.skipIf(rag_store._HAS_RAG_BACKEND, "Testa apenas o fallback sem ChromaDB/LlamaIndex")
+class TestDedupNaIngestao(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_quase_duplicado_nao_e_ingerido(self):
+        store = rag_store.RagStore(persist_path=self.tmpdir)
+        original = store.add_document(PEDIDO, {"destino": "porto"})
+        self.assertEqual(store.add_document(PEDIDO_DO_DIA_SEGUINTE, {"destino": "porto"}), original)
+        store.add_document(OUTRO_PEDIDO, {"destino": "faro"})
+
+        self.assertEqual(store.ingest_stats(), {"ingeridos": 2, "duplicados": 1})
+        self.assertEqual(len(store.query_context("transporte para", top_k=10)), 2)
+
+    def test_duplicados_no_mesmo_lote_e_entre_processos(self):
+        ids = rag_store.RagStore(persist_path=self.tmpdir).add_documents(
+            [(PEDIDO, {"id": "a"}), (PEDIDO_DO_DIA_SEGUINTE, {"id": "b"}), (OUTRO_PEDIDO, {"id": "c"})]
+        )
+        self.assertEqual(ids, ["a", "a", "c"])
+
+        # Outro worker (e depois de uma compactação) continua a reconhecer o original
+        outro = rag_store.RagStore(persist_path=self.tmpdir)
+        outro.compactar()
+        self.assertEqual(outro.add_document(PEDIDO_DO_DIA_SEGUINTE, {"id": "d"}), "a")
+        self.assertEqual(outro.ingest_stats()["duplicados"], 1)
+
+    def test_metadados_originais_nao_sao_alterados(self):
+        metadata = {"destino": "porto"}
+        rag_store.RagStore(persist_path=None).add_document(PEDIDO, metadata)
+        self.assertEqual(metadata, {"destino": "porto"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_embeddings
+import rag_store
+from rag_embeddings import OnnxEncoder, mean_pooling, normalizar_l2
+
+try:
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+    import onnxruntime  # noqa: F401
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    _HAS_ONNX = True
+except ImportError:
+    _HAS_ONNX = False
+
+VOCAB = ["[PAD]", "[UNK]", "transporte", "carga", "para", "porto", "lisboa", "frio", "paletes", "kg"]
+DIM = 16
+
+
+class TestPooling(unittest.TestCase):
+
+    def test_mean_pooling_ignora_padding(self):
+        tokens = np.array([[[1.0, 2.0], [3.0, 4.0], [100.0, 100.0]]])
+        mascara = np.array([[1, 1, 0]])
+        np.testing.assert_allclose(mean_pooling(tokens, mascara), [[2.0, 3.0]])
+
+    def test_normalizar_l2(self):
+        vetores = normalizar_l2(np.array([[3.0, 4.0], [0.0, 0.0]]))
+        np.testing.assert_allclose(vetores, [[0.6, 0.8], [0.0, 0.0]])
+
+    def test_backend_desconhecido(self):
+        with self.assertRaises(ValueError):
+            rag_embeddings.verificar_dependencias("tensorflow")
+
+    def test_modelo_onnx_inexistente(self):
+        with patch.dict(os.environ, {"RAG_ONNX_MODEL_PATH": "/nao/existe/model.onnx"}):
+            with self.assertRaises(FileNotFoundError):
+                rag_embeddings.verificar_dependencias("onnx")
+
+    def test_onnx_indisponivel_e_registado_como_erro(self):
+        with patch.object(rag_store, "RAG_EMBED_BACKEND", "onnx"), \
+                patch.object(rag_store, "verificar_dependencias", side_effect=ImportError("No module named 'onnxruntime'")):
+            with self.assertLogs(level="ERROR") as registos:
+                self.assertFalse(rag_store._backend_embeddings_disponivel())
+        self.assertIn("onnxruntime", registos.output[0])
+
+    def test_backend_padrao_indisponivel_e_aviso(self):
+        with patch.object(rag_store, "RAG_EMBED_BACKEND", "huggingface"), \
+                patch.object(rag_store, "verificar_dependencias", side_effect=ImportError("huggingface")):
+            with self.assertLogs(level="WARNING") as registos:
+                self.assertFalse(rag_store._backend_embeddings_disponivel())
+        self.assertTrue(registos.output[0].startswith("WARNING"))
+
+
+@unittest.skipUnless(_HAS_ONNX, "onnx/onnxruntime/tokenizers não instalados")
+class TestOnnxEncoder(unittest.TestCase):
+    """Modelo sintético (embedding + projeção) para validar tokenização, pooling e int8."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.tabela = rng.normal(size=(len(VOCAB), DIM)).astype(np.float32)
+        self.projecao = rng.normal(size=(DIM, DIM)).astype(np.float32)
+
+        grafo = helper.make_graph(
+            [
+                helper.make_node("Gather", ["tabela", "input_ids"], ["tokens"]),
+                helper.make_node("MatMul", ["tokens", "projecao"], ["last_hidden_state"]),
+            ],
+            "modelo_teste",
+            [
+                helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["lote", "seq"]),
+                helper.make_tensor_value_info("attention_mask", TensorProto.INT64, ["lote", "seq"]),
+            ],
+            [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, ["lote", "seq", DIM])],
+            initializer=[
+                numpy_helper.from_array(self.tabela, "tabela"),
+                numpy_helper.from_array(self.projecao, "projecao"),
+            ],
+        )
+        modelo = helper.make_model(grafo, opset_imports=[helper.make_opsetid("", 13)])
+        modelo.ir_version = 8
+        self.modelo_path = os.path.join(self.tmpdir, "model.onnx")
+        onnx.save(modelo, self.modelo_path)
+
+        tokenizer = Tokenizer(models.WordLevel({t: i for i, t in enumerate(VOCAB)}, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+        self.tokenizer_path = os.path.join(self.tmpdir, "tokenizer.json")
+        tokenizer.save(self.tokenizer_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _referencia(self, texto):
+        ids = [VOCAB.index(t) if t in VOCAB else 1 for t in texto.split()]
+        vetor = (self.tabela[ids] @ self.projecao).mean(axis=0)
+        return vetor / np.linalg.norm(vetor)
+
+    def _encoder(self, **kwargs):
+        return OnnxEncoder("teste", modelo_path=self.modelo_path, tokenizer_path=self.tokenizer_path, **kwargs)
+
+    def test_vetores_iguais_a_referencia_e_ordem_preservada(self):
+        textos = ["transporte para porto frio paletes kg", "carga", "lisboa para porto", "xpto frio"]
+        vetores = self._encoder().encode(textos, batch_size=2)
+        self.assertEqual(vetores.shape, (4, DIM))
+        for texto, vetor in zip(textos, vetores):
+            np.testing.assert_allclose(vetor, self._referencia(texto), atol=1e-5)
+
+    def test_truncagem(self):
+        vetor = self._encoder(max_length=2).encode(["transporte para porto frio"])[0]
+        np.testing.assert_allclose(vetor, self._referencia("transporte para"), atol=1e-5)
+
+    def test_encoder_criado_antes_de_fork_funciona_no_filho(self):
+        encoder = self._encoder()
+        esperado = encoder.encode(["carga para lisboa"])
+        contexto = multiprocessing.get_context("fork")
+        fila = contexto.Queue()
+        filho = contexto.Process(target=lambda: fila.put(encoder.encode(["carga para lisboa"])))
+        filho.start()
+        resultado = fila.get(timeout=30)
+        filho.join(timeout=30)
+        np.testing.assert_allclose(resultado, esperado, atol=1e-6)
+
+    def test_int8_compativel_com_fp32(self):
+        textos = ["transporte para porto frio", "carga lisboa paletes kg"]
+        fp32 = self._encoder().encode(textos)
+        with patch.object(rag_embeddings, "RAG_ONNX_CACHE_DIR", self.tmpdir):
+            int8 = self._encoder(quantizado=True)
+        cossenos = (fp32 * int8.encode(textos)).sum(axis=1)
+        self.assertTrue(np.all(cossenos > 0.99), cossenos)
+
+
+if __name__ == "__main__":
+    unittest.main()
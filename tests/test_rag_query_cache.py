@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_store import _CacheEmbeddings
+
+
+class TestCacheEmbeddings(unittest.TestCase):
+
+    def setUp(self):
+        self.calculados = []
+
+    def calcular(self, texto):
+        self.calculados.append(texto)
+        return [float(len(texto))]
+
+    def test_reutiliza_vetor_de_consultas_repetidas(self):
+        cache = _CacheEmbeddings(max_itens=10)
+        v1 = cache.obter("Transporte  para Porto\n", self.calcular)
+        v2 = cache.obter("Transporte para Porto", self.calcular)
+        self.assertEqual(v1, v2)
+        self.assertEqual(len(self.calculados), 1)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_despeja_o_menos_usado(self):
+        cache = _CacheEmbeddings(max_itens=2)
+        cache.obter("a", self.calcular)
+        cache.obter("b", self.calcular)
+        cache.obter("a", self.calcular)
+        cache.obter("c", self.calcular)  # despeja "b"
+        cache.obter("a", self.calcular)
+        cache.obter("b", self.calcular)
+        self.assertEqual(self.calculados, ["a", "b", "c", "b"])
+        self.assertEqual(cache.stats()["itens"], 2)
+
+    def test_tamanho_zero_desativa(self):
+        cache = _CacheEmbeddings(max_itens=0)
+        cache.obter("a", self.calcular)
+        cache.obter("a", self.calcular)
+        self.assertEqual(len(self.calculados), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_manutencao
+import rag_store
+from rag_store import _selecionar_para_remocao
+
+DIA = 86400
+
+
+class TestPoliticaRetencao(unittest.TestCase):
+
+    def setUp(self):
+        self.agora = 1_000 * DIA
+        self.itens = [
+            ("antigo", {"ingerido_em": self.agora - 400 * DIA, "ultimo_acesso": self.agora}),
+            ("a", {"ingerido_em": self.agora - 30 * DIA, "ultimo_acesso": self.agora - 1}),
+            ("b", {"ingerido_em": self.agora - 20 * DIA, "ultimo_acesso": self.agora - 20 * DIA}),
+            ("c", {"ingerido_em": self.agora - 10 * DIA, "ultimo_acesso": self.agora - 10 * DIA}),
+            ("sem_carimbo", {}),
+        ]
+
+    def test_idade_e_capacidade_por_antiguidade(self):
+        por_idade, por_capacidade = _selecionar_para_remocao(self.itens, 2, 365, False, self.agora)
+        self.assertEqual(por_idade, ["antigo"])
+        self.assertEqual(por_capacidade, ["sem_carimbo", "a"])
+
+    def test_capacidade_por_ultimo_acesso(self):
+        _, por_capacidade = _selecionar_para_remocao(self.itens, 2, 365, True, self.agora)
+        self.assertEqual(por_capacidade, ["sem_carimbo", "b"])
+
+    def test_sem_limites_nao_remove(self):
+        self.assertEqual(_selecionar_para_remocao(self.itens, 0, 0, True, self.agora), ([], []))
+
+
+@unittest.skipIf(rag_store._HAS_RAG_BACKEND, "Testa apenas o fallback sem ChromaDB/LlamaIndex")
+class TestRetencaoFallback(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(rag_store, "RAG_DEDUP_ENABLED", False),
+            patch.object(rag_store, "RAG_ACCESS_UPDATE_SECONDS", 0),
+        ]
+        for p in self.patches:
+            p.start()
+        agora = time.time()
+        self.store = rag_store.RagStore(persist_path=self.tmpdir)
+        self.store.add_documents([
+            ("Cotação de 2023 para Porto", {"id": "velho", "ingerido_em": agora - 400 * DIA}),
+            ("Pedido para Lisboa, carga fria", {"id": "lisboa", "ingerido_em": agora - 30 * DIA}),
+            ("Pedido para Faro, carga ambiente", {"id": "faro", "ingerido_em": agora - 20 * DIA}),
+            ("Pedido para Braga, paletes", {"id": "braga", "ingerido_em": agora - 10 * DIA}),
+        ])
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def ids(self, store):
+        return {r["metadata"]["id"] for r in store.query_context("pedido cotação para", top_k=10)}
+
+    def test_remove_por_idade_e_capacidade_lru(self):
+        outro_worker = rag_store.RagStore(persist_path=self.tmpdir)
+        # Lisboa é o mais antigo dos restantes, mas foi devolvido recentemente
+        self.store.query_context("Lisboa fria", top_k=1)
+
+        resumo = self.store.apply_retention(max_docs=2, max_age_days=365, lru=True)
+        self.assertEqual(resumo, {"removidos_idade": 1, "removidos_capacidade": 1, "restantes": 2})
+        self.assertEqual(self.ids(self.store), {"lisboa", "braga"})
+        # Outro worker passa a ver o log reescrito e continua a poder escrever
+        self.assertEqual(self.ids(outro_worker), {"lisboa", "braga"})
+        outro_worker.add_document("Pedido para Evora", {"id": "evora"})
+        self.assertEqual(self.ids(self.store), {"lisboa", "braga", "evora"})
+        self.assertEqual(
+            sorted(n for n in os.listdir(os.path.join(self.tmpdir, "fallback")) if n.endswith(".jsonl")),
+            ["acessos.jsonl", "docs-1.jsonl", "docs.jsonl"],
+        )
+
+    def test_capacidade_por_antiguidade_e_sem_remocoes(self):
+        self.store.query_context("Lisboa fria", top_k=1)
+        self.assertEqual(self.store.apply_retention(max_docs=3, max_age_days=0, lru=False)["restantes"], 3)
+        self.assertEqual(self.ids(self.store), {"lisboa", "faro", "braga"})
+
+        resumo = self.store.apply_retention(max_docs=0, max_age_days=0)
+        self.assertEqual(resumo, {"removidos_idade": 0, "removidos_capacidade": 0, "restantes": 3})
+
+    def test_remover_tudo(self):
+        self.store.apply_retention(max_docs=0, max_age_days=1)
+        self.assertEqual(self.store.query_context("Braga", top_k=3), [])
+        self.store.add_document("Pedido novo para Braga", {"id": "novo"})
+        self.assertEqual(self.ids(rag_store.RagStore(persist_path=self.tmpdir)), {"novo"})
+
+    def test_em_memoria(self):
+        store = rag_store.RagStore(persist_path=None)
+        store.add_documents([("Pedido A para Porto", {"id": "a"}), ("Pedido B para Porto", {"id": "b"})])
+        store.apply_retention(max_docs=1)
+        self.assertEqual([r["metadata"]["id"] for r in store.query_context("Porto")], ["b"])
+
+
+@unittest.skipIf(rag_store._HAS_RAG_BACKEND, "Testa apenas o fallback sem ChromaDB/LlamaIndex")
+class TestDuplicadoRenovaFallback(unittest.TestCase):
+    """Um quase-duplicado suprimido renova `ingerido_em` e `ultimo_acesso` do documento existente."""
+
+    TEXTO = "Pedido de cotação: 2 paletes de fruta refrigerada de Lisboa para o Porto, 800 kg, entrega amanhã"
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patch = patch.object(rag_store, "RAG_DEDUP_ENABLED", True)
+        self.patch.start()
+        agora = time.time()
+        self.antigos = [
+            (self.TEXTO, {"id": "repetido", "ingerido_em": agora - 400 * DIA}),
+            ("Transporte de paletes para Faro em carga ambiente", {"id": "faro", "ingerido_em": agora - 10 * DIA}),
+        ]
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_duplicado_sobrevive_a_retencao_por_idade(self):
+        self.store = rag_store.RagStore(persist_path=self.tmpdir)
+        self.store.add_documents(self.antigos)
+        # O mesmo pedido volta a chegar, com uma pontuação diferente: não é ingerido de novo
+        self.assertEqual(self.store.add_document(self.TEXTO + ".", {"id": "novo"}), "repetido")
+
+        # A retenção corre noutro worker, que só conhece a renovação pelo acessos.jsonl
+        outro_worker = rag_store.RagStore(persist_path=self.tmpdir)
+        resumo = outro_worker.apply_retention(max_docs=0, max_age_days=365)
+        self.assertEqual(resumo, {"removidos_idade": 0, "removidos_capacidade": 0, "restantes": 2})
+
+        # Com capacidade para um só, sai o que não voltou a ser visto
+        resumo = outro_worker.apply_retention(max_docs=1, max_age_days=365, lru=False)
+        self.assertEqual(resumo["removidos_capacidade"], 1)
+        restantes = outro_worker.query_context("paletes Porto Faro", top_k=5)
+        self.assertEqual([r["metadata"]["id"] for r in restantes], ["repetido"])
+        self.assertGreater(restantes[0]["metadata"]["ingerido_em"], time.time() - DIA)
+
+    def test_em_memoria(self):
+        store = rag_store.RagStore(persist_path=None)
+        store.add_documents(self.antigos)
+        store.add_document(self.TEXTO, {"id": "novo"})
+        self.assertEqual(store.apply_retention(max_docs=0, max_age_days=365)["removidos_idade"], 0)
+        self.assertEqual(store.ingest_stats(), {"ingeridos": 2, "duplicados": 1})
+
+    def test_sem_duplicado_o_antigo_expira(self):
+        store = rag_store.RagStore(persist_path=self.tmpdir)
+        store.add_documents(self.antigos)
+        self.assertEqual(store.apply_retention(max_docs=0, max_age_days=365)["removidos_idade"], 1)
+
+
+class TestManutencao(unittest.TestCase):
+    """rag_manutencao.executar: compacta só quando removeu algo e não esconde falhas do VACUUM."""
+
+    def executar(self, resumo, compactar):
+        with patch.object(rag_manutencao, "apply_retention", return_value=resumo), \
+                patch.object(rag_manutencao, "compact_storage", side_effect=compactar) as compact_storage:
+            return rag_manutencao.executar(), compact_storage
+
+    def test_compacta_depois_de_remover(self):
+        resumo, compact_storage = self.executar(
+            {"removidos_idade": 1, "removidos_capacidade": 0, "restantes": 3}, [True]
+        )
+        compact_storage.assert_called_once_with()
+        self.assertTrue(resumo["compactado"])
+
+    def test_sem_remocoes_nao_compacta(self):
+        resumo, compact_storage = self.executar(
+            {"removidos_idade": 0, "removidos_capacidade": 0, "restantes": 3}, [True]
+        )
+        compact_storage.assert_not_called()
+        self.assertFalse(resumo["compactado"])
+
+    def test_falha_no_vacuum_propaga(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            self.executar(
+                {"removidos_idade": 0, "removidos_capacidade": 2, "restantes": 0},
+                sqlite3.OperationalError("database is locked"),
+            )
+
+    @unittest.skipIf(rag_store._HAS_RAG_BACKEND, "Testa apenas o fallback sem ChromaDB/LlamaIndex")
+    def test_fallback_nao_tem_sqlite_para_compactar(self):
+        with patch.object(rag_store, "_default_store", rag_store.RagStore(persist_path=None)):
+            self.assertFalse(rag_store.compact_storage())
+            self.assertIsNotNone(rag_store._default_store)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_store
+
+
+class StoreLento:
+    instancias = 0
+
+    def __init__(self):
+        StoreLento.instancias += 1
+        time.sleep(0.05)
+        self.aquecido = False
+
+    def warm_up(self):
+        self.aquecido = True
+
+    def query_context(self, query_text, top_k=3):
+        return [{"text": query_text, "metadata": {}, "score": 1.0}]
+
+
+class TestRagWarmUp(unittest.TestCase):
+
+    def setUp(self):
+        StoreLento.instancias = 0
+        self.patches = [
+            patch.object(rag_store, "RagStore", StoreLento),
+            patch.object(rag_store, "_default_store", None),
+            patch.object(rag_store, "_primeira_consulta_pendente", True),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_warm_up_em_segundo_plano_carrega_uma_so_vez(self):
+        thread = rag_store.warm_up(background=True)
+        self.assertIsInstance(thread, threading.Thread)
+        # Uma consulta concorrente espera pelo warm-up em vez de criar outro store
+        self.assertEqual(len(rag_store.retrieve_similar("Porto", top_k=1)), 1)
+        thread.join(timeout=2)
+        self.assertEqual(StoreLento.instancias, 1)
+        self.assertTrue(rag_store.get_default_store().aquecido)
+
+    def test_regista_cold_start_e_primeira_consulta(self):
+        with self.assertLogs(level="INFO") as logs:
+            self.assertIsNone(rag_store.warm_up())
+            rag_store.query_context("Porto")
+            rag_store.query_context("Lisboa")
+        mensagens = "\n".join(logs.output)
+        self.assertIn("cold start", mensagens)
+        self.assertIn("Warm-up do RAG concluído", mensagens)
+        self.assertEqual(mensagens.count("Primeira consulta RAG"), 1)
+
+    def test_falha_no_warm_up_nao_propaga(self):
+        with patch.object(StoreLento, "warm_up", side_effect=RuntimeError("sem modelo")):
+            with self.assertLogs(level="WARNING"):
+                rag_store.warm_up()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import datetime
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rag_store
+import worker
+from rq import SimpleWorker
+
+
+class TestPreaquecer(unittest.TestCase):
+
+    def setUp(self):
+        self.ambiente = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.ambiente)
+
+    def test_antes_de_fork_carrega_so_o_seguro_e_congela_gc(self):
+        with patch.object(rag_store, "warm_up_before_fork") as antes_fork, \
+                patch.object(rag_store, "warm_up") as completo, \
+                patch.object(worker.gc, "freeze") as freeze:
+            tempos = worker.preaquecer(antes_de_fork=True)
+        antes_fork.assert_called_once()
+        completo.assert_not_called()
+        freeze.assert_called_once()
+        self.assertEqual(set(tempos), {"imports", "rag"})
+        self.assertIn("tasks", sys.modules)
+        # O warm-up em thread do agent.py criaria estado não seguro para fork no pai
+        self.assertEqual(os.environ["RAG_WARMUP"], "false")
+
+    def test_modo_simples_aquece_tudo_sem_congelar(self):
+        with patch.object(rag_store, "warm_up") as completo, patch.object(worker.gc, "freeze") as freeze:
+            worker.preaquecer(antes_de_fork=False)
+        completo.assert_called_once()
+        freeze.assert_not_called()
+
+
+class TestWorkerSimples(unittest.TestCase):
+
+    def setUp(self):
+        # Sem Redis: o construtor não é necessário para testar execute_job
+        self.worker = worker.WorkerSimplesPreaquecido.__new__(worker.WorkerSimplesPreaquecido)
+
+    def test_isola_ambiente_e_diretorio_entre_jobs(self):
+        diretorio = os.getcwd()
+
+        def job_que_suja_o_processo(self, job, queue):
+            os.environ["VARIAVEL_DO_JOB"] = "1"
+            os.chdir("/")
+
+        with patch.object(SimpleWorker, "execute_job", job_que_suja_o_processo), \
+                patch.object(worker.WorkerSimplesPreaquecido, "_registar_overhead"):
+            self.worker.execute_job(MagicMock(), MagicMock())
+        self.assertNotIn("VARIAVEL_DO_JOB", os.environ)
+        self.assertEqual(os.getcwd(), diretorio)
+
+    def test_regista_overhead_por_job(self):
+        inicio = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        job = MagicMock(id="j1", started_at=inicio, ended_at=inicio + datetime.timedelta(seconds=0.1))
+        with self.assertLogs(level="INFO") as logs:
+            self.worker._registar_overhead(job, 0.5)
+            self.worker._registar_overhead(job, 0.3)
+        self.assertIn("overhead 0.400s", logs.output[0])
+        self.assertIn("média 0.300s em 2 jobs", logs.output[1])
+
+    def test_job_sem_tempos_nao_e_contabilizado(self):
+        job = MagicMock(started_at=None, ended_at=None)
+        self.worker._registar_overhead(job, 0.5)
+        self.assertEqual(getattr(self.worker, "_jobs_medidos", 0), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+Worker RQ pré-aquecido.
+
+Com `rq worker`, cada job corre num processo filho (work-horse) que importa `tasks` →
+`agent`/`cotador` do zero. Isso inclui ler a tabela de preços com pandas, construir o
+`cotador_global` e, na primeira consulta RAG, carregar o modelo de embeddings e abrir o
+Chroma. Este custo fixo repete-se em todos os jobs e é maior do que a própria pesquisa na
+tabela. Aqui esse trabalho é feito uma só vez, antes do primeiro job:
+
+- modo "fork" (padrão, `WorkerPreaquecido`): o processo pai importa `tasks` e carrega os
+  pesos do modelo de embeddings (`rag_store.warm_up_before_fork`). Depois congela os
+  objetos do arranque (`gc.freeze`) e só então faz fork de um filho por job. Os filhos
+  herdam o estado por copy-on-write, e o isolamento entre jobs continua a ser o de
+  processos separados. O cliente Chroma e a sessão ONNX não sobrevivem a um fork, por
+  isso continuam a ser criados em cada filho.
+- modo "simples" (`WorkerSimplesPreaquecido`): sem fork. Todo o estado fica quente
+  (incluindo o cliente Chroma) e os jobs correm no próprio processo. Entre jobs, o
+  ambiente (`os.environ`) e o diretório de trabalho são repostos. Com `--max-jobs` o
+  processo termina ao fim de N jobs para ser reiniciado pelo supervisor.
+
+Em ambos os modos, cada job regista o seu overhead: o tempo total no worker menos o
+tempo de execução do job.
+
+Uso:
+    python3 worker.py [filas ...] [--modo fork|simples] [--max-jobs N] [--burst]
+    python3 worker.py extracao --modo simples   # p.ex. um pool só para a etapa do LLM
+ou, com o CLI do RQ:
+    rq worker -w worker.WorkerPreaquecido
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import time
+from typing import Dict
+
+from rq import Queue, SimpleWorker, Worker
+
+from logger_config import logger
+from metricas import observar, publicar
+from redis_client import get_redis
+
+RQ_WORKER_MODO = os.getenv("RQ_WORKER_MODO", "fork").lower()
+RQ_WORKER_MAX_JOBS = int(os.getenv("RQ_WORKER_MAX_JOBS", 0))
+# As filas de `tasks.CONFIG_ETAPAS` (lidas do ambiente para não importar `tasks` antes do
+# pré-aquecimento) e a fila por omissão. O envio vem primeiro, para concluir os e-mails já em curso
+FILAS_PADRAO = [
+    os.getenv(f"PIPELINE_{etapa.upper()}_FILA", etapa) for etapa in ("envio", "cotacao", "extracao", "ingestao")
+] + ["default"]
+
+
+def preaquecer(antes_de_fork: bool = True) -> Dict[str, float]:
+    """Importa as tarefas (tabela de preços, cotador, prompts) e carrega o RAG; devolve os tempos."""
+    # O warm-up em segundo plano do agent.py criaria o cliente Chroma numa thread do pai,
+    # que não sobrevive ao fork: aqui o warm-up é feito de forma explícita e síncrona
+    os.environ["RAG_WARMUP"] = "false"
+    tempos = {}
+
+    inicio = time.perf_counter()
+    import tasks  # noqa: F401  (agent → destinos válidos, cache LLM; cotador → cotador_global)
+    tempos["imports"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    try:
+        import rag_store
+
+        if antes_de_fork:
+            rag_store.warm_up_before_fork()
+        else:
+            rag_store.warm_up()
+    except Exception as e:
+        logger.warning(f"RAG indisponível no pré-aquecimento do worker: {e}")
+    tempos["rag"] = time.perf_counter() - inicio
+
+    if antes_de_fork:
+        # Os objetos do arranque passam para a geração permanente do GC: as recolhas nos
+        # filhos deixam de os percorrer (e de sujar as páginas partilhadas por copy-on-write)
+        gc.collect()
+        gc.freeze()
+
+    logger.info(
+        "Worker pré-aquecido: "
+        + ", ".join(f"{nome} {segundos:.2f}s" for nome, segundos in tempos.items())
+    )
+    return tempos
+
+
+class _RelatorioOverhead:
+    """Regista, por job, o tempo total no worker face ao tempo de execução do próprio job."""
+
+    _pre_aquecer_antes_de_fork = True
+
+    def work(self, *args, **kwargs):
+        preaquecer(self._pre_aquecer_antes_de_fork)
+        self._jobs_medidos = 0
+        self._overhead_total = 0.0
+        return super().work(*args, **kwargs)
+
+    def execute_job(self, job, queue):
+        inicio = time.perf_counter()
+        try:
+            return super().execute_job(job, queue)
+        finally:
+            self._registar_overhead(job, time.perf_counter() - inicio)
+
+    def _registar_overhead(self, job, total: float) -> None:
+        try:
+            # Num worker com fork, os tempos do job foram gravados no Redis pelo filho
+            job.refresh()
+        except Exception:
+            return
+        if not (job.started_at and job.ended_at):
+            return
+        execucao = (job.ended_at - job.started_at).total_seconds()
+        overhead = max(total - execucao, 0.0)
+        self._jobs_medidos = getattr(self, "_jobs_medidos", 0) + 1
+        self._overhead_total = getattr(self, "_overhead_total", 0.0) + overhead
+        observar("cotacoes_worker_overhead_segundos", overhead, fila=job.origin)
+        publicar()
+        logger.info(
+            f"Job {job.id}: {total:.3f}s no worker, {execucao:.3f}s de execução, overhead {overhead:.3f}s "
+            f"(média {self._overhead_total / self._jobs_medidos:.3f}s em {self._jobs_medidos} jobs)"
+        )
+
+
+class WorkerPreaquecido(_RelatorioOverhead, Worker):
+    """Worker com fork por job, com o estado carregado no pai antes do fork."""
+
+
+class WorkerSimplesPreaquecido(_RelatorioOverhead, SimpleWorker):
+    """Worker sem fork: todo o estado fica quente e os jobs correm no próprio processo."""
+
+    _pre_aquecer_antes_de_fork = False
+
+    def execute_job(self, job, queue):
+        ambiente, diretorio = dict(os.environ), os.getcwd()
+        try:
+            return super().execute_job(job, queue)
+        finally:
+            # Isolamento explícito: alterações de um job ao ambiente do processo não passam ao seguinte
+            if os.environ != ambiente:
+                os.environ.clear()
+                os.environ.update(ambiente)
+            if os.getcwd() != diretorio:
+                os.chdir(diretorio)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker RQ com modelos e tabelas carregados uma só vez.")
+    parser.add_argument(
+        "filas", nargs="*", default=FILAS_PADRAO,
+        help=f"Filas a consumir, por prioridade (padrão: {' '.join(FILAS_PADRAO)}).",
+    )
+    parser.add_argument(
+        "--modo", choices=["fork", "simples"], default=RQ_WORKER_MODO,
+        help="fork: um processo filho por job, estado herdado do pai; simples: sem fork (padrão: RQ_WORKER_MODO).",
+    )
+    parser.add_argument(
+        "--max-jobs", type=int, default=RQ_WORKER_MAX_JOBS,
+        help="Termina ao fim de N jobs, para o supervisor reiniciar o processo (padrão: RQ_WORKER_MAX_JOBS; 0 = sem limite).",
+    )
+    parser.add_argument("--burst", action="store_true", help="Termina quando as filas ficarem vazias.")
+    args = parser.parse_args()
+
+    conexao = get_redis()
+    classe = WorkerPreaquecido if args.modo == "fork" else WorkerSimplesPreaquecido
+    worker = classe([Queue(nome, connection=conexao) for nome in args.filas], connection=conexao)
+    worker.work(burst=args.burst, max_jobs=args.max_jobs or None)